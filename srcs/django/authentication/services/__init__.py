@@ -6,6 +6,7 @@ from .gdpr_service import GDPRService
 from .password_service import PasswordService
 from .two_factor_service import TwoFactorService
 from .qr_service import QRService
+from .identity_cache import IdentityCache
 
 __all__ = [
     "AuthenticationService",
@@ -16,4 +17,5 @@ __all__ = [
     "PasswordService",
     "TwoFactorService",
     "QRService",
+    "IdentityCache",
 ]
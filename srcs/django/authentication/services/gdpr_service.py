@@ -1,5 +1,6 @@
 from django.core.exceptions import ValidationError
 from django.utils import timezone
+from .identity_cache import IdentityCache
 import logging
 
 
@@ -61,6 +62,7 @@ class GDPRService:
                 'deleted_at', 'fortytwo_id', 'pending_email', 
                 'pending_email_token', 'email_hash'
             ])
+            IdentityCache.invalidate(user.id)	# consumers must stop showing the old username
 
             return True
         except Exception as e:
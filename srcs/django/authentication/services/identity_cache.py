@@ -0,0 +1,220 @@
+from channels.db import database_sync_to_async
+from django.conf import settings
+from collections import OrderedDict
+from main.redis_connection import get_redis
+from ..models import CustomUser
+import threading
+import logging
+import redis
+import time
+
+# Process-wide cache of public user identity (id, username, avatar) for the WebSocket layer.
+
+# Game and chat consumers need the username of a user id on hot paths (connects, user lists,
+# messages). Entries are kept in an LRU bounded to MAX_SIZE users and expire after TTL seconds.
+
+# Invalidation:
+#    - ProfileService and GDPRService call IdentityCache.invalidate(user_id) after saving a user
+#    - The id is dropped locally and published on INVALIDATION_CHANNEL, so every other
+#      process holding a cache (daphne, celery workers...) drops it too
+#    - TTL bounds the staleness if an invalidation message is lost
+#    - One long-lived listener thread per process, it reconnects with backoff if Redis goes away.
+#      While it is disconnected invalidations can be missed, so entries only live DISCONNECTED_TTL
+#      seconds, and the cache is emptied once when the subscription is back
+
+logger = logging.getLogger(__name__)
+
+class IdentityCache:
+    MAX_SIZE = 10000	# users kept in memory
+    TTL = 300	# seconds an entry is trusted
+    DISCONNECTED_TTL = 5	# seconds an entry is trusted while the listener is not subscribed
+    RECONNECT_DELAY = 1	# first delay before the listener reconnects, doubled up to MAX_RECONNECT_DELAY
+    MAX_RECONNECT_DELAY = 30
+    INVALIDATION_CHANNEL = "identity:invalidate"
+
+    _entries = OrderedDict()	# {user_id: (expires_at, {"id", "username", "avatar"}), ...} least recent first
+    _usernames = {}	# {username: user_id, ...} for lookups by username
+    _lock = threading.Lock()	# sync callers run in database_sync_to_async threads
+    _listener = None
+    _subscribed = False	# True while the listener receives invalidations
+    _redis = None
+
+    @staticmethod
+    def _get_redis():
+        if IdentityCache._redis is None:
+            IdentityCache._redis = get_redis()
+        return IdentityCache._redis
+
+    @staticmethod
+    def _avatar(user):
+        """Avatar URL of a values() row, same priority as CustomUser.get_profile_image_url"""
+        if user["profile_image"]:
+            return f"{settings.MEDIA_URL}{user['profile_image']}"
+        if user["is_fortytwo_user"] and user["fortytwo_image"]:
+            return user["fortytwo_image"]
+        return None
+
+    @staticmethod
+    def _lookup(user_id):
+        """Return a fresh cached identity or None, marking it as recently used"""
+        with IdentityCache._lock:
+            entry = IdentityCache._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                IdentityCache._drop(user_id)
+                return None
+            IdentityCache._entries.move_to_end(user_id)
+            return dict(entry[1])
+
+    @staticmethod
+    def _store(identity):
+        with IdentityCache._lock:
+            IdentityCache._drop(identity["id"])
+            ttl = IdentityCache.TTL if IdentityCache._subscribed else IdentityCache.DISCONNECTED_TTL
+            IdentityCache._entries[identity["id"]] = (time.monotonic() + ttl, identity)
+            IdentityCache._usernames[identity["username"]] = identity["id"]
+            while len(IdentityCache._entries) > IdentityCache.MAX_SIZE:
+                IdentityCache._drop(next(iter(IdentityCache._entries)))
+
+    @staticmethod
+    def _drop(user_id):
+        """Remove an entry, the caller holds the lock"""
+        entry = IdentityCache._entries.pop(user_id, None)
+        if entry and IdentityCache._usernames.get(entry[1]["username"]) == user_id:
+            del IdentityCache._usernames[entry[1]["username"]]
+
+    @staticmethod
+    def _load(**filters):
+        """Load identities from the database and cache them"""
+        IdentityCache._ensure_listener()
+        rows = CustomUser.objects.filter(**filters).values(
+            "id", "username", "profile_image", "fortytwo_image", "is_fortytwo_user"
+        )
+        identities = []
+        for row in rows:
+            identity = {"id": row["id"], "username": row["username"], "avatar": IdentityCache._avatar(row)}
+            IdentityCache._store(identity)
+            identities.append(dict(identity))
+        return identities
+
+    @staticmethod
+    def get(user_id):
+        """Get {"id", "username", "avatar"} of a user, or None if it doesn't exist (sync)"""
+        if not user_id:
+            return None
+        identity = IdentityCache._lookup(user_id)
+        if identity is None:
+            identities = IdentityCache._load(id=user_id)
+            identity = identities[0] if identities else None
+        return identity
+
+    @staticmethod
+    def get_many(user_ids):
+        """Get the identities of several users with one query for the misses (sync)"""
+        found = {}
+        missing = []
+        for user_id in user_ids:
+            identity = IdentityCache._lookup(user_id)
+            if identity is None:
+                missing.append(user_id)
+            else:
+                found[user_id] = identity
+        if missing:
+            for identity in IdentityCache._load(id__in=missing):
+                found[identity["id"]] = identity
+        return found
+
+    @staticmethod
+    def get_by_username(username):
+        """Get the identity of a user by username (sync)"""
+        if not username:
+            return None
+        user_id = IdentityCache._usernames.get(username)
+        identity = IdentityCache._lookup(user_id) if user_id else None
+        if identity is None or identity["username"] != username:
+            identities = IdentityCache._load(username=username)
+            identity = identities[0] if identities else None
+        return identity
+
+    @staticmethod
+    async def aget(user_id):
+        """Async get, served from memory without a thread hop on hits"""
+        identity = IdentityCache._lookup(user_id) if user_id else None
+        if identity is None:
+            identity = await database_sync_to_async(IdentityCache.get)(user_id)
+        return identity
+
+    @staticmethod
+    async def aget_many(user_ids):
+        """Async get_many"""
+        found = {}
+        for user_id in user_ids:
+            identity = IdentityCache._lookup(user_id)
+            if identity is None:
+                return await database_sync_to_async(IdentityCache.get_many)(user_ids)
+            found[user_id] = identity
+        return found
+
+    @staticmethod
+    async def aget_by_username(username):
+        """Async get_by_username"""
+        return await database_sync_to_async(IdentityCache.get_by_username)(username)
+
+    @staticmethod
+    def invalidate(user_id):
+        """Forget a user in this process and in every other process listening"""
+        with IdentityCache._lock:
+            IdentityCache._drop(user_id)
+        try:
+            IdentityCache._get_redis().publish(IdentityCache.INVALIDATION_CHANNEL, str(user_id))
+        except redis.RedisError as e:
+            logger.warning(f"Could not publish identity invalidation for user {user_id}: {str(e)}")
+
+    @staticmethod
+    def _ensure_listener():
+        """Start the thread that applies invalidations published by other processes (once per process)"""
+        if IdentityCache._listener is not None and IdentityCache._listener.is_alive():
+            return
+        with IdentityCache._lock:
+            if IdentityCache._listener is not None and IdentityCache._listener.is_alive():
+                return
+            IdentityCache._listener = threading.Thread(
+                target=IdentityCache._listen, name="identity-cache-invalidation", daemon=True
+            )
+            IdentityCache._listener.start()
+
+    @staticmethod
+    def _listen():
+        """Listener thread body, never returns: subscribe, apply invalidations, reconnect on errors"""
+        delay = IdentityCache.RECONNECT_DELAY
+        while True:
+            pubsub = None
+            try:
+                pubsub = IdentityCache._get_redis().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(IdentityCache.INVALIDATION_CHANNEL)
+                # Invalidations may have been missed before the subscription, start from an empty cache
+                with IdentityCache._lock:
+                    IdentityCache._entries.clear()
+                    IdentityCache._usernames.clear()
+                    IdentityCache._subscribed = True
+                delay = IdentityCache.RECONNECT_DELAY
+                for message in pubsub.listen():
+                    try:
+                        user_id = int(message["data"])
+                    except (TypeError, ValueError):
+                        continue
+                    with IdentityCache._lock:
+                        IdentityCache._drop(user_id)
+            except Exception as e:
+                if IdentityCache._subscribed:
+                    logger.warning(f"Identity cache invalidation listener disconnected: {str(e)}")
+            finally:
+                IdentityCache._subscribed = False
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+            time.sleep(delay)
+            delay = min(delay * 2, IdentityCache.MAX_RECONNECT_DELAY)
@@ -5,6 +5,7 @@ from django.core.files.base import ContentFile
 from .password_service import PasswordService
 from authentication.models import UserSession
 from .mail_service import MailSendingService
+from .identity_cache import IdentityCache
 from .token_service import TokenService
 from ..models import PreviousPassword
 from .gdpr_service import GDPRService
@@ -172,6 +173,7 @@ class ProfileService:
                     raise ValidationError(f"Error al guardar la imagen: {str(e)}")
 
             user.save()
+            IdentityCache.invalidate(user.id)	# avatar may have changed
             rate_limiter.reset_limit(user.id, 'profile_update') # reset rate limit on successful profile update
             
             # Build profile image URL
@@ -201,6 +203,7 @@ class ProfileService:
                 user.fortytwo_image = user.fortytwo_image_url
 
             user.save()
+            IdentityCache.invalidate(user.id)
             return True
 
         except Exception as e:
@@ -1,3 +1,4 @@
+from main.redis_connection import get_redis
 import logging
 import redis
 
@@ -5,7 +6,7 @@ import redis
 # It is used to prevent brute force attacks and ensure fair usage of the application's resources.
 
 # Redis Connection:
-#    - Connects to a Redis container running on host 'redis' at port 6379
+#    - Connects to the Redis of settings.REDIS_URL (redis://redis:6379/0 by default)
 #    - Used for storing temporary counters and block states
 
 # Configuration Macros:
@@ -25,9 +26,7 @@ logger = logging.getLogger(__name__)
 
 class RateLimitService:
     def __init__(self):
-        self.redis_client = redis.Redis(	# Redis connection
-             # db=0 -> default database, decode_responses=True -> decode bytes to strings
-            host="redis", port=6379, db=0, decode_responses=True)
+        self.redis_client = get_redis()	# Redis connection (settings.REDIS_URL), decode_responses=True
         
         # Authentication rate limits
         self.LIMITS = { 
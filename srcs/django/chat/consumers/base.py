@@ -3,6 +3,8 @@ from django.contrib.auth import get_user_model
 from django.views.decorators.csrf import csrf_protect
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
+from urllib.parse import parse_qs
+from .message_writer import MessageWriter
 import logging
 
 User = get_user_model()
@@ -22,33 +24,38 @@ class ChatConsumer(AsyncWebsocketConsumer):
         self.username = self.user.username
         self.user_id = self.user.id
 
+        await self.load_blocked_ids()                                                           # Before joining any group, chat_message filters with it
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)             # Add the user to the general group
         await self.channel_layer.group_add(f"user_{self.user_id}", self.channel_name)           # User-specific group, the user will receive messages only for them
         ChatConsumer.connected_users[self.user_id] = self.channel_name                          # Add the user to the list of connected users
         await self.accept()                                                                     # Accept the WebSocket connection
+        await self.presence_connect()                                                           # Shared online set, the others get user_online if it's the first connection
         await self.join_group_channels()                                                        # Join the group channels
         await self.join_private_channels()                                                      # Join the private channels
-        await self.update_all_lists()                                                           # Update the user list, friend list, blocked users list ...
-        await self.load_unarchived_messages(self.user_id)                                       # Load unarchived messages
+        await self.update_all_lists()                                                           # Update the friend list, blocked users list ...
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        if "resume" not in query:                                                               # Resuming clients send a sync request with what they already have
+            await self.load_unarchived_messages(self.user_id)                                   # Load unarchived messages
 
     async def disconnect(self, close_code):
         """
-        Disconnect from the WebSocket, remove the user from the chat group, and send the updated list of connected users.
+        Disconnect from the WebSocket, remove the user from the chat group, and broadcast user_offline if it was their last connection.
         """
         ChatConsumer.connected_users.pop(self.user_id, None)
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
         await self.channel_layer.group_discard(
             f"user_{self.user_id}", self.channel_name
         )
+        await self.presence_disconnect()                                                        # The others get user_offline if it was the last connection
         await self.leave_group_channels()
         await self.leave_private_channels()
-        await self.update_all_lists()
+        await MessageWriter.flush()                                                             # Store what this socket sent before it goes away
 
     async def update_all_lists(self):
         """
-        Update the user list, friend list, blocked users list ...
+        Update the friend list, blocked users list ...
+        The online users list is sent when the client asks for it (request_online_users).
         """
-        await self.user_list_update()
         await self.notify_pending_requests(self.scope["user"].id)
         await self.notify_pending_requests(self.scope["user"].id, sent=True)
         await self.send_friend_list(self.scope["user"].id)
@@ -0,0 +1,92 @@
+from channels.db import database_sync_to_async
+from chat.models import BlockedUser
+from main.redis_connection import get_async_redis
+import logging
+
+logger = logging.getLogger(__name__)
+
+class BlockGraph:
+    """
+    Cache of "who blocks this user", shared by every worker through Redis.
+    The delivery planner reads it once per message to leave out the users blocking the sender.
+
+    - chat:blocked_by:{user_id} is a set of blocker ids plus the LOADED marker, so an empty set is cached too
+    - Loaded from the database on the first read, dropped when the user is blocked or unblocked
+    - chat:blocked_by:{user_id}:version is bumped on every block or unblock. A read that loaded the database
+      before the change would cache a stale set, the fill only happens if the version it started with is unchanged
+    """
+
+    KEY = "chat:blocked_by:{}"
+    VERSION_KEY = "chat:blocked_by:{}:version"
+    KEY_TTL = 3600                                                                              # Seconds before the set is loaded again from the database
+    VERSION_TTL = 86400                                                                         # Longer than any read, refreshed on every change
+    LOADED = "-"
+
+    # KEYS[1] set, KEYS[2] version, ARGV[1] version read before the load, ARGV[2] ttl, ARGV[3..] blocker ids.
+    # Caches the loaded set unless the version changed meanwhile, returns 1 if it was cached
+    FILL_SCRIPT = """
+    if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+        return 0
+    end
+    redis.call('SADD', KEYS[1], unpack(ARGV, 3))
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return 1
+    """
+
+    _redis = None
+    _fill = None
+
+    @staticmethod
+    def _get_redis():
+        if BlockGraph._redis is None:
+            BlockGraph._redis = get_async_redis()
+            BlockGraph._fill = BlockGraph._redis.register_script(BlockGraph.FILL_SCRIPT)
+        return BlockGraph._redis
+
+    @staticmethod
+    async def blockers_of(user_id):
+        """
+        Ids of the users who block user_id.
+        """
+        key = BlockGraph.KEY.format(user_id)
+        version_key = BlockGraph.VERSION_KEY.format(user_id)
+        try:
+            async with BlockGraph._get_redis().pipeline(transaction=True) as pipe:
+                pipe.smembers(key)
+                pipe.get(version_key)
+                members, version = await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Could not read the block graph of user {user_id}: {str(e)}")
+            return set(await BlockGraph._load(user_id))
+        if BlockGraph.LOADED in members:
+            return {int(member) for member in members if member != BlockGraph.LOADED}
+
+        blockers = await BlockGraph._load(user_id)
+        try:
+            await BlockGraph._fill(
+                keys=[key, version_key],
+                args=[version or "", BlockGraph.KEY_TTL, BlockGraph.LOADED, *blockers],
+            )
+        except Exception as e:
+            logger.warning(f"Could not cache the block graph of user {user_id}: {str(e)}")
+        return set(blockers)
+
+    @staticmethod
+    async def invalidate(blocked_id):
+        """
+        Called after blocked_id is blocked or unblocked (once the change is committed), the next read loads it again.
+        """
+        version_key = BlockGraph.VERSION_KEY.format(blocked_id)
+        try:
+            async with BlockGraph._get_redis().pipeline(transaction=True) as pipe:
+                pipe.incr(version_key)                                                          # Reads in flight won't cache what they loaded
+                pipe.expire(version_key, BlockGraph.VERSION_TTL)
+                pipe.delete(BlockGraph.KEY.format(blocked_id))
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Could not invalidate the block graph of user {blocked_id}: {str(e)}")
+
+    @staticmethod
+    @database_sync_to_async
+    def _load(user_id):
+        return list(BlockedUser.objects.filter(blocked_id=user_id).values_list("blocker_id", flat=True))
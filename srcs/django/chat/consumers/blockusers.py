@@ -1,6 +1,7 @@
 import json
 from django.contrib.auth import get_user_model
 from chat.models import BlockedUser
+from .block_graph import BlockGraph
 from channels.db import database_sync_to_async, sync_to_async
 from asgiref.sync import sync_to_async
 
@@ -24,10 +25,36 @@ class BlockConsumer:
         else:
             await self.block_user(from_user, user)
             type = "blocked"
+        await BlockGraph.invalidate(user.id)                                                    # Users blocking user.id changed
+
+        await self.channel_layer.group_send(                                                    # Update the block set of every connection of this user, on any worker
+            f"user_{from_user.id}",
+            {"type": "block_list_update", "user_id": user.id, "blocked": type == "blocked"},
+        )
 
         await self.send(text_data=json.dumps({"type": type, "username": user.username}))        # Send the action to the client
         await self.send_blocked_users()                                                         # Send the updated list of blocked users to the client
 
+    async def load_blocked_ids(self):
+        """
+        Load the ids of the users blocked by the owner of the connection, once on connect.
+        chat_message filters with this set instead of querying the database for every message.
+        """
+        self.blocked_ids = set(
+            await database_sync_to_async(list)(
+                BlockedUser.objects.filter(blocker_id=self.scope["user"].id).values_list("blocked_id", flat=True)
+            )
+        )
+
+    async def block_list_update(self, event):
+        """
+        Method called when the user blocks or unblocks someone from any of their connections.
+        """
+        if event["blocked"]:
+            self.blocked_ids.add(event["user_id"])
+        else:
+            self.blocked_ids.discard(event["user_id"])
+
     async def is_blocked(self, blocker_id, blocked_id):
         """
         Check if a user is blocked.
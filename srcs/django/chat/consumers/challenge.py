@@ -1,7 +1,9 @@
 import json
 from django.contrib.auth import get_user_model
 from channels.db import database_sync_to_async
+from authentication.services.identity_cache import IdentityCache
 from game.models import Game
+from game.consumers.utils.game_readiness import GameReadiness
 import logging
 from django.db import transaction
 
@@ -12,17 +14,20 @@ logger = logging.getLogger(__name__)
 class ChallengeConsumer():
     async def handle_challenge_action(self, data, channel_name):
         action = data.get('action')  # 'challenge', 'reject', 'accept'
-        from_user = await self.get_user_by_id(data.get('from_user_id'))
+        from_user = await IdentityCache.aget(data.get('from_user_id'))
         to_user_username = data.get('to_username')
-        to_user = await self.get_user_by_username(to_user_username)
+        to_user = await IdentityCache.aget_by_username(to_user_username)
+        if not from_user or not to_user:
+            return
 
         if action == 'challenge':
             message = data.get('message', '')
         elif action == 'reject':
-            message = f"{to_user.username} ha rechazado tu invitación :("
+            message = f"{to_user['username']} ha rechazado tu invitación :("
         elif action == 'accept':
-            game = await self.create_game(from_user, to_user)
-            message = f"{to_user.username} ha aceptado tu invitación :)"
+            game = await self.create_game(from_user['id'], to_user['id'])
+            await GameReadiness.mark_ready(game.id)
+            message = f"{to_user['username']} ha aceptado tu invitación :)"
         else:
             return
 
@@ -31,10 +36,10 @@ class ChallengeConsumer():
             {
                 'type': 'challenge_action_message',
                 'action': action,
-                'from_user_id': from_user.id,
-                'from_username': from_user.username,
-                'to_user_id': to_user.id,
-                'to_username': to_user.username,
+                'from_user_id': from_user['id'],
+                'from_username': from_user['username'],
+                'to_user_id': to_user['id'],
+                'to_username': to_user['username'],
                 'channel_name': channel_name,
                 'message': message,
                 'game_id': game.id if action == 'accept' else None
@@ -56,16 +61,12 @@ class ChallengeConsumer():
         await self.send(text_data=json.dumps(msg))
 
     @database_sync_to_async
-    def get_user_by_username(self, username):
-        return User.objects.filter(username=username).first()
-    
-    @database_sync_to_async
-    def create_game(self, player1, player2):
-        """Create a new game with the given players"""
+    def create_game(self, player1_id, player2_id):
+        """Create a new game with the given player ids"""
         with transaction.atomic():
             game = Game.objects.create(
-                player1=player1,
-                player2=player2,
+                player1_id=player1_id,
+                player2_id=player2_id,
                 status='WAITING',
                 player1_ready=True,
                 player2_ready=True 
@@ -216,7 +216,11 @@ class MainChatConsumer(
                 await self.handle_challenge_action(data, channel_name)
             case "request_channel_messages":
                 await self.load_unarchived_messages(self.scope["user"].id)
-            case "request_online_users" | "get_user_list":  # Multiple cases in one
+            case "request_channel_history":
+                await self.request_channel_history(data)
+            case "sync":
+                await self.sync_channels(data)
+            case "request_online_users" | "get_user_list" | "request_user_list":  # Multiple cases in one, snapshot of the online users
                 await self.user_list_update()
             case "get_friend_list":
                 await self.send_friend_list(self.scope["user"].id)
@@ -47,13 +47,13 @@ class FriendRequestsConsumer:
         )
         await self.delete_friend_request(friend_request)                                        #Delete the friend request
 
-        from_user = await self.get_user_by_id(friend_request.from_user_id)
-        to_user = await self.get_user_by_id(friend_request.to_user_id)
+        from_user_id = friend_request.from_user_id
+        to_user_id = friend_request.to_user_id
 
-        await self.notify_pending_requests(from_user.id, sent=True)
-        await self.notify_pending_requests(to_user.id)
-        await self.send_friend_list(from_user.id)
-        await self.send_friend_list(to_user.id)
+        await self.notify_pending_requests(from_user_id, sent=True)
+        await self.notify_pending_requests(to_user_id)
+        await self.send_friend_list(from_user_id)
+        await self.send_friend_list(to_user_id)
 
     async def reject_friend_request(self, data):
         """
@@ -74,11 +74,11 @@ class FriendRequestsConsumer:
 
         await self.delete_friend_request(friend_request)
 
-        from_user = await self.get_user_by_id(friend_request.from_user_id)
-        to_user = await self.get_user_by_id(friend_request.to_user_id)
+        from_user_id = friend_request.from_user_id
+        to_user_id = friend_request.to_user_id
 
-        await self.notify_pending_requests(from_user.id, sent=True)
-        await self.notify_pending_requests(to_user.id)
+        await self.notify_pending_requests(from_user_id, sent=True)
+        await self.notify_pending_requests(to_user_id)
 
     async def notify_pending_requests(self, user_id, sent=False):
         """
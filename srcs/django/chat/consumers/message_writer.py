@@ -0,0 +1,154 @@
+from channels.db import database_sync_to_async
+from chat.models import Channel, Message
+from .recent_messages import RecentMessages
+import asyncio
+import atexit
+import logging
+
+logger = logging.getLogger(__name__)
+
+class MessageWriter:
+    """
+    Write buffer of the chat messages of this process. Messages are broadcast right away and stored
+    a few milliseconds later, many of them with a single bulk INSERT instead of one per message.
+
+    - add() queues an unsaved Message, a flush runs FLUSH_INTERVAL later or as soon as BATCH_SIZE are queued
+    - Flushes are serialized by a lock, so messages are inserted in the order they were sent
+    - Saved messages (with their id) are appended to the recent messages buffer after the insert
+    - If a bulk insert fails the batch is saved one by one. The rows that fail again go back to the front
+      of the queue and are retried after RETRY_DELAY, doubled on each attempt. A row is dropped (and
+      counted in snapshot()["dropped"]) only after MAX_ATTEMPTS failed attempts
+
+    What survives a shutdown:
+    - ChatConsumer.disconnect awaits flush(), which waits for the flush in progress, so the messages of a
+      socket closed by the server are stored before it goes away
+    - On SIGTERM the process exits normally: the database thread of the flush in progress is joined first
+      (it stores its batch or puts the failed rows back in the queue), then the atexit hook stores the rest
+    - On SIGKILL, or if the database is down at exit, the queued messages are lost (at most a few
+      FLUSH_INTERVAL of traffic plus the rows waiting for a retry)
+    """
+
+    FLUSH_INTERVAL = 0.01                                                                       # Seconds a message may wait in the buffer
+    BATCH_SIZE = 200                                                                            # Queued messages that trigger a flush immediately
+    RETRY_DELAY = 0.5                                                                           # Seconds before the first retry of a failed batch
+    MAX_ATTEMPTS = 5                                                                            # Failed attempts before a message is dropped
+
+    _pending = []                                                                               # [(message, failed attempts), ...] in send order
+    _flush_task = None
+    _lock = None
+    _atexit_registered = False
+    _stats = {"stored": 0, "retried": 0, "dropped": 0}
+
+    @staticmethod
+    async def add(message):
+        """
+        Queue an unsaved Message (channel_name set, channel_id is resolved on flush).
+        """
+        MessageWriter._pending.append((message, 0))
+        if not MessageWriter._atexit_registered:
+            atexit.register(MessageWriter.flush_sync)
+            MessageWriter._atexit_registered = True
+
+        if len(MessageWriter._pending) >= MessageWriter.BATCH_SIZE:
+            asyncio.ensure_future(MessageWriter.flush())
+        elif MessageWriter._flush_task is None or MessageWriter._flush_task.done():
+            MessageWriter._flush_task = asyncio.ensure_future(MessageWriter._flush_later())
+
+    @staticmethod
+    async def _flush_later(delay=None):
+        await asyncio.sleep(MessageWriter.FLUSH_INTERVAL if delay is None else delay)
+        await MessageWriter.flush()
+
+    @staticmethod
+    async def flush():
+        """
+        Store every queued message, waits for a flush already in progress.
+        """
+        if MessageWriter._lock is None:
+            MessageWriter._lock = asyncio.Lock()
+        async with MessageWriter._lock:
+            batch, MessageWriter._pending = MessageWriter._pending, []                          # Messages added meanwhile go to the next flush
+            if not batch:
+                return
+            saved, attempts = await database_sync_to_async(MessageWriter._store_batch)(batch)
+        if attempts:                                                                            # Failed rows were put back, retry with backoff
+            delay = MessageWriter.RETRY_DELAY * 2 ** (attempts - 1)
+            MessageWriter._flush_task = asyncio.ensure_future(MessageWriter._flush_later(delay))
+        for message in saved:
+            await RecentMessages.append(message)
+
+    @staticmethod
+    def flush_sync():
+        """
+        Store the queued messages from synchronous code, registered with atexit.
+        """
+        batch, MessageWriter._pending = MessageWriter._pending, []
+        if batch:
+            saved, _ = MessageWriter._store_batch(batch)
+            logger.info(f"Stored {len(saved)} of {len(batch)} queued chat messages on shutdown")
+
+    @staticmethod
+    def _store_batch(batch):
+        """
+        Store a batch of (message, attempts) and put the failed ones back at the front of the queue.
+        Returns the saved messages and the highest attempt count of the requeued ones (0 if none).
+        """
+        messages = [message for message, _ in batch]
+        try:
+            saved = MessageWriter._store(messages)
+        except Exception as e:                                                                  # Database unreachable, nothing was stored
+            logger.error(f"Could not store {len(batch)} chat messages: {str(e)}")
+            saved = []
+        MessageWriter._stats["stored"] += len(saved)
+
+        saved_ids = {id(message) for message in saved}
+        retry = []
+        for message, attempts in batch:
+            if id(message) in saved_ids:
+                continue
+            if attempts + 1 >= MessageWriter.MAX_ATTEMPTS:
+                MessageWriter._stats["dropped"] += 1
+                logger.error(f"Dropped a chat message of {message.channel_name} after {attempts + 1} attempts")
+            else:
+                retry.append((message, attempts + 1))
+        MessageWriter._stats["retried"] += len(retry)
+        MessageWriter._pending[:0] = retry                                                      # Only the flush holding the lock swaps the queue
+        return saved, max((attempts for _, attempts in retry), default=0)
+
+    @staticmethod
+    def pending_max_seq(channel_name):
+        """
+        Highest seq of the queued messages of a channel, 0 if none (see ChatSequence).
+        """
+        return max(
+            (message.seq or 0 for message, _ in MessageWriter._pending if message.channel_name == channel_name),
+            default=0,
+        )
+
+    @staticmethod
+    def snapshot():
+        """
+        Write counters of this process.
+        """
+        return dict(MessageWriter._stats, pending=len(MessageWriter._pending))
+
+    @staticmethod
+    def _store(batch):
+        for message in batch:
+            message.channel_id = Channel.id_for(message.channel_name)
+        try:
+            return Message.objects.bulk_create(batch)                                           # PostgreSQL returns the ids
+        except Exception as e:
+            logger.warning(f"Bulk insert of {len(batch)} chat messages failed, saving one by one: {str(e)}")
+
+        Channel.forget()                                                                        # Cached channel ids may be gone (database reset)
+        saved = []
+        for message in batch:
+            message.pk = None
+            try:
+                message.channel_id = Channel.id_for(message.channel_name)
+                message.save()
+                saved.append(message)
+            except Exception as e:
+                logger.error(f"Could not store a chat message of {message.channel_name}: {str(e)}")
+        return saved
@@ -1,9 +1,13 @@
 import json
 from django.contrib.auth import get_user_model
 from .base import ChatConsumer
-from .blockusers import BlockedUser  
+from .block_graph import BlockGraph
+from .sequences import ChatSequence
+from .recent_messages import RecentMessages
+from .message_writer import MessageWriter
 from channels.db import database_sync_to_async
 from chat.models import (
+    Channel,
     Message,
     PrivateChannelMembership,
     GroupMembership,
@@ -26,10 +30,14 @@ class MessagesConsumer:
 
     2. Processing:
     - handle_message processes data and calls send_to_channel
-    - checks if recipient has blocked sender before sending
 
-    3. Channel Distribution:
-    - send_to_channel uses group_send to broadcast to all consumers in the channel group
+    3. Channel Distribution (delivery planner):
+    - send_to_channel reads the users blocking the sender from the BlockGraph cache
+    - Nobody blocks the sender: one group_send to the channel group
+    - Private and group channels: group_send to the user_{id} group of each member that doesn't block the sender,
+      group members are read from GroupMembership
+    - chat_general: everybody is a member, one group_send with excluded_ids. Each consumer drops the event
+      before anything is serialized for its socket (see chat_message)
     - Event includes message type and data (user_id, username, message, channel_name)
 
     4. Consumer Handling:
@@ -41,6 +49,10 @@ class MessagesConsumer:
 
     Flow Summary: Client -> receive -> handle_message -> send_to_channel -> group_send -> chat_message -> self.send
     """
+
+    HISTORY_PAGE_SIZE = 50                                                                      # Messages per channel_history frame
+    SYNC_LIMIT = 500                                                                            # Missed messages sent on sync, beyond that the client gets the last page
+
     async def handle_message(self, data, channel_name):
         """
         Handle a message sent by the user.
@@ -54,7 +66,8 @@ class MessagesConsumer:
             is_dangerous = data.get("_has_xss_in_message", False)                               # Check if chatconsumers.py already detected XSS
             if not is_dangerous:
                 is_dangerous = detect_xss(message)
-            await self.save_message(from_user, channel_name, message)                           # Store the ORIGINAL message in the database (not sanitized)   
+            seq = await ChatSequence.next(channel_name)                                         # Position of the message in the channel, for sync on reconnect
+            await self.save_message(from_user, channel_name, message, seq)                      # Store the ORIGINAL message in the database (not sanitized)   
             if is_dangerous:                                                                    # If the message contains dangerous code, sanitize it BEFORE sending
                 sanitized_message = render_code_safely(message)
             else:
@@ -74,24 +87,37 @@ class MessagesConsumer:
                         )
             
             await self.send_to_channel(
-                channel_name, from_user.id, from_user.username, sanitized_message
+                channel_name, from_user.id, from_user.username, sanitized_message, seq
             )
 
-    async def send_to_channel(self, channel_name, user_id, username, message):
+    async def send_to_channel(self, channel_name, user_id, username, message, seq=None):
         """
-        Send a message to the channel. The message is sent to all consumers in the channel group.
-        If the recipient has blocked the sender, the message will not be sent.
+        Send a message to the channel. The recipients are resolved here, so the users who
+        have blocked the sender don't receive the message at all.
         """
-        await self.channel_layer.group_send(
-            channel_name,
-            {
-                "type": "chat_message",
-                "user_id": user_id,
-                "username": username,
-                "message": message,
-                "channel_name": channel_name,
-            },
-        )
+        event = {
+            "type": "chat_message",
+            "user_id": user_id,
+            "username": username,
+            "message": message,
+            "channel_name": channel_name,
+            "seq": seq,
+        }
+        blockers = await BlockGraph.blockers_of(user_id)
+
+        if not blockers:                                                                        # Common case, a single group send
+            await self.channel_layer.group_send(channel_name, event)
+        elif channel_name.startswith(("dm_", "chat_group_")):                                   # Members are known, send to each one left
+            if channel_name.startswith("dm_"):
+                member_ids = map(int, channel_name.split("_")[1:])
+            else:
+                member_ids = await self.get_group_member_ids(channel_name)
+            for member_id in member_ids:
+                if member_id not in blockers:
+                    await self.channel_layer.group_send(f"user_{member_id}", event)
+        else:                                                                                   # chat_general, every user is a member
+            event["excluded_ids"] = list(blockers)
+            await self.channel_layer.group_send(channel_name, event)
 
     async def chat_message(self, event):
         """
@@ -100,9 +126,10 @@ class MessagesConsumer:
         If the sender is blocked, the message will not be sent.
         """
         sender_id = event["user_id"]
-        sender_user = await self.get_user_by_id(sender_id)
 
-        if await self.is_blocked(self.scope["user"].id, sender_user.id):                        # If the sender is blocked, return
+        if self.user_id in event.get("excluded_ids", ()):                                       # Excluded by the delivery planner
+            return
+        if sender_id in self.blocked_ids:                                                       # Safety net if the block graph cache is behind (no query, see load_blocked_ids)
             return
 
         message = event["message"]                                                              # The message is already sanitized from send_to_channel
@@ -115,45 +142,104 @@ class MessagesConsumer:
                     "username": event["username"],
                     "message": message,
                     "channel_name": event["channel_name"],
+                    "seq": event.get("seq"),
                 }
             )
         )
 
     async def load_unarchived_messages(self, user_id):
         """
-        Load unarchived messages for the user. Archive messages are not sent to the user(Not implemented).
-        The messages are sent to the user in the order they were sent and to the correct channel.
+        Load the last HISTORY_PAGE_SIZE unarchived messages of every channel of the user (archive messages are not sent).
+        Each channel is sent as a single channel_history frame, older pages are requested with request_channel_history.
         Sanitizes messages when loading them from the database, not before storing them.
         """
-        logger.info(f"Loading unarchived messages for user {user_id}")
         channels = await self.get_user_channels(user_id)
         for channel_name in channels:
-            messages = await self.get_unarchived_messages_filtered(                             # Get the unarchived messages for the user, filtered by blocked users
-                user_id, channel_name
+            await self.send_channel_history(channel_name, initial=True)
+        logger.info(f"Sent the last messages of {len(channels)} channels to user {user_id}")
+
+    async def request_channel_history(self, data):
+        """
+        Send an older page of a channel, the messages sent before the message id "before".
+        """
+        channel_name = data.get("channel_name")
+        before = data.get("before")
+        if before and (isinstance(before, bool) or not str(before).isdigit()):                  # A message id, sent as a number or a numeric string
+            await self.send(text_data=json.dumps({"type": "error", "message": "Invalid history request"}))
+            return
+        if not channel_name or channel_name not in await self.get_user_channels(self.scope["user"].id):
+            return                                                                              # Only channels the user belongs to
+        await self.send_channel_history(channel_name, before=int(before) if before else None)
+
+    async def sync_channels(self, data):
+        """
+        Reconnect without replaying the history: "channels" is {channel_name: last seq seen} for the
+        channels the client already has. Those get only the newer messages, the others their last page.
+        If more than SYNC_LIMIT messages were missed the last page is sent instead, marked with "gap".
+        """
+        last_seen = data.get("channels") or {}
+        if not isinstance(last_seen, dict):
+            await self.send(text_data=json.dumps({"type": "error", "message": "Invalid sync request"}))
+            return
+        for channel_name in await self.get_user_channels(self.scope["user"].id):
+            seq = last_seen.get(channel_name)
+            if not isinstance(seq, int) or isinstance(seq, bool):
+                await self.send_channel_history(channel_name, initial=True)
+                continue
+            rows = await self.get_recent_messages_after(channel_name, seq)
+            if rows is None:                                                                    # Not all in the recent messages buffer
+                rows = await self.get_messages_after(channel_name, seq)
+            if len(rows) > self.SYNC_LIMIT:
+                await self.send_channel_history(channel_name, initial=True, gap=True)
+            elif rows:
+                await self.send_history_frame(channel_name, rows, initial=True, sync=True)
+
+    async def send_channel_history(self, channel_name, before=None, initial=False, gap=False):
+        """
+        Send one page of a channel, oldest first, as a single frame.
+        "before" in the frame is the cursor of the next (older) page, None when there is nothing older.
+        """
+        page = await self.get_recent_page(channel_name) if before is None else None
+        rows, has_more = page or await self.get_channel_history_page(channel_name, before)
+        if not rows and not initial:
+            return
+        await self.send_history_frame(
+            channel_name, rows, initial=initial, before=rows[0]["id"] if has_more else None, gap=gap
+        )
+
+    async def send_history_frame(self, channel_name, rows, initial=False, before=None, **flags):
+        """
+        Send stored messages of a channel (database or recent messages buffer rows) as one channel_history frame.
+        """
+        messages = []
+        for row in rows:
+            content = row["content"]                                                            # Get the original content from the database
+            if detect_xss(content):                                                             # Detect if it contains dangerous code
+                content = render_code_safely(content)                                           # Sanitize only if necessary
+            messages.append(
+                {
+                    "id": row["id"],
+                    "seq": row["seq"],
+                    "user_id": row["user_id"],
+                    "username": row["user__username"],
+                    "message": content,
+                    "channel_name": channel_name,
+                    "timestamp": row["timestamp"] if isinstance(row["timestamp"], str) else row["timestamp"].isoformat(),
+                }
             )
-            logger.info(
-                f"Loading {len(messages)} unarchived messages for channel {channel_name}"
+
+        await self.send(
+            text_data=json.dumps(
+                {
+                    "type": "channel_history",
+                    "channel_name": channel_name,
+                    "messages": messages,
+                    "initial": initial,
+                    "before": before,
+                    **flags,
+                }
             )
-            for message in messages:
-                content = message.content                                                       # Get the original content from the database
-            
-                if detect_xss(content):                                                         # Detect if it contains dangerous code
-                    sanitized_content = render_code_safely(content)                             # Sanitize only if necessary
-                else:
-                    sanitized_content = content                                                 # Don't modify safe content
-
-                await self.send(
-                    text_data=json.dumps(
-                        {
-                            "type": "chat_message",
-                            "user_id": await self.get_user_id(message),
-                            "username": await self.get_username(message),
-                            "message": sanitized_content,
-                            "channel_name": message.channel_name,
-                            "timestamp": message.timestamp.isoformat(),
-                        }
-                    )
-                )
+        )
 
     def is_already_escaped(self, text):
         """
@@ -161,28 +247,79 @@ class MessagesConsumer:
         """
         return is_already_processed(text)
 
+    async def get_recent_page(self, channel_name):
+        """
+        The last page of a channel from the recent messages buffer, like get_channel_history_page.
+        None if the buffer doesn't have enough messages left once blocked users are filtered out.
+        """
+        recent = await RecentMessages.get(channel_name)
+        if recent is None:
+            return None
+        rows, complete = recent
+        rows = [row for row in rows if row["user_id"] not in self.blocked_ids]
+        if len(rows) <= self.HISTORY_PAGE_SIZE and not complete:                                # Older messages are only in the database
+            return None
+        return rows[-self.HISTORY_PAGE_SIZE:], len(rows) > self.HISTORY_PAGE_SIZE
+
+    async def get_recent_messages_after(self, channel_name, seq):
+        """
+        Messages after seq from the recent messages buffer, like get_messages_after.
+        None if the buffer doesn't go back far enough.
+        """
+        recent = await RecentMessages.get(channel_name)
+        if recent is None:
+            return None
+        rows, complete = recent
+        sequenced = [row["seq"] for row in rows if row["seq"] is not None]
+        if not complete and (not sequenced or sequenced[0] > seq + 1):
+            return None
+        return [
+            row for row in rows
+            if row["seq"] is not None and row["seq"] > seq and row["user_id"] not in self.blocked_ids
+        ]
+
     @database_sync_to_async
-    def get_unarchived_messages_filtered(self, user_id, channel_name):
+    def get_channel_history_page(self, channel_name, before=None):
         """
-        This method filters out messages from blocked users.
+        Get a page of unarchived messages of a channel, newest first in the query, returned oldest first.
+        Messages from blocked users are filtered out. Keyset pagination on the id, so any page costs
+        one range scan of the unarchived (channel, id) index, the username comes with the same query (join on user).
         """
-        blocked_users = BlockedUser.objects.filter(blocker_id=user_id).values_list(
-            "blocked_id", flat=True
+        queryset = (
+            Message.objects.filter(channel_id=Channel.id_for(channel_name), is_archived=False)
+            .exclude(user_id__in=self.blocked_ids)
         )
-
-        return list(
-            Message.objects.filter(channel_name=channel_name, is_archived=False)
-            .exclude(user_id__in=blocked_users)
-            .order_by("timestamp")
+        if before:
+            queryset = queryset.filter(id__lt=before)
+        rows = list(
+            queryset.order_by("-id").values(
+                "id", "seq", "user_id", "user__username", "content", "timestamp"
+            )[: self.HISTORY_PAGE_SIZE + 1]
         )
+        has_more = len(rows) > self.HISTORY_PAGE_SIZE
+        return rows[: self.HISTORY_PAGE_SIZE][::-1], has_more
 
     @database_sync_to_async
-    def get_user_id(self, message):
-        return message.user.id if message.user else None
+    def get_messages_after(self, channel_name, seq):
+        """
+        Get the unarchived messages of a channel with a sequence number above seq, oldest first.
+        Returns at most SYNC_LIMIT + 1 rows, so the caller can tell the gap is too large.
+        """
+        return list(
+            Message.objects.filter(channel_id=Channel.id_for(channel_name), is_archived=False, seq__gt=seq)
+            .exclude(user_id__in=self.blocked_ids)
+            .order_by("seq")
+            .values("id", "seq", "user_id", "user__username", "content", "timestamp")[: self.SYNC_LIMIT + 1]
+        )
 
     @database_sync_to_async
-    def get_username(self, message):
-        return message.user.username if message.user else None
+    def get_group_member_ids(self, channel_name):
+        """
+        Get the ids of the members of a group channel.
+        """
+        return list(
+            GroupMembership.objects.filter(group__channel_name=channel_name).values_list("user_id", flat=True)
+        )
 
     @database_sync_to_async
     def get_user_channels(self, user_id):
@@ -199,10 +336,15 @@ class MessagesConsumer:
 
         return list(private_channels) + list(group_channels) + ["chat_general"]
 
-    @database_sync_to_async
-    def save_message(self, user, channel_name, content):
-        Message.objects.create(
-            user=user,
-            channel_name=channel_name,
-            content=content,
+    async def save_message(self, user, channel_name, content, seq=None):
+        """
+        Queue the message in the write buffer, it is stored with the next bulk insert (see MessageWriter).
+        """
+        await MessageWriter.add(
+            Message(
+                user_id=user.id,
+                channel_name=channel_name,
+                content=content,
+                seq=seq,
+            )
         )
\ No newline at end of file
@@ -0,0 +1,147 @@
+"""
+Compiled scanner for the security pattern lists of xss_patterns.py.
+Answers "does any of these patterns match the text" without running the patterns that can't match it.
+"""
+import re
+import logging
+
+try:
+    from re import _parser as sre_parse                                                         # Python 3.11+
+except ImportError:
+    import sre_parse
+
+logger = logging.getLogger(__name__)
+
+_LITERAL = sre_parse.LITERAL
+_IN = sre_parse.IN
+_BRANCH = sre_parse.BRANCH
+_SUBPATTERN = sre_parse.SUBPATTERN
+_REPEATS = (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, "POSSESSIVE_REPEAT", None))
+
+
+class PatternScanner:
+    """
+    The patterns of a list compiled once, searched case-insensitively like the original
+    re.search(pattern, text, re.IGNORECASE) loop (same verdicts, same order).
+
+    Each pattern requires at least one of a few literal substrings ("<iframe", "union", "=", ...), found
+    by walking its parse tree. For ASCII text the scanner first checks which literals appear in the
+    lowercased text (plain substring tests), then only runs the patterns one of whose literals is there:
+    typical chat text runs a handful of patterns instead of all of them.
+    - Non-ASCII text runs every pattern, IGNORECASE folds some non-ASCII characters to ASCII letters
+      (ı, ſ, K) and lower() doesn't
+    - A pattern without required literal always runs
+
+    Patterns are not merged into one alternation: Python's re runs a large alternation slower than
+    the same patterns compiled separately.
+    Benchmark: python manage.py benchmark_security_scan
+    """
+
+    def __init__(self, patterns):
+        patterns = [self._strip_global_flags(pattern) for pattern in patterns]
+        self.patterns = [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+        self.required = [self._required_literals(pattern) for pattern in patterns]
+        self.literals = sorted(set().union(*(required for required in self.required if required)))
+
+    def search(self, text):
+        """
+        True if any pattern matches the text.
+        """
+        return any(pattern.search(text) for pattern in self._candidates(text))
+
+    def count(self, text, limit=None):
+        """
+        Number of patterns matching the text, stops at limit.
+        """
+        matches = 0
+        for pattern in self._candidates(text):
+            if pattern.search(text):
+                matches += 1
+                if limit and matches >= limit:
+                    break
+        return matches
+
+    @staticmethod
+    def _strip_global_flags(pattern):
+        # "(?i)" is only allowed at the start of a whole expression, it is redundant with IGNORECASE anyway
+        return pattern[4:] if pattern.startswith("(?i)") else pattern
+
+    def _candidates(self, text):
+        """
+        Patterns that may match the text, in list order.
+        """
+        if not text.isascii():
+            return self.patterns
+        lowered = text.lower()
+        present = {literal for literal in self.literals if literal in lowered}
+        return [
+            pattern for pattern, required in zip(self.patterns, self.required)
+            if required is None or not required.isdisjoint(present)
+        ]
+
+    @classmethod
+    def _required_literals(cls, pattern):
+        """
+        Frozen set of literals such that every match of the pattern contains one of them, None if unknown.
+        """
+        try:
+            required = cls._required(sre_parse.parse(pattern, re.IGNORECASE))
+        except Exception as e:
+            logger.warning(f"Could not analyze pattern {pattern!r}: {str(e)}")
+            required = None
+        return frozenset(required) if required else None
+
+    @classmethod
+    def _required(cls, items):
+        """
+        Set of literals such that every match of the sequence contains one of them, None if there is none.
+        Among the candidates of the sequence (runs of literals, groups, repeats) the least common is kept.
+        """
+        candidates = []
+        run = ""
+        for op, arg in items:
+            char = cls._literal_char(op, arg)
+            if char is not None:
+                run += char
+                continue
+            if run:
+                candidates.append({run})
+                run = ""
+            if op is _SUBPATTERN:
+                candidates.append(cls._required(arg[-1]))
+            elif op is _BRANCH:
+                branches = [cls._required(branch) for branch in arg[1]]
+                if all(branches):
+                    candidates.append(set().union(*branches))
+            elif op in _REPEATS and arg[0] >= 1:
+                candidates.append(cls._required(arg[2]))
+        if run:
+            candidates.append({run})
+        candidates = [candidate for candidate in candidates if candidate]
+        if not candidates:
+            return None
+        return min(candidates, key=cls._cost)
+
+    @staticmethod
+    def _literal_char(op, arg):
+        # A literal, or a class like [iI] that is a single character once case is ignored
+        if op is _LITERAL:
+            return chr(arg).lower()
+        if op is _IN and arg and all(item_op is _LITERAL for item_op, _ in arg):
+            chars = {chr(value).lower() for _, value in arg}
+            if len(chars) == 1:
+                return chars.pop()
+        return None
+
+    @staticmethod
+    def _cost(literals):
+        # Rough chance of appearing in chat text: punctuation is rare, long words are rare, short words are common
+        cost = 0
+        for literal in literals:
+            if not literal.strip():
+                cost += 50
+            elif any(not char.isalnum() and not char.isspace() for char in literal):
+                cost += 1 if len(literal) > 1 else 3
+            else:
+                cost += 2 if len(literal) >= 4 else 10
+        return cost
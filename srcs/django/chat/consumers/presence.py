@@ -0,0 +1,166 @@
+from channels.layers import get_channel_layer
+from main.redis_connection import get_async_redis
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+class Presence:
+    """
+    Online users shared by every worker through Redis. A user is online while any of their
+    connections (tabs, devices) is alive, only the first connection and the last disconnection
+    are broadcast (user_online / user_offline), the full list is sent when a client asks for it.
+
+    - chat:presence:{user_id} is a sorted set of the user's connections (channel names) scored by expiry
+    - chat:presence:users is a sorted set of the online user ids scored by their latest connection expiry
+    - Each connection refreshes its expiry every HEARTBEAT seconds, connections of a worker that died
+      stop being refreshed and expire after TTL
+    - Once per REAP_INTERVAL one worker (Redis lock) removes the expired users and broadcasts them offline.
+      The candidates are read first, then each one is reaped with its own script call, every key a script
+      touches is declared in KEYS
+    - A reaped user whose socket is still open (its heartbeats failed for a while) gets a presence_check on
+      user_{id}, the consumer registers the connection again and announces the user online right away
+      instead of at its next heartbeat
+    """
+
+    CONN_KEY = "chat:presence:{}"
+    USERS_KEY = "chat:presence:users"
+    REAP_LOCK = "chat:presence:reaper"
+    GROUP = "chat_general"
+    TTL = 60                                                                                    # Seconds a connection stays online without heartbeat
+    HEARTBEAT = 20
+    REAP_INTERVAL = 30
+
+    # KEYS[1] connections, KEYS[2] users, ARGV[1] channel name, ARGV[2] now, ARGV[3] expiry, ARGV[4] user id.
+    # Adds or refreshes a connection, returns 1 if the user had no live connection before
+    CONNECT_SCRIPT = """
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+    local before = redis.call('ZCARD', KEYS[1])
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+    redis.call('EXPIREAT', KEYS[1], math.ceil(tonumber(ARGV[3])))
+    local top = redis.call('ZRANGE', KEYS[1], -1, -1, 'WITHSCORES')
+    redis.call('ZADD', KEYS[2], top[2], ARGV[4])
+    if before == 0 then
+        return 1
+    end
+    return 0
+    """
+
+    # KEYS[1] connections, KEYS[2] users, ARGV[1] channel name, ARGV[2] now, ARGV[3] user id.
+    # Removes a connection, returns 1 if it was the last live one of the user
+    DISCONNECT_SCRIPT = """
+    redis.call('ZREM', KEYS[1], ARGV[1])
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+    local top = redis.call('ZRANGE', KEYS[1], -1, -1, 'WITHSCORES')
+    if #top == 0 then
+        redis.call('DEL', KEYS[1])
+        return redis.call('ZREM', KEYS[2], ARGV[3])
+    end
+    redis.call('ZADD', KEYS[2], top[2], ARGV[3])
+    return 0
+    """
+
+    # KEYS[1] connections, KEYS[2] users, ARGV[1] now, ARGV[2] user id.
+    # Drops the expired connections of a user, returns 1 if none is left (the user went offline)
+    REAP_SCRIPT = """
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+    local top = redis.call('ZRANGE', KEYS[1], -1, -1, 'WITHSCORES')
+    if #top == 0 then
+        redis.call('DEL', KEYS[1])
+        return redis.call('ZREM', KEYS[2], ARGV[2])
+    end
+    redis.call('ZADD', KEYS[2], top[2], ARGV[2])
+    return 0
+    """
+
+    _redis = None
+    _connect = None
+    _disconnect = None
+    _reap = None
+    _reaper_task = None
+
+    @staticmethod
+    def _get_redis():
+        if Presence._redis is None:
+            Presence._redis = get_async_redis()
+            Presence._connect = Presence._redis.register_script(Presence.CONNECT_SCRIPT)
+            Presence._disconnect = Presence._redis.register_script(Presence.DISCONNECT_SCRIPT)
+            Presence._reap = Presence._redis.register_script(Presence.REAP_SCRIPT)
+        return Presence._redis
+
+    @staticmethod
+    async def connect(user_id, channel_name):
+        """
+        Register a connection (or refresh it, used as heartbeat). True if the user just came online.
+        """
+        Presence._ensure_reaper()
+        now = time.time()
+        try:
+            Presence._get_redis()
+            return bool(await Presence._connect(
+                keys=[Presence.CONN_KEY.format(user_id), Presence.USERS_KEY],
+                args=[channel_name, now, now + Presence.TTL, user_id],
+            ))
+        except Exception as e:
+            logger.warning(f"Could not register the presence of user {user_id}: {str(e)}")
+            return False
+
+    @staticmethod
+    async def disconnect(user_id, channel_name):
+        """
+        Remove a connection. True if the user has no connection left (went offline).
+        """
+        try:
+            Presence._get_redis()
+            return bool(await Presence._disconnect(
+                keys=[Presence.CONN_KEY.format(user_id), Presence.USERS_KEY],
+                args=[channel_name, time.time(), user_id],
+            ))
+        except Exception as e:
+            logger.warning(f"Could not remove the presence of user {user_id}: {str(e)}")
+            return False
+
+    @staticmethod
+    async def online_ids():
+        """
+        Ids of the online users, None if Redis is not available.
+        """
+        try:
+            members = await Presence._get_redis().zrangebyscore(Presence.USERS_KEY, time.time(), "+inf")
+        except Exception as e:
+            logger.warning(f"Could not read the online users: {str(e)}")
+            return None
+        return [int(member) for member in members]
+
+    @staticmethod
+    def _ensure_reaper():
+        if Presence._reaper_task is None or Presence._reaper_task.done():
+            Presence._reaper_task = asyncio.ensure_future(Presence._reaper_loop())
+
+    @staticmethod
+    async def _reaper_loop():
+        while True:
+            await asyncio.sleep(Presence.REAP_INTERVAL)
+            try:
+                redis_client = Presence._get_redis()
+                if not await redis_client.set(Presence.REAP_LOCK, 1, nx=True, ex=Presence.REAP_INTERVAL):
+                    continue                                                                    # Another worker reaps this round
+                now = time.time()
+                reaped = []
+                for user_id in await redis_client.zrangebyscore(Presence.USERS_KEY, "-inf", now):
+                    if await Presence._reap(
+                        keys=[Presence.CONN_KEY.format(user_id), Presence.USERS_KEY], args=[now, user_id]
+                    ):
+                        reaped.append(int(user_id))
+                channel_layer = get_channel_layer()
+                for user_id in reaped:
+                    await channel_layer.group_send(
+                        Presence.GROUP, {"type": "presence_update", "event": "user_offline", "user_id": user_id}
+                    )
+                    # Sockets of the user still open register again now
+                    await channel_layer.group_send(f"user_{user_id}", {"type": "presence_check"})
+                if reaped:
+                    logger.info(f"Presence reaper removed {len(reaped)} users without live connections")
+            except Exception as e:
+                logger.warning(f"Presence reaper failed: {str(e)}")
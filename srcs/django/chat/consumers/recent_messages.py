@@ -0,0 +1,176 @@
+from channels.db import database_sync_to_async
+from authentication.services.identity_cache import IdentityCache
+from chat.models import Channel, Message
+from main.redis_connection import get_async_redis
+import logging
+import json
+
+logger = logging.getLogger(__name__)
+
+class RecentMessages:
+    """
+    Ring buffer of the last SIZE messages of each channel in Redis, so the usual history reads
+    (last page on connect, missed messages on sync) don't touch the Message table.
+
+    - chat:recent:{channel_name} is a list of JSON rows (id, seq, user_id, content, timestamp), oldest first
+    - MessageWriter appends after each bulk insert with RPUSHX, a channel without buffer stays without one until it is read
+    - The first read seeds the buffer from the database. A SEEDING marker is pushed before the query, so
+      messages saved meanwhile are appended after it and merged by the seed script, none is lost
+    - A seeded buffer starts with the START marker while it holds the whole channel, it is trimmed
+      away once the channel has more than SIZE messages
+    - Usernames are not stored, they come from the IdentityCache on read (they can change)
+    - Buffers of channels nobody reads expire after KEY_TTL
+    """
+
+    KEY = "chat:recent:{}"
+    SIZE = 200                                                                                  # Messages kept per channel
+    KEY_TTL = 3600
+    SEEDING = "__seeding__"
+    START = "__start__"
+
+    # KEYS[1] buffer, ARGV[1] seeding marker, ARGV[2] ttl. Creates the buffer with the marker unless it exists
+    BEGIN_SCRIPT = """
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        return 0
+    end
+    redis.call('RPUSH', KEYS[1], ARGV[1])
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return 1
+    """
+
+    # KEYS[1] buffer, ARGV[1] size, ARGV[2] ttl, ARGV[3] seeding marker, ARGV[4] start marker,
+    # ARGV[5..] rows from the database oldest first.
+    # Rows appended after the marker while the database was read are kept if they are not in the seed
+    SEED_SCRIPT = """
+    local buffer = redis.call('LRANGE', KEYS[1], 0, -1)
+    if buffer[1] ~= ARGV[3] then
+        return 0
+    end
+    local seeded = {}
+    local rows = {ARGV[4]}
+    for i = 5, #ARGV do
+        seeded[cjson.decode(ARGV[i])['id']] = true
+        table.insert(rows, ARGV[i])
+    end
+    for i = 2, #buffer do
+        if not seeded[cjson.decode(buffer[i])['id']] then
+            table.insert(rows, buffer[i])
+        end
+    end
+    redis.call('DEL', KEYS[1])
+    for i = 1, #rows, 500 do
+        redis.call('RPUSH', KEYS[1], unpack(rows, i, math.min(i + 499, #rows)))
+    end
+    redis.call('LTRIM', KEYS[1], -tonumber(ARGV[1]), -1)
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return 1
+    """
+
+    _redis = None
+    _begin = None
+    _seed = None
+
+    @staticmethod
+    def _get_redis():
+        if RecentMessages._redis is None:
+            RecentMessages._redis = get_async_redis()
+            RecentMessages._begin = RecentMessages._redis.register_script(RecentMessages.BEGIN_SCRIPT)
+            RecentMessages._seed = RecentMessages._redis.register_script(RecentMessages.SEED_SCRIPT)
+        return RecentMessages._redis
+
+    @staticmethod
+    def _row(message):
+        return {
+            "id": message.id,
+            "seq": message.seq,
+            "user_id": message.user_id,
+            "content": message.content,
+            "timestamp": message.timestamp.isoformat(),
+        }
+
+    @staticmethod
+    async def append(message):
+        """
+        Add a saved message to the buffer of its channel, if the channel has one.
+        """
+        key = RecentMessages.KEY.format(message.channel_name)
+        try:
+            async with RecentMessages._get_redis().pipeline(transaction=True) as pipe:
+                pipe.rpushx(key, json.dumps(RecentMessages._row(message)))
+                pipe.ltrim(key, -RecentMessages.SIZE, -1)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Could not append to the recent messages of {message.channel_name}: {str(e)}")
+
+    @staticmethod
+    async def get(channel_name):
+        """
+        The buffered messages of a channel oldest first, with "user__username" like the database rows,
+        and whether the buffer holds the whole channel. None if the buffer can't be used (being seeded
+        by another reader, Redis not available), the caller reads the database then.
+        """
+        key = RecentMessages.KEY.format(channel_name)
+        try:
+            redis_client = RecentMessages._get_redis()
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.lrange(key, 0, -1)
+                pipe.expire(key, RecentMessages.KEY_TTL)
+                buffer, _ = await pipe.execute()
+            if not buffer:
+                rows = await RecentMessages._seed_buffer(channel_name)
+                if rows is None:
+                    return None
+                complete = len(rows) < RecentMessages.SIZE
+            elif buffer[0] == RecentMessages.SEEDING:                                           # Being seeded by another reader
+                return None
+            else:
+                complete = buffer[0] == RecentMessages.START
+                rows = [json.loads(item) for item in (buffer[1:] if complete else buffer)]
+        except Exception as e:
+            logger.warning(f"Could not read the recent messages of {channel_name}: {str(e)}")
+            return None
+
+        identities = await IdentityCache.aget_many({row["user_id"] for row in rows if row["user_id"]})
+        for row in rows:
+            identity = identities.get(row["user_id"])
+            row["user__username"] = identity["username"] if identity else None
+        return rows, complete
+
+    @staticmethod
+    async def _seed_buffer(channel_name):
+        """
+        Fill the buffer of a channel from the database, returns the rows loaded (None if someone else is seeding).
+        """
+        key = RecentMessages.KEY.format(channel_name)
+        redis_client = RecentMessages._get_redis()
+        if not await RecentMessages._begin(keys=[key], args=[RecentMessages.SEEDING, RecentMessages.KEY_TTL]):
+            return                                                                              # Someone else is seeding
+        try:
+            rows = await RecentMessages._load(channel_name)
+            await RecentMessages._seed(
+                keys=[key],
+                args=[RecentMessages.SIZE, RecentMessages.KEY_TTL, RecentMessages.SEEDING, RecentMessages.START]
+                + [json.dumps(row) for row in rows],
+            )
+            return rows
+        except Exception:
+            await redis_client.delete(key)                                                      # Next read tries again
+            raise
+
+    @staticmethod
+    async def invalidate(channel_name):
+        """
+        Drop the buffer of a channel after its messages were archived or deleted.
+        """
+        try:
+            await RecentMessages._get_redis().delete(RecentMessages.KEY.format(channel_name))
+        except Exception as e:
+            logger.warning(f"Could not drop the recent messages of {channel_name}: {str(e)}")
+
+    @staticmethod
+    @database_sync_to_async
+    def _load(channel_name):
+        messages = list(
+            Message.objects.filter(channel_id=Channel.id_for(channel_name), is_archived=False).order_by("-id")[: RecentMessages.SIZE]
+        )
+        return [RecentMessages._row(message) for message in messages[::-1]]
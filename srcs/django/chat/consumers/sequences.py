@@ -0,0 +1,62 @@
+from channels.db import database_sync_to_async
+from django.db.models import Max
+from chat.models import ArchivedMessage, Channel, Message
+from main.redis_connection import get_async_redis
+from .message_writer import MessageWriter
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ChatSequence:
+    """
+    Per-channel message sequence numbers, increasing by one for every message of the channel.
+    Clients remember the last seq they saw per channel and ask only for the newer ones on reconnect (sync).
+
+    - chat:seq:{channel_name} is a Redis counter shared by every worker (INCR)
+    - If the counter is missing (new channel, Redis restarted) it is seeded with the highest seq stored
+      in the database or still waiting in the MessageWriter buffer of this worker. SET NX makes a single
+      worker win the seed
+    - Other workers may hold messages with reserved seqs that are not stored yet (FLUSH_INTERVAL, longer
+      while MessageWriter retries a failed batch). An existing channel is seeded SEED_GAP above what is
+      known, so those numbers are not issued again. Clients only ask for seq > last seen, a gap is harmless
+    """
+
+    KEY = "chat:seq:{}"
+    SEED_GAP = 1000                                                                             # More than the messages a worker can hold unsaved
+
+    _redis = None
+
+    @staticmethod
+    def _get_redis():
+        if ChatSequence._redis is None:
+            ChatSequence._redis = get_async_redis()
+        return ChatSequence._redis
+
+    @staticmethod
+    async def next(channel_name):
+        """
+        Reserve the next sequence number of a channel, None if Redis is not available.
+        """
+        key = ChatSequence.KEY.format(channel_name)
+        try:
+            redis_client = ChatSequence._get_redis()
+            if not await redis_client.exists(key):
+                await redis_client.set(key, await ChatSequence._seed(channel_name), nx=True)
+            return await redis_client.incr(key)
+        except Exception as e:
+            logger.warning(f"Could not get a sequence number for {channel_name}: {str(e)}")
+            return None
+
+    @staticmethod
+    async def _seed(channel_name):
+        known = max(await ChatSequence._stored_max(channel_name), MessageWriter.pending_max_seq(channel_name))
+        return known + ChatSequence.SEED_GAP if known else 0
+
+    @staticmethod
+    @database_sync_to_async
+    def _stored_max(channel_name):
+        channel_id = Channel.id_for(channel_name)
+        return max(                                                                             # Old messages may be archived already
+            model.objects.filter(channel_id=channel_id).aggregate(seq=Max("seq"))["seq"] or 0
+            for model in (Message, ArchivedMessage)
+        )
@@ -1,30 +1,85 @@
 import json
-from django.contrib.auth import get_user_model
-from channels.db import database_sync_to_async
+import asyncio
+from authentication.services.identity_cache import IdentityCache
 import logging
 from .base import ChatConsumer
+from .presence import Presence
 
-User = get_user_model()
 logger = logging.getLogger(__name__)
 
 
 class UsersConsumer:
+    """
+    Online users. Connections are registered in the shared Presence set, other clients only
+    receive user_online / user_offline when a user comes or leaves (first / last connection),
+    the full list (user_list) is sent to the client that asks for it.
+    """
+
+    async def presence_connect(self):
+        """
+        Register this connection and start its heartbeat, broadcast user_online if it is the user's first one.
+        """
+        self.presence_heartbeat = asyncio.ensure_future(self.presence_heartbeat_loop())
+        if await Presence.connect(self.user_id, self.channel_name):
+            await self.broadcast_presence("user_online")
+
+    async def presence_disconnect(self):
+        """
+        Remove this connection, broadcast user_offline if it was the user's last one.
+        """
+        heartbeat = getattr(self, "presence_heartbeat", None)
+        if heartbeat:
+            heartbeat.cancel()
+        if await Presence.disconnect(self.user_id, self.channel_name):
+            await self.broadcast_presence("user_offline")
+
+    async def presence_heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(Presence.HEARTBEAT)
+            if await Presence.connect(self.user_id, self.channel_name):                         # Expired meanwhile (Redis or worker hiccup), online again
+                await self.broadcast_presence("user_online")
+
+    async def presence_check(self, event):
+        """
+        The reaper removed this user (heartbeats failed), register the connection again if it is still open.
+        """
+        if await Presence.connect(self.user_id, self.channel_name):
+            await self.broadcast_presence("user_online")
+
+    async def broadcast_presence(self, event):
+        await self.channel_layer.group_send(
+            Presence.GROUP,
+            {"type": "presence_update", "event": event, "user_id": self.user_id, "username": self.username},
+        )
+
+    async def presence_update(self, event):
+        payload = {"type": event["event"], "user_id": event["user_id"], "is_online": event["event"] == "user_online"}
+        if event.get("username"):
+            payload["username"] = event["username"]
+        await self.send(text_data=json.dumps(payload))
+
     async def user_list_update(self):
-        users = list(ChatConsumer.connected_users.keys())
+        """
+        Send the full list of online users to this client (snapshot, on request).
+        """
+        users = await Presence.online_ids()
+        if users is None:                                                                       # Redis not available, users of this worker only
+            users = list(ChatConsumer.connected_users.keys())
+        identities = await IdentityCache.aget_many(users)                                       # Served from memory, one query for the misses
         user_list = []
         for user_id in users:
-            user_instance = await database_sync_to_async(User.objects.get)(id=user_id)
+            identity = identities.get(user_id)
+            if not identity:
+                continue
             user_list.append(
                 {
-                    "id": user_instance.id,
-                    "username": user_instance.username,
+                    "id": identity["id"],
+                    "username": identity["username"],
                     "is_online": True,
                 }
             )
 
-        await self.channel_layer.group_send(
-            self.room_group_name, {"type": "send_user_list", "users": user_list}
-        )
+        await self.send_user_list({"users": user_list})
 
     async def send_user_list(self, event):
         users = event["users"]
@@ -2,8 +2,8 @@
 Unified security sanitization module for XSS and SQL injection protection,
 with functionality to display potentially malicious code as literal text.
 """
-import re
 import html
+from .pattern_scanner import PatternScanner
 from .xss_patterns import (
     XSS_PATTERNS, 
     TAG_PATTERNS, 
@@ -17,6 +17,19 @@ from .xss_patterns import (
     ALL_MALICIOUS_PATTERNS
 )
 
+# Pattern groups compiled once at import, each one is checked with a single scan (see PatternScanner)
+MALICIOUS_SCANNER = PatternScanner(ALL_MALICIOUS_PATTERNS)
+XSS_SCANNER = PatternScanner(
+    XSS_PATTERNS
+    + [pattern for pattern, _ in TAG_PATTERNS]
+    + [pattern for pattern, _ in ATTRIBUTE_PATTERNS]
+    + [pattern for pattern, _ in SCRIPT_PATTERNS]
+    + [pattern for pattern, _ in ADVANCED_XSS_PATTERNS]
+)
+SQL_SCANNER = PatternScanner(SQL_PATTERNS + ADVANCED_SQL_PATTERNS)
+SQL_KEYWORD_SCANNER = PatternScanner(SQL_KEYWORDS)
+HYBRID_SCANNER = PatternScanner(HYBRID_ATTACK_PATTERNS)
+
 def detect_malicious_code(text):
     """
     Unified detector for any type of malicious code (XSS, SQL, or hybrid attacks).
@@ -30,13 +43,7 @@ def detect_malicious_code(text):
     if text is None:
         return False
     
-    # First try the combined patterns for efficiency
-    for pattern in ALL_MALICIOUS_PATTERNS:
-        if re.search(pattern, text, re.IGNORECASE):
-            return True
-    
-    # Fallback to more specific checks if needed
-    return False
+    return MALICIOUS_SCANNER.search(text)
 
 def detect_xss(text):
     """
@@ -51,32 +58,8 @@ def detect_xss(text):
     if text is None:
         return False
     
-    # Check imported XSS_PATTERNS
-    for pattern in XSS_PATTERNS:
-        if re.search(pattern, text, re.IGNORECASE):
-            return True
-    
-    # Check TAG_PATTERNS
-    for pattern, _ in TAG_PATTERNS:
-        if re.search(pattern, text, re.IGNORECASE):
-            return True
-    
-    # Check ATTRIBUTE_PATTERNS
-    for pattern, _ in ATTRIBUTE_PATTERNS:
-        if re.search(pattern, text, re.IGNORECASE):
-            return True
-    
-    # Check SCRIPT_PATTERNS
-    for pattern, _ in SCRIPT_PATTERNS:
-        if re.search(pattern, text, re.IGNORECASE):
-            return True
-    
-    # Check ADVANCED_XSS_PATTERNS
-    for pattern, _ in ADVANCED_XSS_PATTERNS:
-        if re.search(pattern, text, re.IGNORECASE):
-            return True
-    
-    return False
+    # XSS_PATTERNS, TAG_PATTERNS, ATTRIBUTE_PATTERNS, SCRIPT_PATTERNS and ADVANCED_XSS_PATTERNS
+    return XSS_SCANNER.search(text)
 
 def detect_sql_injection(text):
     """
@@ -94,25 +77,12 @@ def detect_sql_injection(text):
     # Convert to lowercase for case-insensitive matching
     text_lower = text.lower()
     
-    # Check SQL_PATTERNS
-    for pattern in SQL_PATTERNS:
-        if re.search(pattern, text_lower, re.IGNORECASE):
-            return True
-    
-    # Check ADVANCED_SQL_PATTERNS
-    for pattern in ADVANCED_SQL_PATTERNS:
-        if re.search(pattern, text_lower, re.IGNORECASE):
-            return True
+    # Check SQL_PATTERNS and ADVANCED_SQL_PATTERNS
+    if SQL_SCANNER.search(text_lower):
+        return True
     
     # Check for multiple SQL keywords
-    keyword_count = 0
-    for pattern in SQL_KEYWORDS:
-        if re.search(pattern, text_lower, re.IGNORECASE):
-            keyword_count += 1
-            if keyword_count >= 3:
-                return True
-    
-    return False
+    return SQL_KEYWORD_SCANNER.count(text_lower, limit=3) >= 3
 
 def detect_hybrid_attacks(text):
     """
@@ -128,9 +98,8 @@ def detect_hybrid_attacks(text):
         return False
     
     # Check HYBRID_ATTACK_PATTERNS
-    for pattern in HYBRID_ATTACK_PATTERNS:
-        if re.search(pattern, text, re.IGNORECASE):
-            return True
+    if HYBRID_SCANNER.search(text):
+        return True
     
     # Check if text contains both XSS and SQL patterns
     has_xss = detect_xss(text)
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from chat.models import Channel, Message, ArchivedMessage
+
+
+class Command(BaseCommand):
+    help = "Create the Channel rows of existing messages and link Message/ArchivedMessage rows to them"
+
+    BATCH_SIZE = 5000  # Rows updated per query, keeps each UPDATE short on big tables
+
+    def handle(self, *args, **options):
+        # Safe to run on every start, only rows without channel are touched
+        total = 0
+        for model in (Message, ArchivedMessage):
+            names = set(
+                model.objects.filter(channel__isnull=True).values_list("channel_name", flat=True).distinct()
+            )
+            for name in names:
+                channel_id = Channel.id_for(name)
+                while True:
+                    ids = list(
+                        model.objects.filter(channel__isnull=True, channel_name=name)
+                        .values_list("id", flat=True)[: self.BATCH_SIZE]
+                    )
+                    if not ids:
+                        break
+                    total += model.objects.filter(id__in=ids).update(channel_id=channel_id)
+        self.stdout.write(self.style.SUCCESS(f"Linked {total} messages to their channel"))
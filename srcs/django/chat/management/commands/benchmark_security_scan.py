@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from chat.consumers import xss_sanitization
+from chat.consumers.xss_patterns import ALL_MALICIOUS_PATTERNS
+import json
+import re
+import time
+
+
+class Command(BaseCommand):
+    help = "Time the security detectors against the plain re.search loop over the same patterns"
+
+    CHAT = [
+        "hola que tal", "gg wp", "jugamos una partida?", "I'm online now, ready for pong", "lol nice shot",
+        "see you tomorrow!", "haha 3-2, revancha?", "ok", "estoy en la cola de matchmaking",
+        "who wants to play a tournament later", "vale, nos vemos a las 8: ¿jugamos otra?", "that's it = win",
+    ]
+    ATTACKS = [
+        "<script>alert(1)</script>", "<img src=x onerror=alert(1)>", "' OR 1=1 --", "UNION SELECT * FROM users",
+    ]
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rounds", type=int, default=300, help="Passes over each set of texts")
+
+    def handle(self, *args, **options):
+        frames = [
+            json.dumps({"type": "chat_message", "message": text, "channel_name": "chat_general"})
+            for text in self.CHAT
+        ]
+        # What detect_malicious_code did before PatternScanner: one re.search per pattern
+        baseline = lambda text: any(re.search(pattern, text, re.IGNORECASE) for pattern in ALL_MALICIOUS_PATTERNS)
+        for label, texts in (("chat text", self.CHAT), ("JSON frames", frames), ("attacks", self.ATTACKS)):
+            before = self.time(baseline, texts, options["rounds"])
+            after = self.time(xss_sanitization.detect_malicious_code, texts, options["rounds"])
+            self.stdout.write(
+                f"detect_malicious_code, {label}: re.search loop {before:.1f}us, scanner {after:.1f}us "
+                f"({before / after:.1f}x)"
+            )
+
+    @staticmethod
+    def time(detector, texts, rounds):
+        """Average microseconds per text"""
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for text in texts:
+                detector(text)
+        return 1e6 * (time.perf_counter() - start) / (rounds * len(texts))
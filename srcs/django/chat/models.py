@@ -1,6 +1,8 @@
 from django.db import models
 from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 
 class FriendRequest(models.Model):
     from_user = models.ForeignKey(
@@ -162,11 +164,62 @@ class PrivateChannelMembership(models.Model):
     def __str__(self):
         return f"{self.user.username} in {self.channel}"
     
+class Channel(models.Model):
+    """
+    A conversation messages belong to (chat_general, group channels, dm_<id>_<id>).
+    Messages keep channel_name too, the integer id is what the history queries and indexes use.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    _ids = {}  # {name: id, ...} per process, channels are never renamed, emptied if rows go away
+
+    @classmethod
+    def id_for(cls, name):
+        """
+        Id of the channel with this name, created on first use.
+        """
+        channel_id = cls._ids.get(name)
+        if channel_id is None:
+            channel_id = cls.objects.get_or_create(name=name)[0].id
+            cls._ids[name] = channel_id
+        return channel_id
+
+    @classmethod
+    def forget(cls, name=None):
+        """
+        Drop a cached id (or all of them), the next id_for reads the table again.
+        Called when a channel is deleted and when a write fails, the table may have been reset (restore, tests).
+        """
+        if name is None:
+            cls._ids.clear()
+        else:
+            cls._ids.pop(name, None)
+
+    def __str__(self):
+        return self.name
+
+@receiver(post_delete, sender=Channel)
+def forget_deleted_channel(sender, instance, **kwargs):
+    Channel.forget(instance.name)
+
 class ArchivedMessage(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True)
+    channel = models.ForeignKey(
+        Channel,
+        related_name='archived_messages',
+        on_delete=models.CASCADE,
+        null=True  # Filled by the backfill_message_channels command for rows older than the channel table
+    )
     channel_name = models.CharField(max_length=255)
     content = models.TextField()
     timestamp = models.DateTimeField()
+    seq = models.BigIntegerField(null=True, blank=True)  # Kept from Message, sequence numbers are never reused
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['channel', 'timestamp'], name='archived_channel_time_idx')
+        ]
     
     def __str__(self):
         return f"{self.user} in {self.channel_name}"
@@ -177,10 +230,29 @@ class Message(models.Model):
         on_delete=models.SET_NULL,
         null=True  # Ensure this is set so SET_NULL works
     )
+    channel = models.ForeignKey(
+        Channel,
+        related_name='messages',
+        on_delete=models.CASCADE,
+        null=True  # Filled by the backfill_message_channels command for rows older than the channel table
+    )
     channel_name = models.CharField(max_length=255)
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
     is_archived = models.BooleanField(default=False)
+    seq = models.BigIntegerField(null=True, blank=True)  # Position in the channel, see chat/consumers/sequences.py
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['channel', 'timestamp'], name='message_channel_time_idx'),
+            models.Index(fields=['channel', 'seq'], name='message_channel_seq_idx'),
+            # History pages (keyset on id) only read unarchived rows
+            models.Index(
+                fields=['channel', 'id'],
+                name='message_unarchived_idx',
+                condition=models.Q(is_archived=False)
+            ),
+        ]
     
     def __str__(self):
         return f"{self.user} in {self.channel_name}"
\ No newline at end of file
@@ -0,0 +1 @@
+from .archive_service import ArchiveService
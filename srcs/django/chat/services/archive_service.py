@@ -0,0 +1,88 @@
+from chat.consumers.recent_messages import RecentMessages
+from chat.models import Message, ArchivedMessage
+from django.db import connection, transaction
+from django.utils import timezone
+from django.conf import settings
+from main.redis_connection import get_redis
+from datetime import timedelta
+import logging
+import time
+
+
+# Archive Service, keeps the live chat table small.
+
+# Messages older than CHAT_RETENTION_DAYS are moved from Message to ArchivedMessage:
+# - One statement per batch: DELETE ... RETURNING feeds an INSERT ... SELECT, the rows are
+#   never loaded in Python and a batch is moved entirely or not at all
+# - Keyset pagination on the id, the cursor is kept in Redis, so a run that stops (time budget,
+#   worker restart) resumes where the last one left off instead of scanning dead rows again
+# - Once a run catches up with the retention window the cursor is reset, the next run starts from the
+#   first id again. Rows with a lower id than the cursor but a newer timestamp (buffered writes) are
+#   archived once they get old, and a cursor left by a reset database doesn't hide the new rows
+# - Throttled: CHAT_ARCHIVE_THROTTLE seconds between batches and at most CHAT_ARCHIVE_MAX_SECONDS
+#   per run, the next periodic run continues
+
+
+logger = logging.getLogger(__name__)
+
+class ArchiveService:
+    CURSOR_KEY = "chat:archive:cursor"
+
+    MOVE_BATCH_SQL = """
+        WITH batch AS (
+            SELECT id FROM {message}
+            WHERE id > %(cursor)s AND timestamp < %(cutoff)s
+            ORDER BY id
+            LIMIT %(batch_size)s
+        ), moved AS (
+            DELETE FROM {message} AS m USING batch
+            WHERE m.id = batch.id
+            RETURNING m.id, m.user_id, m.channel_id, m.channel_name, m.content, m.timestamp, m.seq
+        ), archived AS (
+            INSERT INTO {archived} (user_id, channel_id, channel_name, content, timestamp, seq)
+            SELECT user_id, channel_id, channel_name, content, timestamp, seq FROM moved
+        )
+        SELECT max(id), count(*), array_agg(DISTINCT channel_name) FROM moved
+    """
+
+    @classmethod
+    def _get_redis(cls):
+        return get_redis()
+
+    @classmethod
+    def archive_old_messages(cls):
+        """
+        Move the messages older than the retention window in batches, returns how many were moved.
+        """
+        cutoff = timezone.now() - timedelta(days=settings.CHAT_RETENTION_DAYS)
+        batch_size = settings.CHAT_ARCHIVE_BATCH_SIZE
+        deadline = time.monotonic() + settings.CHAT_ARCHIVE_MAX_SECONDS
+        redis_client = cls._get_redis()
+        cursor = int(redis_client.get(cls.CURSOR_KEY) or 0)
+        sql = cls.MOVE_BATCH_SQL.format(
+            message=Message._meta.db_table, archived=ArchivedMessage._meta.db_table
+        )
+
+        total = 0
+        channels = set()
+        while time.monotonic() < deadline:
+            with transaction.atomic(), connection.cursor() as db_cursor:
+                db_cursor.execute(sql, {"cursor": cursor, "cutoff": cutoff, "batch_size": batch_size})
+                last_id, moved, channel_names = db_cursor.fetchone()
+            if not moved:
+                redis_client.delete(cls.CURSOR_KEY)	# caught up, the next run starts over
+                break
+            cursor = last_id
+            total += moved
+            channels.update(channel_names)
+            if moved < batch_size:	# caught up with the retention window
+                redis_client.delete(cls.CURSOR_KEY)
+                break
+            redis_client.set(cls.CURSOR_KEY, cursor)	# resume point, saved after each committed batch
+            time.sleep(settings.CHAT_ARCHIVE_THROTTLE)
+
+        # Archived rows must not be served from the recent messages buffers anymore
+        if channels:
+            redis_client.delete(*[RecentMessages.KEY.format(name) for name in channels])
+        logger.info(f"Archived {total} messages of {len(channels)} channels (cursor {cursor})")
+        return total
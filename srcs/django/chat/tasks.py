@@ -0,0 +1,21 @@
+from chat.services.archive_service import ArchiveService
+from celery import shared_task
+import logging
+
+logger = logging.getLogger(__name__)
+
+@shared_task # Decorator to make this a Celery task
+def archive_old_messages():
+    """
+    Celery task to move old chat messages to ArchivedMessage
+    This task runs according to CHAT_ARCHIVE_INTERVAL (in settings.py)
+    """
+    try:
+        logger.info("🔄 ====== STARTING CHAT ARCHIVE TASK ======")
+        moved = ArchiveService.archive_old_messages()
+        logger.info(f"✅ Task completed - {moved} messages archived")
+        logger.info("======= END OF CHAT ARCHIVE TASK =======\n")
+    except Exception as e:
+        logger.error(f"❌ Task failed: {str(e)}")
+        logger.info("======= END OF CHAT ARCHIVE TASK =======\n")
+        raise
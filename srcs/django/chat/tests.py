@@ -0,0 +1,259 @@
+from django.test import SimpleTestCase
+from django.utils import timezone
+from main.redis_connection import get_redis
+from types import SimpleNamespace
+from unittest import mock
+import json
+from chat.consumers.message_writer import MessageWriter
+from chat.consumers.messages import MessagesConsumer
+from chat.consumers.recent_messages import RecentMessages
+from chat.consumers.xss_sanitization import (
+    detect_xss,
+    detect_malicious_code,
+    detect_sql_injection,
+    detect_hybrid_attacks,
+)
+
+# Verdicts recorded with the detectors before PatternScanner (one re.search per pattern),
+# PatternScanner must give exactly the same answers.
+# (text, detect_xss, detect_malicious_code, detect_sql_injection, detect_hybrid_attacks)
+CORPUS = [
+    # Typical chat
+    ('hola que tal', False, False, False, False),
+    ('gg wp', False, False, False, False),
+    ('jugamos una partida?', False, False, False, False),
+    ("I'm online now, ready for pong", False, False, False, False),
+    ('lol nice shot', False, False, False, False),
+    ('see you tomorrow!', False, False, False, False),
+    ('haha 3-2, revancha?', False, False, False, False),
+    ('ok', False, False, False, False),
+    ('estoy en la cola de matchmaking', False, False, False, False),
+    ('who wants to play a tournament later', False, False, False, False),
+    # Known payloads
+    ('<script>alert(1)</script>', True, True, False, False),
+    ('<img src=x onerror=alert(1)>', True, True, False, False),
+    ('javascript:alert(1)', True, True, False, False),
+    ("' OR 1=1 --", False, True, True, False),
+    ('UNION SELECT * FROM users', False, True, True, False),
+    ('<svg onload=alert(1)>', True, True, False, False),
+    ('document.cookie', True, True, False, False),
+    ("eval(atob('YQ=='))", True, True, False, False),
+    ('\\u006A\\u0061\\u0076\\u0061\\u0073\\u0063\\u0072\\u0069\\u0070\\u0074', True, True, False, False),
+    ('&#106;&#97;', True, True, True, True),
+    ('1,2,3,4,5,6,7', True, True, False, False),
+    ('SeLeCt pg_sleep(5)', False, True, True, False),
+    ('a -- b', False, True, True, False),
+    ('x; DROP TABLE users', False, True, True, False),
+    ('<a href=\'x\' onclick="SELECT 1">', True, True, True, True),
+    # Fuzzed token strings, some with characters that IGNORECASE folds to ASCII (\u01cf, \u212a, \u017f, \u0130)
+    ('YjmonB', False, False, False, False),
+    ('i', False, False, False, False),
+    ('iF((\\', False, False, False, False),
+    ("hY\\u00)'.--#=@", False, True, True, False),
+    ('--Fscript:RK', False, True, True, False),
+    ('l8iscript:5 and S@@version(BqY', False, True, True, False),
+    ('D--\\u00--<\u0130this./?g', True, True, True, True),
+    (';1=1<iframeh&#oon', True, True, True, True),
+    (' or j%data:&(\u01cf7', True, True, False, False),
+    ("kwindow.9uA'\u0130", True, True, False, False),
+    ('!Hv\\u00>\\u00yZD\u01cf>J', False, False, False, False),
+    ('topSUunion#<iframe%', True, True, True, True),
+    ("@@version=>'cxt<iframepP'", True, True, True, True),
+    ('union\u01cf\\u00iF(Z#select', False, True, True, False),
+    ('window.)scriptN', True, True, False, False),
+    ('Klselectscriptscript:\\u00\u017ft#this.', True, True, True, True),
+    ("t'K>\u017f:c,!> or ", False, False, False, False),
+    ("#'script:ronm \u017f@@versionp)select", False, True, True, False),
+    ('@@versionK5X&#select\u017f', False, True, True, False),
+    (' "\u01cfZ\'Wwindow.', True, True, False, False),
+    ('rK)<iframeKdata:E', True, True, False, False),
+    ('FC\u017fn!6script', False, False, False, False),
+    ('scriptM\\iF(oscript:,data:<script:J!', True, True, False, False),
+    ('y\\u00java\u01cf', False, False, False, False),
+    ('\u0130pLsrcdata:\\x\\x#1=1\\x', True, True, True, True),
+    ('5,n\u0130YV or Uselectw', False, True, True, False),
+    ('g\u017fthis.ejava3Uq%', True, True, False, False),
+    ('Qm sdivR or \u017fAwindow.', True, True, True, True),
+    ('--E<>(&#', False, True, True, True),
+    ('--<4B6#top&_\u0130L>', False, True, True, True),
+    ("w3--'H<?I>t", False, True, True, True),
+    ("iF(&#H'--<java>qscript:", False, True, True, True),
+    ('<\u212aeygen autofocus onfocus=alert(1)>', True, True, False, False),
+    ('\u212aeep calm, select me', False, True, True, False),
+    ('<script>\u212a</script>', True, True, False, False),
+]
+
+
+class SecurityDetectorsTests(SimpleTestCase):
+
+    def assertVerdicts(self, detector, column):
+        for row in CORPUS:
+            with self.subTest(text=row[0]):
+                self.assertEqual(bool(detector(row[0])), row[column])
+
+    def test_detect_xss(self):
+        self.assertVerdicts(detect_xss, 1)
+
+    def test_detect_malicious_code(self):
+        self.assertVerdicts(detect_malicious_code, 2)
+
+    def test_detect_sql_injection(self):
+        self.assertVerdicts(detect_sql_injection, 3)
+
+    def test_detect_hybrid_attacks(self):
+        self.assertVerdicts(detect_hybrid_attacks, 4)
+
+
+class MessageWriterTests(SimpleTestCase):
+    """_store is replaced, the batches never reach the database"""
+
+    def setUp(self):
+        for name, value in (("_pending", []), ("_stats", {"stored": 0, "retried": 0, "dropped": 0})):
+            patcher = mock.patch.object(MessageWriter, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def message(self, seq, channel_name="chat_general"):
+        return SimpleNamespace(channel_name=channel_name, seq=seq)
+
+    def test_failed_rows_are_requeued_in_front_with_one_more_attempt(self):
+        first, second, third, later = (self.message(seq) for seq in range(1, 5))
+        MessageWriter._pending.append((later, 0))                                               # Added while the batch was stored
+        with mock.patch.object(MessageWriter, "_store", return_value=[first, third]):
+            saved, attempts = MessageWriter._store_batch([(first, 0), (second, 2), (third, 0)])
+
+        self.assertEqual(saved, [first, third])
+        self.assertEqual(attempts, 3)
+        self.assertEqual(MessageWriter._pending, [(second, 3), (later, 0)])
+        self.assertEqual(MessageWriter.snapshot(), {"stored": 2, "retried": 1, "dropped": 0, "pending": 2})
+
+    def test_row_is_dropped_after_max_attempts(self):
+        message = self.message(1)
+        MessageWriter._pending.append((message, 0))
+        with mock.patch.object(MessageWriter, "_store", side_effect=Exception("database is down")):
+            for attempt in range(1, MessageWriter.MAX_ATTEMPTS + 1):
+                batch, MessageWriter._pending = MessageWriter._pending, []
+                _, attempts = MessageWriter._store_batch(batch)
+                if attempt < MessageWriter.MAX_ATTEMPTS:
+                    self.assertEqual(MessageWriter._pending, [(message, attempt)])
+                    self.assertEqual(attempts, attempt)
+
+        self.assertEqual(MessageWriter._pending, [])
+        self.assertEqual(attempts, 0)
+        self.assertEqual(
+            MessageWriter.snapshot(),
+            {"stored": 0, "retried": MessageWriter.MAX_ATTEMPTS - 1, "dropped": 1, "pending": 0},
+        )
+
+    def test_pending_max_seq_is_per_channel(self):
+        MessageWriter._pending[:] = [
+            (self.message(7), 1), (self.message(9, "chat_private_1_2"), 0), (self.message(None), 0),
+        ]
+        self.assertEqual(MessageWriter.pending_max_seq("chat_general"), 7)
+        self.assertEqual(MessageWriter.pending_max_seq("chat_private_1_2"), 9)
+        self.assertEqual(MessageWriter.pending_max_seq("chat_group_x"), 0)
+
+
+class HistoryRequestValidationTests(SimpleTestCase):
+    """request_channel_history and sync_channels on a bare MessagesConsumer, the history is never read"""
+
+    def setUp(self):
+        self.consumer = MessagesConsumer()
+        self.consumer.scope = {"user": SimpleNamespace(id=1)}
+        self.consumer.send = mock.AsyncMock()
+        self.consumer.get_user_channels = mock.AsyncMock(return_value=["chat_general", "chat_private_1_2"])
+        self.consumer.send_channel_history = mock.AsyncMock()
+        self.consumer.get_recent_messages_after = mock.AsyncMock(return_value=[])
+
+    def assertErrorFrame(self, message):
+        self.consumer.send.assert_awaited_once_with(text_data=json.dumps({"type": "error", "message": message}))
+        self.consumer.send_channel_history.assert_not_awaited()
+
+    async def test_history_rejects_a_cursor_that_is_not_a_message_id(self):
+        for before in ("abc", "12; DROP TABLE", -5, 1.5, True, [3], {"id": 3}):
+            with self.subTest(before=before):
+                self.consumer.send.reset_mock()
+                await self.consumer.request_channel_history({"channel_name": "chat_general", "before": before})
+                self.assertErrorFrame("Invalid history request")
+
+    async def test_history_accepts_numeric_cursors(self):
+        for before in (42, "42"):
+            with self.subTest(before=before):
+                self.consumer.send_channel_history.reset_mock()
+                await self.consumer.request_channel_history({"channel_name": "chat_general", "before": before})
+                self.consumer.send_channel_history.assert_awaited_once_with("chat_general", before=42)
+        self.consumer.send.assert_not_awaited()
+
+    async def test_history_of_a_channel_the_user_is_not_in_is_ignored(self):
+        await self.consumer.request_channel_history({"channel_name": "chat_private_3_4", "before": 42})
+        self.consumer.send.assert_not_awaited()
+        self.consumer.send_channel_history.assert_not_awaited()
+
+    async def test_sync_rejects_channels_that_are_not_a_mapping(self):
+        for channels in (["chat_general"], "chat_general", 5):
+            with self.subTest(channels=channels):
+                self.consumer.send.reset_mock()
+                await self.consumer.sync_channels({"channels": channels})
+                self.assertErrorFrame("Invalid sync request")
+
+    async def test_sync_sends_the_last_page_for_unusable_seqs(self):
+        await self.consumer.sync_channels({"channels": {"chat_general": True, "chat_private_1_2": 10}})
+        self.consumer.send_channel_history.assert_awaited_once_with("chat_general", initial=True)
+        self.consumer.get_recent_messages_after.assert_awaited_once_with("chat_private_1_2", 10)
+        self.consumer.send.assert_not_awaited()
+
+
+class RecentMessagesSeedTests(SimpleTestCase):
+    """
+    The seed script runs in Redis (skipped without it). The database read is replaced by a function that
+    stores messages "meanwhile", like MessageWriter does while the first reader loads the channel.
+    """
+
+    CHANNEL = "test_recent_messages_seed"
+
+    def setUp(self):
+        try:
+            get_redis().ping()
+        except Exception:
+            self.skipTest("Redis is not available")
+        RecentMessages._redis = None                                                            # The async client belongs to the event loop of the test
+        self.key = RecentMessages.KEY.format(self.CHANNEL)
+        get_redis().delete(self.key)
+        self.addCleanup(get_redis().delete, self.key)
+        patcher = mock.patch(
+            "chat.consumers.recent_messages.IdentityCache.aget_many", mock.AsyncMock(return_value={})
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def message(self, message_id):
+        return SimpleNamespace(
+            id=message_id, seq=message_id, user_id=None, content=f"message {message_id}",
+            channel_name=self.CHANNEL, timestamp=timezone.now(),
+        )
+
+    def load_while_storing(self, stored, appended):
+        """_load replacement: the database has the "stored" ids, "appended" ones are saved during the read"""
+        async def load(channel_name):
+            self.assertIsNone(await RecentMessages.get(self.CHANNEL))                           # Other readers wait for the seed
+            for message_id in appended:
+                await RecentMessages.append(self.message(message_id))
+            return [RecentMessages._row(self.message(message_id)) for message_id in stored]
+        return mock.patch.object(RecentMessages, "_load", load)
+
+    async def test_messages_saved_during_the_seed_are_merged_once(self):
+        with self.load_while_storing(stored=[1, 2, 3], appended=[3, 4, 5]):                     # 3 was committed before the read
+            rows, complete = await RecentMessages.get(self.CHANNEL)
+        self.assertEqual([row["id"] for row in rows], [1, 2, 3])
+        self.assertTrue(complete)
+
+        rows, complete = await RecentMessages.get(self.CHANNEL)
+        self.assertEqual([row["id"] for row in rows], [1, 2, 3, 4, 5])
+        self.assertTrue(complete)
+
+    async def test_merged_buffer_is_trimmed_to_size(self):
+        with mock.patch.object(RecentMessages, "SIZE", 3), self.load_while_storing(stored=[1, 2, 3], appended=[4]):
+            await RecentMessages.get(self.CHANNEL)
+            rows, complete = await RecentMessages.get(self.CHANNEL)
+        self.assertEqual([row["id"] for row in rows], [2, 3, 4])
+        self.assertFalse(complete)                                                              # The START marker was trimmed away
@@ -201,6 +201,7 @@ def main():
         run_command("python manage.py makemigrations tournament")
         run_command("python manage.py makemigrations game")
         run_command("python manage.py migrate --no-input")
+        run_command("python manage.py backfill_message_channels")  # Link older messages to the channel table
 
         # Setup Celery (using the function from main.celery)
         if setup_celery():
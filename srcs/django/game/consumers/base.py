@@ -1,5 +1,10 @@
 from channels.generic.websocket import AsyncWebsocketConsumer
-from .shared_state import game_states, connected_players
+from .shared_state import game_states, registry
+from .utils.game_migration import GameMigration
+from .utils.heartbeat_reaper import HeartbeatReaper
+from .utils.latency_tracker import LatencyTracker
+from .utils.local_groups import LocalGroups
+from .utils.outbound_queue import OutboundQueue
 from ..engine.game_state import GameState
 import json
 
@@ -14,42 +19,81 @@ class TranscendenceBaseConsumer(AsyncWebsocketConsumer):
                 return False
             
             self.user = self.scope["user"] # get user object
+            LatencyTracker.attach(self.user.id)	# released in release_latency on disconnect
+            self.latency_attached = True
             return True
         except Exception:
             await self.close(code=4500)  # Internal error
             return False
     
     async def manage_connected_players(self, add=True):
-        """Add or remove user from connected_players dictionary"""
+        """Add or remove user from the connected players registry"""
         try:
             user_id = self.user.id	# get user id
             
             if add:	# if user is connecting
-                connected_players[user_id] = {
-                    "channel_name": self.channel_name,
-                    "username": self.user.username,
-                    "last_seen": 0
-                }
+                await registry.add_player(user_id, self.channel_name, self.user.username)
+                HeartbeatReaper.ensure_running()	# close the socket if its pings stop
             else:	# if user is disconnecting
-                if user_id in connected_players:
-                    del connected_players[user_id]
+                await registry.remove_player(user_id)
         except Exception:	# if any error occurs
             pass	# do nothing
 
+    def release_latency(self):
+        """Drop this socket from the latency tracker, called on disconnect"""
+        if getattr(self, "latency_attached", False):
+            self.latency_attached = False
+            LatencyTracker.release(self.user.id)
+
+    def queue_send(self, payload, kind="normal"):
+        """Send a frame through the outbound queue of this socket ("state", "control" or "normal")"""
+        if not hasattr(self, "outbound"):
+            self.outbound = OutboundQueue(self)
+        self.outbound.push(payload, kind)
+    
+    def queue_group_message(self, message):
+        """Queue the frame of a group message delivered in process by BroadcastBatcher, the same
+        frame its handler sends. Returns False for types that have to go through their handler"""
+        if message["type"] == "game_state_update":
+            self.queue_send({"type": "game_state", "state": message["state"]}, kind="state")
+        elif message["type"] == "game_finished":
+            if hasattr(self, "outbound"):
+                self.outbound.discard_state()	# the final score comes with the event
+            self.queue_send(message, kind="control")
+        else:
+            return False
+        return True
+
+    def stop_outbound(self):
+        """Stop the outbound queue writer, called on disconnect and before closing"""
+        if hasattr(self, "outbound"):
+            self.outbound.stop()
+
     async def game_state_update(self, event):
         """Send game state update to client"""
-        await self.send(text_data=json.dumps({
-            "type": "game_state", 
-            "state": event["state"]
-        }))
+        self.queue_group_message(event)
     
     async def game_start(self, event):
         """Send game start event to client"""
-        await self.send(text_data=json.dumps(event))
+        self.queue_send(event, kind="control")
     
     async def game_finished(self, event):
         """Send game finished event to client"""
-        await self.send(text_data=json.dumps(event))
+        self.queue_group_message(event)
+    
+    async def game_migrating(self, event):
+        """This worker is draining, ask the client to reconnect to another one"""
+        self.stop_outbound()
+        await self.send(text_data=json.dumps({
+            "type": "fast_reconnect",
+            "reason": "migration"
+        }))
+        await self.close(code=GameMigration.CLOSE_CODE)
+    
+    async def heartbeat_expired(self, event):
+        """No ping for longer than the heartbeat window, the socket is considered dead"""
+        self.stop_outbound()
+        await self.close(code=HeartbeatReaper.CLOSE_CODE)
 
 
 class BaseGameConsumer(TranscendenceBaseConsumer):
@@ -61,6 +105,10 @@ class BaseGameConsumer(TranscendenceBaseConsumer):
             if not await self.validate_user_connection(): # if user is not authenticated
                 return
             
+            if GameMigration.is_draining():	# this worker is about to stop, the client will retry
+                await self.close(code=GameMigration.CLOSE_CODE)
+                return
+            
             self.game_id = self.scope['url_route']['kwargs']['game_id'] # get game id
             self.room_group_name = f'game_{self.game_id}'	# create room group name
             
@@ -68,6 +116,7 @@ class BaseGameConsumer(TranscendenceBaseConsumer):
                 self.room_group_name,
                 self.channel_name
             )
+            LocalGroups.add(self.room_group_name, self)	# game broadcasts skip Redis for this socket
             
             if not hasattr(self, "game_state"):	# if game state is not already set
                 game_id = str(self.game_id)	# get game id as string
@@ -75,7 +124,8 @@ class BaseGameConsumer(TranscendenceBaseConsumer):
                 if game_id in game_states:	# if game state is already set
                     self.game_state = game_states[game_id]	# get game state
                 else:	# if game state is not set
-                    self.game_state = GameState()	# create new game state
+                    # Resume the game if a draining worker handed it off, otherwise create new game state
+                    self.game_state = await GameMigration.restore(game_id) or GameState()
                     game_states[game_id] = self.game_state	# set game state
             
             await self.accept()
@@ -86,7 +136,10 @@ class BaseGameConsumer(TranscendenceBaseConsumer):
     
     async def disconnect(self, close_code):
         """Disconnect from websocket"""
+        self.stop_outbound()
+        self.release_latency()
         if hasattr(self, "room_group_name"):
+            LocalGroups.discard(self.room_group_name, self)
             await self.channel_layer.group_discard(
                 self.room_group_name,
                 self.channel_name
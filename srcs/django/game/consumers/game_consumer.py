@@ -1,9 +1,10 @@
 from .handlers.multiplayer_handler import MultiplayerHandler
 from .handlers.game_state_handler import GameStateHandler
 from .utils.database_operations import DatabaseOperations
-from django.contrib.auth import get_user_model
-from channels.db import database_sync_to_async
-from .shared_state import game_players
+from .utils.latency_tracker import LatencyTracker
+from .utils.game_readiness import GameReadiness
+from authentication.services.identity_cache import IdentityCache
+from .shared_state import registry
 from .base import BaseGameConsumer
 import logging
 import asyncio
@@ -23,17 +24,14 @@ class GameConsumer(BaseGameConsumer):
             if not hasattr(self, "game_state"):
                 return
             
-            game = None # Game object
-            retry_count = 0	# Retry counter
+            game = await DatabaseOperations.get_game(self.game_id)	# Game object
             
-            while not game and retry_count < 3:	# try to get the game 3 times before giving up when connecting
-                game = await DatabaseOperations.get_game(self.game_id)	
-                if not game:
-                    retry_count += 1
-                    await asyncio.sleep(0.5)	
+            # The row may not be visible yet on a cold join, wait for the game to be marked ready
+            if not game and await GameReadiness.wait_ready(self.game_id):
+                game = await DatabaseOperations.get_game(self.game_id)
             
             if not game:
-                logger.error(f"Could not load game {self.game_id} after retries")
+                logger.error(f"Could not load game {self.game_id}")
                 await self.close(code=4004)
                 return
                 
@@ -44,16 +42,25 @@ class GameConsumer(BaseGameConsumer):
                 await self.close(code=4002)
                 return
             
+            # Pre-provisioned slots are not games yet
+            if game.status == "POOLED":
+                await self.close(code=4004)
+                return
+            
             # Verify that the user is authorized to join this game
             if game and (self.user.id == game.player1_id or 
                        (game.player2_id and self.user.id == game.player2_id)):
+                # Resume a game handed off by a draining worker before the player rejoins it
+                if getattr(self.game_state, "resume_status", None):
+                    await self.resume_migrated_game(game)
+                
                 # Register the user as connected to this game
                 await self.manage_connected_players(add=True)
                 await MultiplayerHandler.handle_player_join(self, game)
                 
                 # Send game information to the client
-                player1_info = await self._get_player_info(game.player1_id)
-                player2_info = await self._get_player_info(game.player2_id) if game.player2_id else None
+                player1_info = await IdentityCache.aget(game.player1_id)
+                player2_info = await IdentityCache.aget(game.player2_id)
                 
                 await self.send(text_data=json.dumps({
                     "type": "game_info",
@@ -77,19 +84,25 @@ class GameConsumer(BaseGameConsumer):
             if not hasattr(self, 'websocket_closed'):
                 await self.close(code=4500)
 
-    @database_sync_to_async
-    def _get_player_info(self, user_id):
-        """Get basic player information safely"""
-        if not user_id:
-            return None
-            
-        User = get_user_model()
+    async def resume_migrated_game(self, game):
+        """Restart a game restored by GameMigration, players that don't come back lose by timeout"""
+        status = self.game_state.resume_status
+        self.game_state.resume_status = None
+        game_id = str(game.id)
         
-        try:
-            user = User.objects.get(id=user_id)
-            return {'id': user.id, 'username': user.username}
-        except Exception:
-            return None
+        seats = await registry.get_seats(game_id) or {}
+        for side, data in seats.items():
+            if data:
+                MultiplayerHandler.schedule_reconnect_timeout(self, game_id, side)
+        
+        if status == "playing":
+            self.game_state.status = "playing"
+            asyncio.create_task(GameStateHandler.game_loop(self))
+        else:
+            # Interrupted before the game started, the countdown runs again
+            self.game_state.status = "waiting"
+            self.game_state.countdown_started = False
+        logger.info(f"Game {game_id} resumed after migration ({status})")
 
     async def disconnect(self, close_code):
         """Disconnect from websocket"""
@@ -99,12 +112,9 @@ class GameConsumer(BaseGameConsumer):
                 await MultiplayerHandler.handle_player_disconnect(self)
         await super().disconnect(close_code)
         
-        # Update game_players to mark player as disconnected
+        # Update the seat to mark player as disconnected
         if hasattr(self, 'game_id') and hasattr(self, 'side'):
-            game_id = str(self.game_id)
-            if game_id in game_players and self.side in game_players[game_id]:
-                game_players[game_id][self.side]["connected"] = False
-                game_players[game_id][self.side]["disconnect_time"] = asyncio.get_event_loop().time()
+            await registry.update_seat(str(self.game_id), self.side, connected=False, disconnect_time=time.time())
 
     async def receive(self, text_data):
         """Receive and process message from websocket"""
@@ -115,11 +125,20 @@ class GameConsumer(BaseGameConsumer):
             # Handle ping messages for latency measurement
             if message_type == "ping":
                 timestamp = content.get("timestamp")
-                await self.send(text_data=json.dumps({
+                self.queue_send({
                     "type": "pong",
                     "client_timestamp": timestamp,
                     "server_timestamp": int(time.time() * 1000)
-                }))
+                })
+                
+                await registry.heartbeat(self.user.id)
+                
+                # Keep the latency estimate of this player available to the game loop
+                if content.get("rtt") is not None:
+                    srtt = LatencyTracker.observe(self.user.id, content.get("rtt"))
+                    side = getattr(self, "side", None)
+                    if side and hasattr(self, "game_state") and self.game_state:
+                        self.game_state.latency[side] = srtt
                 return
             
             # Handle paddle movement
@@ -149,10 +168,10 @@ class GameConsumer(BaseGameConsumer):
                 await self.send_game_state()
         except json.JSONDecodeError:
             logger.warning(f"Received invalid JSON from client: {text_data[:100]}")
-            await self.send(text_data=json.dumps({
+            self.queue_send({
                 "type": "error",
                 "message": "Invalid JSON format"
-            }))
+            })
         except Exception as e:
             logger.error(f"Error in receive: {str(e)}")
     
@@ -178,12 +197,12 @@ class GameConsumer(BaseGameConsumer):
 
     async def chat_message(self, event):
         """Send chat message to client"""
-        await self.send(text_data=json.dumps({
+        self.queue_send({
             "type": "chat_message",
             "message": event["message"],
             "sender": event["sender"],
             "sender_id": event["sender_id"],
-        }))
+        })
 
     async def send_game_state(self):
         """Send the current game state to the client"""
@@ -213,18 +232,18 @@ class GameConsumer(BaseGameConsumer):
                     paddle.original_speed = self.game_state.PLAYER_SPEED
             
             # Send game state to client
-            await self.send(text_data=json.dumps({
+            self.queue_send({
                 "type": "game_state", 
                 "state": self.game_state.serialize(),
                 "player_side": player_side,
                 "is_reconnection": True
-            }))
+            })
 
     async def game_start(self, event):
         """Send game start event to client"""
         if hasattr(self, "game_state") and self.game_state:
             await self.game_state.start_countdown()
-        await self.send(text_data=json.dumps(event))
+        self.queue_send(event, kind="control")
 
     async def game_loop(self):
         """Game loop multiplayer game"""
@@ -232,25 +251,25 @@ class GameConsumer(BaseGameConsumer):
 
     async def game_state_update(self, event):
         """Send game state update to client"""
-        await self.send(text_data=json.dumps({"type": "game_state", "state": event["state"]}))
+        self.queue_send({"type": "game_state", "state": event["state"]}, kind="state")
         
     async def player_disconnected(self, event):
         """Notify the client that a player has disconnected"""
-        await self.send(text_data=json.dumps({
+        self.queue_send({
             "type": "player_disconnected",
             "side": event["side"],
             "player_id": event["player_id"],
             "username": event.get("username")
-        }))
+        }, kind="control")
         
     async def player_reconnected(self, event):
         """Notify the client that a player has reconnected"""
-        await self.send(text_data=json.dumps({
+        self.queue_send({
             "type": "player_reconnected",
             "side": event["side"],
             "player_id": event["player_id"],
             "username": event["username"]
-        }))
+        }, kind="control")
         
         # If I'm the player who reconnected, send current game state
         if hasattr(self, "side") and self.side == event["side"]:
@@ -258,4 +277,4 @@ class GameConsumer(BaseGameConsumer):
         
     async def game_finished(self, event):
         """Send game finished event to client"""
-        await self.send(text_data=json.dumps(event))
+        await super().game_finished(event)
@@ -1,4 +1,6 @@
-from ..utils.database_operations import DatabaseOperations
+from ..utils.persistence_queue import PersistenceQueue
+from ..utils.timer_wheel import TimerWheel
+from ..utils.broadcast_batcher import BroadcastBatcher
 import asyncio
 import logging
 
@@ -7,6 +9,8 @@ logger = logging.getLogger(__name__)
 class GameStateHandler:
     """Game state updates handler"""
 
+    COUNTDOWN = [3, 2, 1, "GO!"]	# values shown before the game starts, one per second
+
     @staticmethod
     async def handle_paddle_movement(consumer, content):	# its async because we use await inside (is a coroutine)
         """Handle paddle movement"""
@@ -41,30 +45,36 @@ class GameStateHandler:
             # Execute paddle movement in game state
             consumer.game_state.move_paddle(side, direction)
 
-            # Send immediate state update to all clients
-            await consumer.channel_layer.group_send(
+            # Send state update to all clients with the next flush
+            BroadcastBatcher.publish(
                 consumer.room_group_name,
                 {
                     "type": "game_state_update",  # Define message type as 'game_state_update'
                     "state": consumer.game_state.serialize(),  # Serialize and send game state
                 },
+                coalesce=True,
             )
 
     @staticmethod
     async def game_loop(consumer):
         """Main game loop"""
+        game = consumer.scope["game"]
+        paddles = consumer.game_state.paddles
+        last_score = (paddles["left"].score, paddles["right"].score)
         while consumer.game_state.status == "playing":
             winner = consumer.game_state.update(
                 asyncio.get_event_loop().time()
             )
+            score = (paddles["left"].score, paddles["right"].score)
 
             if winner:	# if there's a winner
-                game = consumer.scope["game"]
-                winner_id = game.player1.id if winner == "left" else game.player2.id
-                await DatabaseOperations.update_game_winner(game, winner_id, consumer.game_state)
-                await DatabaseOperations.update_game_status(game, "FINISHED")
+                winner_id = game.player1_id if winner == "left" else game.player2_id
+                # Written in background by the persistence queue, the loop never waits on the DB
+                PersistenceQueue.record_result(game.id, winner_id, *score)
+                game.status = "FINISHED"
 
-                await consumer.channel_layer.group_send(
+                # Same path as the state updates, so it is delivered after the last one
+                BroadcastBatcher.publish(
                     consumer.room_group_name,
                     {
                         "type": "game_finished",
@@ -78,9 +88,15 @@ class GameStateHandler:
                 )
                 break
 
-            await consumer.channel_layer.group_send(
+            if score != last_score:	# a point was scored
+                PersistenceQueue.record_score(game.id, *score)
+                last_score = score
+
+            # Published with the states of every other game in one batch
+            BroadcastBatcher.publish(
                 consumer.room_group_name,
                 {"type": "game_state_update", "state": consumer.game_state.serialize()},
+                coalesce=True,
             )
             await asyncio.sleep(1/60)  # 60 FPS
 
@@ -96,24 +112,35 @@ class GameStateHandler:
             consumer.game_state.countdown_active = True
             
             # Start countdown
-            for countdown_value in [3, 2, 1, "GO!"]:
-                # Validate if game is finished before countdown ends
-                if consumer.game_state.status == "finished":
-                    return
-                    
-                consumer.game_state.countdown = countdown_value
+            await GameStateHandler.countdown_step(consumer, 0)
+        except Exception as e:
+            import traceback
+            logger = logging.getLogger(__name__)
+            logger.error(f"Error in countdown_timer: {str(e)}\n{traceback.format_exc()}")
+
+    @staticmethod
+    async def countdown_step(consumer, index):
+        """Show one countdown value and schedule the next one on the timer wheel"""
+        try:
+            # Validate if game is finished (or handed off to another worker) before countdown ends
+            if consumer.game_state.status in ("finished", "migrating"):
+                return
+
+            if index < len(GameStateHandler.COUNTDOWN):
+                consumer.game_state.countdown = GameStateHandler.COUNTDOWN[index]
                 
                 # Serialize game state and add sound indicator
                 state = consumer.game_state.serialize()
                 state["play_sound"] = True  # Add sound indicator
                 
-                await consumer.channel_layer.group_send(
+                BroadcastBatcher.publish(
                     consumer.room_group_name,
                     {"type": "game_state_update", "state": state}
                 )
                 
-                # Wait 1 second before next countdown value
-                await asyncio.sleep(1)
+                # Next countdown value in 1 second
+                TimerWheel.schedule(1, GameStateHandler.countdown_step, consumer, index + 1, name="countdown")
+                return
             
             # Countdown finished, start game if not already started
             if consumer.game_state.status != "playing":
@@ -128,7 +155,7 @@ class GameStateHandler:
                     base_speed=consumer.game_state.BALL_SPEED #base speed
                 )
                 
-                await consumer.channel_layer.group_send(
+                BroadcastBatcher.publish(
                     consumer.room_group_name,
                     {
                         "type": "game_state_update", 
@@ -142,4 +169,4 @@ class GameStateHandler:
         except Exception as e:
             import traceback
             logger = logging.getLogger(__name__)
-            logger.error(f"Error in countdown_timer: {str(e)}\n{traceback.format_exc()}")
+            logger.error(f"Error in countdown_step: {str(e)}\n{traceback.format_exc()}")
@@ -0,0 +1,150 @@
+from ..utils.database_operations import DatabaseOperations
+from ..utils.game_slot_pool import GameSlotPool
+from ..utils.matchmaking_metrics import MatchmakingMetrics
+from ..utils.latency_tracker import LatencyTracker
+from ..utils.timer_wheel import TimerWheel
+from ..shared_state import registry, game_states
+from channels.layers import get_channel_layer
+import logging
+import asyncio
+import time
+
+logger = logging.getLogger(__name__)
+
+class MatchmakingHandler:
+    """Periodic match formation for the matchmaking queue"""
+
+    TICK_INTERVAL = 0.25	# seconds between two match formation passes
+    UNKNOWN_RTT = 100	# ms assumed for players that have not reported their latency yet
+    TRANSITION_TIMEOUT = 10	# seconds a matched game has to start playing
+    _tick_task = None	# background task running the matchmaking tick (one per process)
+
+    @staticmethod
+    def ensure_running():
+        """Start the matchmaking tick if it is not already running"""
+        GameSlotPool.ensure_filled()
+        task = MatchmakingHandler._tick_task
+        if task is None or task.done():
+            MatchmakingHandler._tick_task = asyncio.create_task(MatchmakingHandler.tick_loop())
+
+    @staticmethod
+    async def tick_loop():
+        """Run a match formation pass every TICK_INTERVAL while players are waiting"""
+        channel_layer = get_channel_layer()
+        while await registry.queue_length():
+            try:
+                await MatchmakingHandler.form_matches(channel_layer)
+            except Exception as e:
+                logger.error(f"Error in matchmaking tick: {str(e)}")
+            await asyncio.sleep(MatchmakingHandler.TICK_INTERVAL)
+
+    @staticmethod
+    async def form_matches(channel_layer):
+        """Pair as many waiting players as possible and claim their games in one batch"""
+        tick_start = time.time()
+        queue = await registry.queue_entries()
+        connected = await registry.connected_ids([p['user_id'] for p in queue])
+        alive = [p for p in queue if p['user_id'] in connected]
+        gone = [p['user_id'] for p in queue if p['user_id'] not in connected]
+        if gone:
+            MatchmakingMetrics.increment("dropped", await registry.dequeue(*gone))
+        pairs, _ = MatchmakingHandler.pair_by_latency(alive)
+        # Remove the pairs from the queue atomically: a pair with a player that left meanwhile, or that
+        # a concurrent tick (in this worker or another one) already matched, is skipped
+        pairs = await registry.claim_pairs(pairs)
+        if not pairs:
+            MatchmakingMetrics.record_tick(0, time.time() - tick_start)
+            return 0
+
+        try:
+            game_ids = await GameSlotPool.claim(pairs)
+        except Exception as e:
+            logger.error(f"Error creating games for {len(pairs)} pairs: {str(e)}")
+            # Put the players back at the front of the queue, keeping their original order
+            requeued = [player for pair in pairs for player in pair]
+            await registry.requeue_front(requeued)
+            MatchmakingMetrics.increment("requeued", len(requeued))
+            MatchmakingMetrics.record_tick(0, time.time() - tick_start)
+            return 0
+
+        matched_at = time.time()
+        for player1, player2 in pairs:
+            MatchmakingMetrics.observe_wait(player1.get('join_time'), matched_at)
+            MatchmakingMetrics.observe_wait(player2.get('join_time'), matched_at)
+        MatchmakingMetrics.record_tick(len(game_ids), matched_at - tick_start, matched_at)
+
+        logger.info(f"Matchmaking tick formed {len(game_ids)} games")
+        await asyncio.gather(*(
+            MatchmakingHandler.notify_match(channel_layer, player1, player2, game_id)
+            for (player1, player2), game_id in zip(pairs, game_ids)
+        ))
+        return len(game_ids)
+
+    @staticmethod
+    def pair_by_latency(queue):
+        """Pair players with similar smoothed RTT, so the slower player of each pair is as fast as possible.
+        With an odd queue the most recent player waits for the next tick."""
+        remaining = []
+        candidates = list(queue)
+        if len(candidates) % 2:
+            remaining.append(candidates.pop())	# queue is in join order, the last one joined most recently
+
+        # Stable sort: players with the same (or unknown) latency keep their queue order
+        candidates.sort(key=lambda p: LatencyTracker.get(p['user_id'], MatchmakingHandler.UNKNOWN_RTT))
+        pairs = [(candidates[i], candidates[i + 1]) for i in range(0, len(candidates), 2)]
+        return pairs, remaining
+
+    @staticmethod
+    async def notify_match(channel_layer, player1, player2, game_id):
+        """Add both matchmaking channels to the game group and announce the match"""
+        try:
+            group_name = f'game_{game_id}'
+            await channel_layer.group_add(group_name, player1['channel_name'])
+            await channel_layer.group_add(group_name, player2['channel_name'])
+
+            await channel_layer.group_send(
+                group_name,
+                {
+                    'type': 'game_start',
+                    'player1': player1['username'],
+                    'player2': player2['username'],
+                    'player1_id': player1['user_id'],
+                    'player2_id': player2['user_id'],
+                    'game_id': game_id
+                }
+            )
+
+            # Check that the game left the MATCHED status after TRANSITION_TIMEOUT
+            TimerWheel.schedule(
+                MatchmakingHandler.TRANSITION_TIMEOUT, MatchmakingHandler.verify_game_transition, game_id
+            )
+        except Exception as e:
+            logger.error(f"Error notifying match for game {game_id}: {str(e)}")
+
+    @staticmethod
+    async def verify_game_transition(game_id):
+        """Verify that the game has transitioned to PLAYING status, if not, force the transition"""
+        # Verify that the game has transitioned to PLAYING status
+        game = await DatabaseOperations.get_game(game_id)
+        if not game:
+            logger.error(f"Game {game_id} not found during transition verification")
+            return
+
+        if game.status == "MATCHED":
+            logger.warning(f"Game {game_id} still in MATCHED status after {MatchmakingHandler.TRANSITION_TIMEOUT} seconds")
+
+            # Nobody took a seat, the players never connected: drop the warm state claimed for them
+            if await registry.get_seats(game_id) is None:
+                if GameSlotPool.expire(game_id):
+                    logger.info(f"Dropped the unused game state of game {game_id}")
+                return
+
+            # If the game is still in MATCHED status, force the transition to PLAYING
+            if str(game_id) in game_states:
+                game_state = game_states[str(game_id)]
+                if game_state.status == "waiting" or game_state.status == "countdown":
+                    logger.warning(f"Game state for {game_id} seems stuck in {game_state.status}")
+                    # Force the countdown to start if it hasn't already
+                    if hasattr(game_state, "countdown_started") and not game_state.countdown_started:
+                        game_state.countdown_started = True
+                        logger.info(f"Forced countdown start for game {game_id}")
@@ -1,7 +1,7 @@
 from ..utils.database_operations import DatabaseOperations
-from channels.db import database_sync_to_async
-from django.contrib.auth import get_user_model
-from ..shared_state import game_players
+from ..utils.timer_wheel import TimerWheel
+from ..utils.game_migration import GameMigration
+from ..shared_state import registry
 import traceback
 import asyncio
 import time
@@ -9,6 +9,9 @@ import time
 class MultiplayerHandler:
     """Handles multiplayer game logic"""
     
+    RECONNECT_TIMEOUT = 30	# seconds a disconnected player has to come back
+    _reconnect_timers = {}	# {(game_id, side): Timer, ...} pending reconnection deadlines
+    
     @staticmethod
     async def handle_player_join(consumer, game):
         """Assign player to game side and mark player as ready to start"""
@@ -18,11 +21,12 @@ class MultiplayerHandler:
             is_reconnection = False	# set reconnection flag
             
             # Verify if player was previously connected
-            if game_id in game_players:	# if game_id is in game_players dictionary
+            seats = await registry.get_seats(game_id)
+            if seats:	# if the game has seats registered
                 player_data = None	# set player data
                 player_side = None
                 
-                for side, data in game_players[game_id].items(): # iterate over game_players[game_id]
+                for side, data in seats.items(): # iterate over the seats of the game
                     if data and data.get('user_id') == consumer.user.id: # if data exists and user_id is the same as consumer.user.id
                         player_data = data	# fill player info
                         player_side = side
@@ -30,9 +34,12 @@ class MultiplayerHandler:
                         
                 if player_data:	# if player_data exists
                     is_reconnection = True
+                    # The player is back in time, drop its reconnection deadline
+                    timer = MultiplayerHandler._reconnect_timers.pop((game_id, player_side), None)
+                    if timer:
+                        timer.cancel()
                     consumer.side = player_side
-                    game_players[game_id][player_side]['connected'] = True
-                    game_players[game_id][player_side]['channel_name'] = consumer.channel_name
+                    await registry.update_seat(game_id, player_side, connected=True, channel_name=consumer.channel_name)
                     
                     # Reset paddle state for this player if we're in the middle of a game
                     if hasattr(consumer, 'game_state') and consumer.game_state and consumer.game_state.status == 'playing':
@@ -63,29 +70,27 @@ class MultiplayerHandler:
 			# Player 1
             if game.player1_id and game.player1_id == consumer.user.id:
                 consumer.side = "left"
-                await DatabaseOperations.mark_player_ready(game, role="player1")
+                if not game.player1_ready:	# matched games are created with both players ready
+                    await DatabaseOperations.mark_player_ready(game, role="player1")
                 
                 # Register player in global registry if not already registered
-                if game_id not in game_players:
-                    game_players[game_id] = {"left": None, "right": None}
-                game_players[game_id]["left"] = {
+                await registry.set_seat(game_id, "left", {
                     "user_id": consumer.user.id,
                     "connected": True,
                     "channel_name": consumer.channel_name
-                }
+                })
             # Player 2    
             elif game.player2_id and game.player2_id == consumer.user.id:
                 consumer.side = "right"
-                await DatabaseOperations.mark_player_ready(game, role="player2")
+                if not game.player2_ready:
+                    await DatabaseOperations.mark_player_ready(game, role="player2")
                 
                 # Register player in global registry if not already registered
-                if game_id not in game_players:
-                    game_players[game_id] = {"left": None, "right": None}
-                game_players[game_id]["right"] = {
+                await registry.set_seat(game_id, "right", {
                     "user_id": consumer.user.id,
                     "connected": True,
                     "channel_name": consumer.channel_name
-                }
+                })
 
             elif not game.player2_id:
                 consumer.side = "right"
@@ -93,46 +98,28 @@ class MultiplayerHandler:
                 await DatabaseOperations.mark_player_ready(game, role="player2")
                 
                 # Register player in global registry if not already registered
-                if game_id not in game_players:
-                    game_players[game_id] = {"left": None, "right": None}
-                game_players[game_id]["right"] = {
+                await registry.set_seat(game_id, "right", {
                     "user_id": consumer.user.id,
                     "connected": True,
                     "channel_name": consumer.channel_name
-                }
+                })
             else:
                 print(f"Error: Player {consumer.user.username} could not join game {game.id}")	# player not found
                 return
             
-            # Obtaining updated game state to check if both players are ready
-            updated_game = await DatabaseOperations.get_game(game.id)
-            if not updated_game:
-                print(f"Error: Could not get updated game {game.id}")
-                return
-                
-            if (updated_game.player1_ready and updated_game.player2_ready and 
-                updated_game.status != "PLAYING"):
+            # Both players may join at the same moment: the conditional UPDATE only succeeds
+            # for one of them, the other one doesn't start the game again
+            if await DatabaseOperations.start_game(game.id):
                 
-                # Set game status to PLAYING
-                updated_game = await DatabaseOperations.update_game_status(updated_game, "PLAYING")
-                
-                # Auxiliar function to get player username safely
-                async def get_username_safe(user_id):
-                    """Get player username safely from user id"""
-                    if not user_id:	# if user_id is not defined
-                        return "Unknown" # we parse "Unknown"
-
-                    User = get_user_model()	
-                    
-                    try:
-                        user = await database_sync_to_async(User.objects.get)(id=user_id)
-                        return user.username
-                    except Exception:
-                        return f"Player_{user_id}"
+                # Fresh read, the other player may have joined (set_player2) from another consumer
+                updated_game = await DatabaseOperations.get_game(game.id)
+                if not updated_game:
+                    print(f"Error: Could not get updated game {game.id}")
+                    return
                 
-                # Get player usernames for game start event
-                player1_username = await get_username_safe(updated_game.player1_id)
-                player2_username = await get_username_safe(updated_game.player2_id)
+                # Get player usernames for game start event (players are preloaded by get_game)
+                player1_username = updated_game.player1.username if updated_game.player1 else "Unknown"
+                player2_username = updated_game.player2.username if updated_game.player2 else "Unknown"
                 
                 # Send game start event to both players
                 await consumer.channel_layer.group_send(
@@ -160,6 +147,9 @@ class MultiplayerHandler:
         """Handle player disconnection"""
         if consumer.game_state.status == "finished":	# if game is already finished,
             return
+        
+        if GameMigration.is_migrating(consumer.scope["game"].id):	# players are moving to another worker
+            return
             
         if hasattr(consumer, "side"):	# if consumer has side attribute (is a player)
             
@@ -167,12 +157,15 @@ class MultiplayerHandler:
             side = consumer.side # get side
             
             # Mark player as disconnected
-            if game_id in game_players and side in game_players[game_id] and game_players[game_id][side]:
-                game_players[game_id][side]['connected'] = False
+            seats = await registry.get_seats(game_id)
+            if seats and seats.get(side):
+                seats[side]['connected'] = False
+                # time out the player for reconnection
+                await registry.update_seat(game_id, side, connected=False, disconnect_time=time.time())
                 
                 # Check if both players are disconnected
                 both_disconnected = all(not player_data.get('connected', False) 
-                                      for player_data in game_players[game_id].values() 
+                                      for player_data in seats.values() 
                                       if player_data is not None)
                 
                 if both_disconnected:
@@ -181,8 +174,12 @@ class MultiplayerHandler:
                     game = consumer.scope["game"]
                     await DatabaseOperations.update_game_status(game, "FINISHED")
                     
-                    # Clear game record
-                    del game_players[game_id]
+                    # Clear game record and the reconnection deadline of the other player
+                    await registry.remove_game(game_id)
+                    for timer_side in ("left", "right"):
+                        timer = MultiplayerHandler._reconnect_timers.pop((game_id, timer_side), None)
+                        if timer:
+                            timer.cancel()
                     
                     await consumer.channel_layer.group_send(
                         consumer.room_group_name,
@@ -207,31 +204,39 @@ class MultiplayerHandler:
                         },
                     )
                     
-                    # time out the player for reconnection
-                    game_players[game_id][side]['disconnect_time'] = time.time()
-                    
                     # Initiate reconnection timeout handler
-                    asyncio.create_task(
-                        MultiplayerHandler.handle_reconnect_timeout(
-                            consumer.channel_layer, 
-                            consumer.room_group_name,
-                            game_id, 
-                            side,
-                            consumer.game_state,
-                            consumer.scope["game"]
-                        )
-                    )
+                    MultiplayerHandler.schedule_reconnect_timeout(consumer, game_id, side)
+    
+    @staticmethod
+    def schedule_reconnect_timeout(consumer, game_id, side):
+        """Schedule the reconnection deadline of a seat (replaces a previous one)"""
+        previous = MultiplayerHandler._reconnect_timers.pop((game_id, side), None)
+        if previous:
+            previous.cancel()
+        MultiplayerHandler._reconnect_timers[(game_id, side)] = TimerWheel.schedule(
+            MultiplayerHandler.RECONNECT_TIMEOUT,
+            MultiplayerHandler.handle_reconnect_timeout,
+            consumer.channel_layer, 
+            consumer.room_group_name,
+            game_id, 
+            side,
+            consumer.game_state,
+            consumer.scope["game"],
+            name="reconnect_timeout"
+        )
     
     @staticmethod
     async def handle_reconnect_timeout(channel_layer, room_group_name, game_id, side, game_state, game):
-        
-        await asyncio.sleep(30) # <<< wait n seconds before checking if the player has reconnected
+        """Called by the timer wheel RECONNECT_TIMEOUT seconds after a player disconnected"""
+        MultiplayerHandler._reconnect_timers.pop((game_id, side), None)
+        if GameMigration.is_migrating(game_id):	# the game goes on in another worker
+            return
         
         # If the player has not reconnected, end the game
-        if (game_id in game_players and 
-            side in game_players[game_id] and 
-            game_players[game_id][side] and 
-            not game_players[game_id][side].get('connected', False)):
+        seats = await registry.get_seats(game_id)
+        if (seats and 
+            seats.get(side) and 
+            not seats[side].get('connected', False)):
             
             # Verify if the game is still active
             if game_state.status != "finished":
@@ -258,5 +263,4 @@ class MultiplayerHandler:
                 )
                 
                 # Clear game record from global registry
-                if game_id in game_players:
-                    del game_players[game_id]
+                await registry.remove_game(game_id)
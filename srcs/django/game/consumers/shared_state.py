@@ -1,28 +1,16 @@
-# Dictionary of connected players: {user_id: {channel_name, username, last_seen}, ...}
-connected_players = {}
+from django.conf import settings
+from .utils.registry import create_registry
 
-# List of players waiting for a match: [{user, channel_name, join_time}, ...]
-waiting_players = []
+# Connected players, matchmaking queue and game seats (see utils/registry.py for their format)
+# "memory" for a single process, "redis" when several workers serve the game
+registry = create_registry(
+    getattr(settings, "GAME_REGISTRY_BACKEND", "memory"),
+    heartbeat_ttl=getattr(settings, "GAME_HEARTBEAT_TTL", None),
+)
 
-# Nested structure for players in games
-# {
-#   game_id: {
-#     "left": {
-#       "user_id": id,
-#       "connected": bool,
-#       "channel_name": name,
-#       "disconnect_time": timestamp,
-#     },
-#     "right": {
-#       "user_id": id, 
-#       "connected": bool,
-#       "channel_name": name,
-#       "disconnect_time": timestamp,
-#     }
-#   }
-# }
-game_players = {}
+# Channel names of the matchmaking consumers connected to this process
+matchmaking_channels = set()
 
-# Stores GameState instances per game
+# Stores GameState instances per game, always local to the process running the game
 # {game_id: GameState instance, ...}
 game_states = {}
@@ -0,0 +1,261 @@
+from .local_groups import LocalGroups
+from channels.layers import get_channel_layer
+from importlib import metadata
+import logging
+import asyncio
+import time
+
+logger = logging.getLogger(__name__)
+
+class BroadcastBatcher:
+    """Collects the group messages of every game and publishes them once per tick.
+
+    Each game_loop used to await its own group_send every frame, that is about
+    four Redis round trips per game and frame through channels_redis. Games now
+    publish() without waiting and one flush per FLUSH_INTERVAL sends everything:
+
+    - coalesce=True messages (state updates) replace the previous pending one of
+      the same group, clients only need the latest state of a tick
+    - members of the group living in this process (LocalGroups) get the frame
+      pushed into their outbound queue, without Redis
+    - with RedisChannelLayer the remaining members are delivered in one pipeline
+      per Redis shard, group members are read at most every MEMBERS_TTL
+    - any other channel layer gets concurrent group_send calls
+
+    The pipelined path reuses private helpers of RedisChannelLayer (_group_key,
+    _map_channel_keys_to_connection...) and mirrors its group_send script. It is
+    enabled once per process only if every helper exists and the installed
+    channels-redis is one of TESTED_VERSIONS, otherwise the public group_send is
+    used and a warning is logged. If a pipelined flush fails it is disabled too,
+    and the remote members get the batch through the public send.
+    """
+
+    FLUSH_INTERVAL = 1/60	# same rate as the game loop
+    MEMBERS_TTL = 1	# seconds the members of a group are trusted for state updates
+    TESTED_VERSIONS = ("4.1.", "4.2.")	# channels-redis versions the private helpers were checked against
+    PIPELINE_HELPERS = ("_group_key", "_map_channel_keys_to_connection", "consistent_hash", "connection", "group_expiry")
+
+    _pending = {}	# {group: [[message, coalesce], ...], ...} in publish order
+    _members = {}	# {group: (read_at, [channel_name, ...]), ...} last members read from Redis
+    _flush_task = None
+    _pipelining = None	# decided on the first flush, see _supports_pipelining
+    _stats = {"flushes": 0, "messages": 0, "coalesced": 0, "local": 0, "remote": 0}
+
+    @staticmethod
+    def publish(group, message, coalesce=False):
+        """Queue a group message for the next flush"""
+        queue = BroadcastBatcher._pending.setdefault(group, [])
+        if coalesce and queue and queue[-1][1]:
+            queue[-1][0] = message	# newer state of the same tick, the old one is never sent
+            BroadcastBatcher._stats["coalesced"] += 1
+        else:
+            queue.append([message, coalesce])
+
+        task = BroadcastBatcher._flush_task
+        if task is None or task.done():
+            BroadcastBatcher._flush_task = asyncio.create_task(BroadcastBatcher._flush_loop())
+
+    @staticmethod
+    async def _flush_loop():
+        """Flush once per tick while there is something to send"""
+        while BroadcastBatcher._pending:
+            await asyncio.sleep(BroadcastBatcher.FLUSH_INTERVAL)
+            try:
+                await BroadcastBatcher.flush()
+            except Exception as e:
+                logger.error(f"Error flushing group messages: {str(e)}")
+
+    @staticmethod
+    async def flush():
+        """Send every pending message, the messages of a group keep their order"""
+        pending, BroadcastBatcher._pending = BroadcastBatcher._pending, {}
+        if not pending:
+            return
+        channel_layer = get_channel_layer()
+        batch = {group: [message for message, _ in queue] for group, queue in pending.items()}
+        BroadcastBatcher._stats["flushes"] += 1
+        BroadcastBatcher._stats["messages"] += sum(len(messages) for messages in batch.values())
+
+        if not BroadcastBatcher._supports_pipelining(channel_layer):
+            await asyncio.gather(*(
+                BroadcastBatcher._send_in_order(channel_layer, group, messages)
+                for group, messages in batch.items()
+            ))
+            return
+
+        # Events (game end, countdown...) must reach members that joined a moment ago
+        now = time.time()
+        stale = [
+            group for group, queue in pending.items()
+            if not all(coalesce for _, coalesce in queue)
+            or now - BroadcastBatcher._members.get(group, (0, None))[0] > BroadcastBatcher.MEMBERS_TTL
+        ]
+        if stale:
+            try:
+                await BroadcastBatcher._read_members(channel_layer, stale)
+            except Exception as e:	# nothing was delivered yet, the whole batch goes through group_send
+                BroadcastBatcher._disable_pipelining(e)
+                await asyncio.gather(*(
+                    BroadcastBatcher._send_in_order(channel_layer, group, messages)
+                    for group, messages in batch.items()
+                ))
+                return
+
+        local_sends = []
+        remote = {}
+        for group, messages in batch.items():
+            local = LocalGroups.members(group)
+            local_sends += [
+                BroadcastBatcher._deliver_local(channel_layer, consumer, messages) for consumer in list(local.values())
+            ]
+            names = [name for name in BroadcastBatcher._members[group][1] if name not in local]
+            if names:
+                remote[group] = (names, messages)
+        BroadcastBatcher._stats["local"] += len(local_sends)
+        BroadcastBatcher._stats["remote"] += sum(len(names) for names, _ in remote.values())
+
+        await asyncio.gather(*local_sends)
+        if remote:
+            try:
+                await BroadcastBatcher._pipelined_send(channel_layer, remote)
+            except Exception as e:	# local members are served, send to the remote channels one by one
+                BroadcastBatcher._disable_pipelining(e)
+                await asyncio.gather(*(
+                    BroadcastBatcher._send_to_channel(channel_layer, name, messages)
+                    for names, messages in remote.values() for name in names
+                ))
+
+        # Forget the members of groups that went quiet
+        for group in [group for group, (read_at, _) in BroadcastBatcher._members.items() if now - read_at > 60]:
+            del BroadcastBatcher._members[group]
+
+    @staticmethod
+    async def _send_in_order(channel_layer, group, messages):
+        for message in messages:
+            await channel_layer.group_send(group, message)
+
+    @staticmethod
+    async def _send_to_channel(channel_layer, name, messages):
+        for message in messages:
+            await channel_layer.send(name, message)
+
+    @staticmethod
+    async def _deliver_local(channel_layer, consumer, messages):
+        """Push the messages into the outbound queue of a local consumer, its writer task sends them.
+        Types the queue doesn't know go to the consumer's own channel, so its handler runs in its task"""
+        for message in messages:
+            if consumer.queue_group_message(message):
+                continue
+            try:
+                await channel_layer.send(consumer.channel_name, message)
+            except Exception as e:	# socket closing, the consumer leaves the group on disconnect
+                logger.debug(f"Local delivery to {consumer.channel_name} failed: {str(e)}")
+
+    @staticmethod
+    def _supports_pipelining(channel_layer):
+        """channels_redis RedisChannelLayer of a tested version, whose helpers the pipelined path reuses"""
+        if BroadcastBatcher._pipelining is None:
+            BroadcastBatcher._pipelining = BroadcastBatcher._check_pipelining(channel_layer)
+        return BroadcastBatcher._pipelining
+
+    @staticmethod
+    def _check_pipelining(channel_layer):
+        missing = [name for name in BroadcastBatcher.PIPELINE_HELPERS if not hasattr(channel_layer, name)]
+        if len(missing) == len(BroadcastBatcher.PIPELINE_HELPERS):
+            return False	# not a Redis channel layer (in memory layer in development)
+        try:
+            version = metadata.version("channels-redis")
+        except metadata.PackageNotFoundError:
+            version = None
+        if missing or not version or not version.startswith(BroadcastBatcher.TESTED_VERSIONS):
+            logger.warning(
+                f"Pipelined group delivery disabled, channels-redis {version} is not a tested version "
+                f"or lacks {missing}: game broadcasts use group_send"
+            )
+            return False
+        return True
+
+    @staticmethod
+    def _disable_pipelining(error):
+        logger.error(f"Pipelined group delivery failed, falling back to group_send: {str(error)}")
+        BroadcastBatcher._pipelining = False
+
+    @staticmethod
+    async def _read_members(channel_layer, groups):
+        """Read the channels of several groups, one pipeline per shard holding groups"""
+        now = time.time()
+        groups_by_connection = {}
+        for group in groups:
+            groups_by_connection.setdefault(channel_layer.consistent_hash(group), []).append(group)
+        for index, shard_groups in groups_by_connection.items():
+            async with channel_layer.connection(index).pipeline(transaction=False) as pipe:
+                for group in shard_groups:
+                    key = channel_layer._group_key(group)
+                    pipe.zremrangebyscore(key, min=0, max=int(now) - channel_layer.group_expiry)
+                    pipe.zrange(key, 0, -1)
+                results = await pipe.execute()
+            for group, names in zip(shard_groups, results[1::2]):
+                BroadcastBatcher._members[group] = (
+                    now, [name.decode("utf8") if isinstance(name, bytes) else name for name in names]
+                )
+
+    # Same delivery as RedisChannelLayer.group_send, for several messages at once. A message
+    # is dropped for a channel at capacity. ARGV: messages, capacities, current_time, expiry
+    GROUP_SEND_LUA = """
+    local over_capacity = 0
+    local current_time = ARGV[#ARGV - 1]
+    local expiry = ARGV[#ARGV]
+    for i=1,#KEYS do
+        if redis.call('ZCOUNT', KEYS[i], '-inf', '+inf') < tonumber(ARGV[i + #KEYS]) then
+            redis.call('ZADD', KEYS[i], current_time, ARGV[i])
+            redis.call('EXPIRE', KEYS[i], expiry)
+        else
+            over_capacity = over_capacity + 1
+        end
+    end
+    return over_capacity
+    """
+
+    @staticmethod
+    async def _pipelined_send(channel_layer, batch):
+        """Deliver {group: (channel_names, messages)} with one pipeline per shard"""
+        now = time.time()
+
+        # The n-th message of each group goes in round n. Channel messages are ordered
+        # by score, so each round gets a later timestamp than the previous one
+        rounds = max(len(messages) for _, messages in batch.values())
+        calls_by_connection = {}
+        for round_index in range(rounds):
+            for names, messages in batch.values():
+                if round_index >= len(messages):
+                    continue
+                connection_keys, key_messages, key_capacities = channel_layer._map_channel_keys_to_connection(
+                    names, messages[round_index]
+                )
+                for index, keys in connection_keys.items():
+                    calls_by_connection.setdefault(index, []).append((
+                        keys,
+                        [key_messages[key] for key in keys] + [key_capacities[key] for key in keys]
+                        + [now + round_index * 1e-6, channel_layer.expiry],
+                    ))
+
+        for index, calls in calls_by_connection.items():
+            evals = []	# positions of the eval results in the pipeline
+            async with channel_layer.connection(index).pipeline(transaction=False) as pipe:
+                position = 0
+                for keys, args in calls:
+                    for key in keys:	# discard expired messages, like group_send
+                        pipe.zremrangebyscore(key, min=0, max=int(now) - int(channel_layer.expiry))
+                    pipe.eval(BroadcastBatcher.GROUP_SEND_LUA, len(keys), *keys, *args)
+                    position += len(keys)
+                    evals.append(position)
+                    position += 1
+                results = await pipe.execute()
+            over_capacity = sum(results[position] for position in evals)
+            if over_capacity:
+                logger.info(f"{over_capacity} group messages dropped, channels over capacity")
+
+    @staticmethod
+    def snapshot():
+        """Flush counters, for the staff metrics endpoint"""
+        return dict(BroadcastBatcher._stats, pending_groups=len(BroadcastBatcher._pending))
@@ -1,5 +1,7 @@
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
+from django.db.models.functions import Coalesce
+from django.db.models import F, Value
 from django.db import transaction
 from django.utils import timezone
 from ...models import Game
@@ -23,6 +25,56 @@ class DatabaseOperations:
             )
             return game
 
+    @staticmethod
+    @database_sync_to_async
+    def create_games(pairs):
+        """Create one MATCHED game per pair of queue entries in a single INSERT"""
+        with transaction.atomic():
+            return Game.objects.bulk_create([
+                Game(
+                    player1_id=player1['user_id'],
+                    player2_id=player2['user_id'],
+                    status='MATCHED',
+                    player1_ready=True,
+                    player2_ready=True
+                )
+                for player1, player2 in pairs
+            ])
+
+    @staticmethod
+    @database_sync_to_async
+    def create_game_slots(count):
+        """Pre-create empty POOLED games and return their ids"""
+        games = Game.objects.bulk_create([Game(status='POOLED') for _ in range(count)])
+        return [game.id for game in games]
+
+    @staticmethod
+    @database_sync_to_async
+    def get_pooled_game_ids(limit):
+        """Get ids of POOLED games left by a previous process"""
+        return list(
+            Game.objects.filter(status='POOLED').order_by('id').values_list('id', flat=True)[:limit]
+        )
+
+    @staticmethod
+    @database_sync_to_async
+    def claim_game_slots(claims):
+        """Turn POOLED games into MATCHED games, one UPDATE per (slot_id, player1_id, player2_id) claim.
+        Returns a list of booleans telling which claims won their slot."""
+        now = timezone.now()
+        with transaction.atomic():
+            return [
+                Game.objects.filter(id=slot_id, status='POOLED').update(
+                    player1_id=player1_id,
+                    player2_id=player2_id,
+                    status='MATCHED',
+                    player1_ready=True,
+                    player2_ready=True,
+                    created_at=now
+                ) == 1
+                for slot_id, player1_id, player2_id in claims
+            ]
+
     @staticmethod
     @database_sync_to_async
     def get_game(game_id):
@@ -41,65 +93,37 @@ class DatabaseOperations:
     def update_game_status(game, status):
         """Update game status"""
         game.status = status
+        update_fields = ['status']
         if status == 'PLAYING' and not game.started_at:
             game.started_at = timezone.now()
+            update_fields.append('started_at')
         elif status == 'FINISHED' and not game.finished_at:
             game.finished_at = timezone.now()
-        game.save()
-        return game
-
-    @staticmethod
-    @database_sync_to_async
-    def update_game_status_by_id(game_id, status):
-        """Update game status by ID"""
-        try:
-            game = Game.objects.get(id=game_id)
-            game.status = status
-            if status == 'PLAYING' and not game.started_at:
-                game.started_at = timezone.now()
-            elif status == 'FINISHED' and not game.finished_at:
-                game.finished_at = timezone.now()
-            game.save()
-            return game
-        except Game.DoesNotExist:
-            return None
-        except Exception as e:
-            print(f"[DEBUG] Error in update_game_status_by_id: {e}")
-            return None
-
-    @staticmethod
-    @database_sync_to_async
-    def update_game_scores(game, score1, score2):
-        """Update game scores"""
-        game.score_player1 = score1
-        game.score_player2 = score2
-        game.save()
+            update_fields.append('finished_at')
+        game.save(update_fields=update_fields)
         return game
 
     @staticmethod
     @database_sync_to_async
-    def update_game_winner(game, winner_id, game_state=None):
-        """Update the winner of a game"""
-        try:
-            winner = User.objects.get(id=winner_id)
-            game.winner = winner
-            
-            # If we have access to the game state, update the scores
-            if game_state:
-                game.score_player1 = game_state.paddles["left"].score
-                game.score_player2 = game_state.paddles["right"].score
-                
-            game.save()
-            return game
-        except User.DoesNotExist:
-            return None
+    def start_game(game_id):
+        """Move a game with both players ready to PLAYING in a conditional UPDATE.
+        Returns True only for the caller whose update changed the row, so the game is started once."""
+        return Game.objects.filter(
+            id=game_id,
+            status__in=['WAITING', 'MATCHED'],
+            player1_ready=True,
+            player2_ready=True
+        ).update(
+            status='PLAYING',
+            started_at=Coalesce(F('started_at'), Value(timezone.now()))
+        ) == 1
 
     @staticmethod
     @database_sync_to_async
     def set_player2(game, player2):
         """Assign a second player to a game"""
         game.player2 = player2
-        game.save()
+        game.save(update_fields=['player2'])
         return game
 
     @staticmethod
@@ -108,9 +132,10 @@ class DatabaseOperations:
         """Mark a player as ready"""
         if role == "player1":
             game.player1_ready = True
+            game.save(update_fields=['player1_ready'])
         elif role == "player2":
             game.player2_ready = True
-        game.save()
+            game.save(update_fields=['player2_ready'])
         return game
 
     @staticmethod
@@ -122,22 +147,9 @@ class DatabaseOperations:
         
         # Determine the winner by abandonment
         if disconnected_side == "left":
-            game.winner = game.player2
+            game.winner_id = game.player2_id
         else:
-            game.winner = game.player1
+            game.winner_id = game.player1_id
             
-        game.save()
+        game.save(update_fields=['status', 'finished_at', 'winner'])
         return game
-
-    @staticmethod
-    @database_sync_to_async
-    def get_player_info(user_id):
-        """Get basic player information safely"""
-        if not user_id:	# if user id is not provided
-            return None
-            
-        try:
-            user = User.objects.get(id=user_id)
-            return {'id': user.id, 'username': user.username}
-        except Exception:
-            return None
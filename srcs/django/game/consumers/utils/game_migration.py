@@ -0,0 +1,107 @@
+from ..shared_state import game_states, registry, matchmaking_channels
+from ...engine.game_state import GameState
+from channels.layers import get_channel_layer
+from main.redis_connection import get_async_redis
+import logging
+import json
+import time
+
+logger = logging.getLogger(__name__)
+
+class GameMigration:
+    """Drain mode for rolling deploys.
+
+    A draining worker stops accepting game and matchmaking connections, saves
+    its live games (GameState + seats) to Redis and asks the clients to
+    fast-reconnect. The first worker that gets a connection for a saved game
+    restores it and the players come back as regular reconnections.
+    """
+
+    KEY = "game:migration:{}"
+    KEY_TTL = 120	# seconds a saved game waits for a worker to resume it
+    CLOSE_CODE = 4503	# worker draining, try again (the client reconnects on any code but 1000)
+
+    _draining = False
+    _migrating = set()	# ids of the games handed off by this worker
+    _redis = None
+
+    @staticmethod
+    def _get_redis():
+        if GameMigration._redis is None:
+            GameMigration._redis = get_async_redis()
+        return GameMigration._redis
+
+    @staticmethod
+    def is_draining():
+        return GameMigration._draining
+
+    @staticmethod
+    def is_migrating(game_id):
+        """True if the game was handed off, its disconnects must not end it"""
+        return str(game_id) in GameMigration._migrating
+
+    @staticmethod
+    async def drain():
+        """Stop accepting games, save the live ones and send their players elsewhere.
+        Returns the number of games saved."""
+        GameMigration._draining = True
+        channel_layer = get_channel_layer()
+
+        snapshots = {}
+        all_seats = await registry.get_seats_many(list(game_states.keys()))
+        for game_id, game_state in list(game_states.items()):
+            players = all_seats.get(game_id)
+            if not players or game_state.status in ("finished", "migrating"):
+                continue	# nobody joined yet or nothing to resume
+            snapshots[game_id] = {
+                "state": game_state.to_snapshot(),
+                "players": {side: data["user_id"] for side, data in players.items() if data},
+            }
+            game_state.status = "migrating"	# stops the game loop and the countdown
+
+        if snapshots:
+            async with GameMigration._get_redis().pipeline(transaction=False) as pipe:
+                for game_id, snapshot in snapshots.items():
+                    pipe.set(GameMigration.KEY.format(game_id), json.dumps(snapshot), ex=GameMigration.KEY_TTL)
+                await pipe.execute()
+
+        for game_id in snapshots:
+            GameMigration._migrating.add(game_id)
+            await channel_layer.group_send(f"game_{game_id}", {"type": "game_migrating"})
+
+        # Players of this worker still in the queue reconnect to another worker and queue there
+        queued = [p["user_id"] for p in await registry.queue_entries() if p["channel_name"] in matchmaking_channels]
+        await registry.dequeue(*queued)
+        for channel_name in list(matchmaking_channels):
+            await channel_layer.send(channel_name, {"type": "game_migrating"})
+
+        logger.info(f"Worker drained, {len(snapshots)} games saved for migration")
+        return len(snapshots)
+
+    @staticmethod
+    async def restore(game_id):
+        """Claim a saved game, register its players as disconnected and return its GameState.
+        The state keeps the "migrating" status, resume_status tells what to resume."""
+        try:
+            data = await GameMigration._get_redis().getdel(GameMigration.KEY.format(game_id))
+        except Exception as e:
+            logger.warning(f"Could not check migration of game {game_id}: {str(e)}")
+            return None
+        if not data:
+            return None
+
+        snapshot = json.loads(data)
+        game_state = GameState.from_snapshot(snapshot["state"])
+        game_state.resume_status = game_state.status
+        game_state.status = "migrating"
+
+        now = time.time()
+        for side, user_id in snapshot["players"].items():
+            await registry.set_seat(game_id, side, {
+                "user_id": user_id,
+                "connected": False,
+                "channel_name": None,
+                "disconnect_time": now,
+            })
+        logger.info(f"Game {game_id} restored from migration")
+        return game_state
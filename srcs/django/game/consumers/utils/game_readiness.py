@@ -0,0 +1,93 @@
+from main.redis_connection import get_async_redis
+import logging
+import asyncio
+
+logger = logging.getLogger(__name__)
+
+class GameReadiness:
+    """Readiness notifications for new games, so GameConsumer.connect waits for the row instead of polling it.
+
+    A game is marked ready once its row is committed. Waiters in this process are
+    woken through an asyncio.Event, waiters in other workers through Redis pub/sub.
+    A short-lived Redis key covers workers that start waiting after the publish.
+
+    Games are marked ready before their id is sent to any client, so a connect for an id
+    without the key is an unknown game: it is answered right away instead of waiting.
+    Only when Redis can't be checked does the connect wait, for WAIT_TIMEOUT at most.
+    """
+
+    CHANNEL = "game:ready"
+    KEY = "game:ready:{}"
+    KEY_TTL = 300	# seconds a game stays marked as ready in Redis
+    WAIT_TIMEOUT = 0.5	# default seconds to wait for a game to become ready when Redis can't be checked
+
+    _events = {}	# {game_id: asyncio.Event, ...} games someone in this process is waiting for
+    _listener_task = None
+    _redis = None
+
+    @staticmethod
+    def _get_redis():
+        if GameReadiness._redis is None:
+            GameReadiness._redis = get_async_redis()
+        return GameReadiness._redis
+
+    @staticmethod
+    async def mark_ready(*game_ids):
+        """Mark games as ready and wake up every waiter, local or in another worker"""
+        for game_id in game_ids:
+            event = GameReadiness._events.get(str(game_id))
+            if event:
+                event.set()
+        try:
+            async with GameReadiness._get_redis().pipeline(transaction=False) as pipe:
+                for game_id in game_ids:
+                    pipe.set(GameReadiness.KEY.format(game_id), 1, ex=GameReadiness.KEY_TTL)
+                    pipe.publish(GameReadiness.CHANNEL, str(game_id))
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Could not publish readiness of games {game_ids}: {str(e)}")
+
+    @staticmethod
+    async def wait_ready(game_id, timeout=None):
+        """Wait until the game is marked ready, return False on timeout"""
+        key = str(game_id)
+        event = GameReadiness._events.setdefault(key, asyncio.Event())
+        GameReadiness._ensure_listener()
+        try:
+            try:
+                # Marked before we started waiting (or by a worker we missed the publish of),
+                # no key means nobody was given this id: don't hold the socket open
+                return bool(await GameReadiness._get_redis().exists(GameReadiness.KEY.format(game_id)))
+            except Exception as e:
+                logger.warning(f"Could not check readiness of game {game_id}: {str(e)}")
+
+            await asyncio.wait_for(event.wait(), timeout or GameReadiness.WAIT_TIMEOUT)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            # Concurrent waiters keep their reference to the event, later ones check the Redis key
+            if GameReadiness._events.get(key) is event:
+                del GameReadiness._events[key]
+
+    @staticmethod
+    def _ensure_listener():
+        task = GameReadiness._listener_task
+        if task is None or task.done():
+            GameReadiness._listener_task = asyncio.create_task(GameReadiness._listen())
+
+    @staticmethod
+    async def _listen():
+        """Set the local events of games marked ready by other workers"""
+        try:
+            pubsub = GameReadiness._get_redis().pubsub(ignore_subscribe_messages=True)
+            await pubsub.subscribe(GameReadiness.CHANNEL)
+            async for message in pubsub.listen():
+                event = GameReadiness._events.get(message["data"])
+                if event:	# only games someone here is waiting for
+                    event.set()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # The next wait_ready starts a new listener
+            logger.warning(f"Game readiness listener stopped: {str(e)}")
@@ -0,0 +1,103 @@
+from .database_operations import DatabaseOperations
+from .latency_tracker import LatencyTracker
+from .game_readiness import GameReadiness
+from ..shared_state import game_states
+from ...engine.game_state import GameState
+from collections import deque
+import logging
+import asyncio
+
+logger = logging.getLogger(__name__)
+
+class GameSlotPool:
+    """Pool of pre-created POOLED Game rows with warm GameState objects.
+
+    A match claims a slot with a single UPDATE instead of an INSERT followed by
+    status updates, and the GameConsumer finds its GameState already registered.
+    """
+
+    POOL_SIZE = 16	# slots kept ready per process
+    _slots = deque()	# (game_id, GameState) pairs ready to be claimed
+    _refill_task = None
+    _adopted = False	# POOLED rows left by a previous process are adopted only once
+
+    @staticmethod
+    def ensure_filled():
+        """Refill the pool in background if it is below POOL_SIZE"""
+        task = GameSlotPool._refill_task
+        if len(GameSlotPool._slots) < GameSlotPool.POOL_SIZE and (task is None or task.done()):
+            GameSlotPool._refill_task = asyncio.create_task(GameSlotPool.refill())
+
+    @staticmethod
+    async def refill():
+        """Create (or adopt) POOLED games until the pool is full"""
+        try:
+            missing = GameSlotPool.POOL_SIZE - len(GameSlotPool._slots)
+            if missing <= 0:
+                return
+
+            game_ids = []
+            if not GameSlotPool._adopted:
+                GameSlotPool._adopted = True
+                game_ids = await DatabaseOperations.get_pooled_game_ids(missing)
+            if len(game_ids) < missing:
+                game_ids += await DatabaseOperations.create_game_slots(missing - len(game_ids))
+
+            known_ids = {game_id for game_id, _ in GameSlotPool._slots}
+            for game_id in game_ids:
+                if game_id not in known_ids:
+                    GameSlotPool._slots.append((game_id, GameState()))
+        except Exception as e:
+            logger.error(f"Error refilling game slot pool: {str(e)}")
+
+    @staticmethod
+    async def claim(pairs):
+        """Claim one slot per pair of queue entries and return the game ids in pair order.
+        Pairs that can't get a slot fall back to a regular game INSERT."""
+        claims = []
+        for player1, player2 in pairs:
+            if not GameSlotPool._slots:
+                break
+            game_id, game_state = GameSlotPool._slots.popleft()
+            claims.append((game_id, game_state, player1, player2))
+
+        won = []
+        if claims:
+            try:
+                won = await DatabaseOperations.claim_game_slots(
+                    [(game_id, player1['user_id'], player2['user_id']) for game_id, _, player1, player2 in claims]
+                )
+            except Exception:
+                # Nothing was claimed, give the slots back to the pool
+                GameSlotPool._slots.extendleft(reversed([(game_id, game_state) for game_id, game_state, _, _ in claims]))
+                raise
+
+        game_ids = [None] * len(pairs)
+        for index, ((game_id, game_state, player1, player2), claimed) in enumerate(zip(claims, won)):
+            if claimed:
+                # Seed the latency estimates measured while the players were in the queue
+                game_state.latency["left"] = LatencyTracker.get(player1['user_id'])
+                game_state.latency["right"] = LatencyTracker.get(player2['user_id'])
+                game_states[str(game_id)] = game_state	# warm state for the GameConsumer
+                game_ids[index] = game_id
+
+        # Slots lost to another process (or a short pool) use a regular INSERT
+        fallback = [index for index, game_id in enumerate(game_ids) if game_id is None]
+        if fallback:
+            games = await DatabaseOperations.create_games([pairs[index] for index in fallback])
+            for index, game in zip(fallback, games):
+                game_ids[index] = game.id
+
+        await GameReadiness.mark_ready(*game_ids)	# rows are committed, wake up waiting connects
+        GameSlotPool.ensure_filled()
+        return game_ids
+
+    @staticmethod
+    def expire(game_id):
+        """Forget the warm GameState of a claimed game that nobody connected to.
+        Returns True if it was dropped, a state already in use is kept."""
+        game_state = game_states.get(str(game_id))
+        if game_state is None or game_state.status != "waiting":
+            return False
+        del game_states[str(game_id)]
+        return True
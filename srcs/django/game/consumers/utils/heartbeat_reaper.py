@@ -0,0 +1,58 @@
+from ..shared_state import registry
+from .matchmaking_metrics import MatchmakingMetrics
+from .timer_wheel import TimerWheel
+from channels.layers import get_channel_layer
+import logging
+
+logger = logging.getLogger(__name__)
+
+class HeartbeatReaper:
+    """Close the game and matchmaking sockets that stopped sending pings.
+
+    Half-open sockets never trigger disconnect, so their players kept a queue
+    place or a game seat forever. One sweep every SWEEP_INTERVAL removes every
+    player whose heartbeat is older than registry.HEARTBEAT_TTL, drops them from
+    the queue in one batch and asks their consumers to close, which runs the
+    usual disconnect handling (reconnect timeout, seat release...).
+    """
+
+    SWEEP_INTERVAL = 5	# seconds between sweeps
+    CLOSE_CODE = 4408	# heartbeat timeout, the client reconnects on any code but 1000
+
+    _timer = None
+
+    @staticmethod
+    def ensure_running():
+        """Schedule the sweep, called when a player connects to this process"""
+        if HeartbeatReaper._timer is None or not HeartbeatReaper._timer.active:
+            HeartbeatReaper._timer = TimerWheel.schedule(
+                HeartbeatReaper.SWEEP_INTERVAL, HeartbeatReaper.sweep, name="heartbeat_sweep"
+            )
+
+    @staticmethod
+    async def sweep():
+        """Expire the players without heartbeat and close their sockets, returns how many were reaped"""
+        HeartbeatReaper._timer = None
+        try:
+            # Each expired player is popped by exactly one process, even with several workers sweeping
+            expired = await registry.expired_players()
+            if not expired:
+                return 0
+
+            dropped = await registry.dequeue(*expired.keys())
+            if dropped:
+                MatchmakingMetrics.increment("dropped", dropped)
+            MatchmakingMetrics.increment("reaped", len(expired))
+
+            # The consumer may live in another worker, go through the channel layer
+            channel_layer = get_channel_layer()
+            for user_id, data in expired.items():
+                if data.get("channel_name"):
+                    await channel_layer.send(data["channel_name"], {"type": "heartbeat_expired"})
+            logger.info(f"Heartbeat sweep reaped {len(expired)} players: {list(expired.keys())}")
+            return len(expired)
+        except Exception as e:
+            logger.error(f"Error in heartbeat sweep: {str(e)}")
+            return 0
+        finally:
+            HeartbeatReaper.ensure_running()	# sockets of this process keep being watched
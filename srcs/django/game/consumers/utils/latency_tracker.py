@@ -0,0 +1,48 @@
+class LatencyTracker:
+    """Smoothed round trip time (ms) per user, fed by the RTT clients report in their pings"""
+
+    ALPHA = 0.125	# weight of a new sample, same smoothing as TCP's SRTT
+    MAX_SAMPLE = 10000	# samples above 10 s are treated as bogus
+    _srtt = {}	# {user_id: smoothed rtt in ms, ...}
+    _sockets = {}	# {user_id: open game/matchmaking sockets, ...}, the entry is dropped with the last one
+
+    @staticmethod
+    def attach(user_id):
+        """A game or matchmaking socket of the user was opened"""
+        LatencyTracker._sockets[user_id] = LatencyTracker._sockets.get(user_id, 0) + 1
+
+    @staticmethod
+    def release(user_id):
+        """A socket of the user was closed, forget the user after the last one"""
+        remaining = LatencyTracker._sockets.get(user_id, 0) - 1
+        if remaining > 0:
+            LatencyTracker._sockets[user_id] = remaining
+        else:
+            LatencyTracker._sockets.pop(user_id, None)
+            LatencyTracker._srtt.pop(user_id, None)
+
+    @staticmethod
+    def observe(user_id, sample):
+        """Add an RTT sample for the user and return the new smoothed value"""
+        try:
+            sample = float(sample)
+        except (TypeError, ValueError):
+            return LatencyTracker._srtt.get(user_id)
+        if not 0 <= sample <= LatencyTracker.MAX_SAMPLE:
+            return LatencyTracker._srtt.get(user_id)
+
+        if user_id not in LatencyTracker._sockets:	# sample from a socket already closed
+            return None
+
+        previous = LatencyTracker._srtt.get(user_id)
+        if previous is None:
+            srtt = sample
+        else:
+            srtt = (1 - LatencyTracker.ALPHA) * previous + LatencyTracker.ALPHA * sample
+        LatencyTracker._srtt[user_id] = srtt
+        return srtt
+
+    @staticmethod
+    def get(user_id, default=None):
+        """Get the smoothed RTT of a user"""
+        return LatencyTracker._srtt.get(user_id, default)
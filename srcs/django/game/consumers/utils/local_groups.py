@@ -0,0 +1,26 @@
+class LocalGroups:
+    """Game consumers of this process per channel layer group.
+
+    BroadcastBatcher hands the messages of a group straight to these consumers
+    and only goes through the channel layer for the members living elsewhere.
+    """
+
+    _groups = {}	# {group: {channel_name: consumer, ...}, ...}
+
+    @staticmethod
+    def add(group, consumer):
+        LocalGroups._groups.setdefault(group, {})[consumer.channel_name] = consumer
+
+    @staticmethod
+    def discard(group, consumer):
+        members = LocalGroups._groups.get(group)
+        if members is None:
+            return
+        members.pop(consumer.channel_name, None)
+        if not members:
+            del LocalGroups._groups[group]
+
+    @staticmethod
+    def members(group):
+        """{channel_name: consumer} of the local members of a group"""
+        return LocalGroups._groups.get(group, {})
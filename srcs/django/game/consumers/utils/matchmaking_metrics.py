@@ -0,0 +1,83 @@
+from collections import deque
+import bisect
+import time
+
+class MatchmakingMetrics:
+    """In-process matchmaking telemetry (queue depth, time to match, cancellations, match rate)"""
+
+    # Upper bounds (seconds) of the time-to-match histogram buckets, the last bucket is +Inf
+    WAIT_BUCKETS = [0.5, 1, 2, 5, 10, 20, 30, 60, 120]
+    RATE_WINDOW = 60	# seconds used to compute matches per second
+
+    _wait_counts = [0] * (len(WAIT_BUCKETS) + 1)
+    _wait_sum = 0.0
+    _counters = {
+        "joined": 0,	# players added to the queue
+        "cancelled": 0,	# players that left the queue (leave_matchmaking or disconnect)
+        "dropped": 0,	# queue entries removed by the tick because the player was gone
+        "requeued": 0,	# players put back in the queue after a failed match
+        "matches": 0,	# games formed
+        "reaped": 0,	# sockets closed by the heartbeat reaper
+    }
+    _recent_matches = deque()	# (timestamp, games formed) of the last RATE_WINDOW seconds
+    _last_tick = {"duration": 0.0, "pairs": 0, "at": None}
+
+    @staticmethod
+    def increment(counter, amount=1):
+        """Increment one of the counters"""
+        MatchmakingMetrics._counters[counter] += amount
+
+    @staticmethod
+    def observe_wait(join_time, now=None):
+        """Record the time a player waited in the queue before being matched"""
+        if not join_time:
+            return
+        waited = max(0.0, (now or time.time()) - join_time)
+        MatchmakingMetrics._wait_counts[bisect.bisect_left(MatchmakingMetrics.WAIT_BUCKETS, waited)] += 1
+        MatchmakingMetrics._wait_sum += waited
+
+    @staticmethod
+    def record_tick(pairs, duration, now=None):
+        """Record a matchmaking tick that formed the given number of games"""
+        now = now or time.time()
+        MatchmakingMetrics._last_tick = {"duration": duration, "pairs": pairs, "at": now}
+        if pairs:
+            MatchmakingMetrics._counters["matches"] += pairs
+            MatchmakingMetrics._recent_matches.append((now, pairs))
+        MatchmakingMetrics._trim(now)
+
+    @staticmethod
+    def _trim(now):
+        """Forget matches older than RATE_WINDOW"""
+        recent = MatchmakingMetrics._recent_matches
+        while recent and recent[0][0] < now - MatchmakingMetrics.RATE_WINDOW:
+            recent.popleft()
+
+    @staticmethod
+    def snapshot(queue):
+        """Return all the metrics as a JSON serializable dictionary, queue is the list of queue entries"""
+        now = time.time()
+        MatchmakingMetrics._trim(now)
+
+        buckets = []
+        cumulative = 0
+        for bound, count in zip(MatchmakingMetrics.WAIT_BUCKETS + ["+Inf"], MatchmakingMetrics._wait_counts):
+            cumulative += count
+            buckets.append({"le": bound, "count": cumulative})
+
+        oldest_wait = max((now - p['join_time'] for p in queue if p.get('join_time')), default=0)
+
+        return {
+            "queue_depth": len(queue),
+            "oldest_wait_seconds": round(oldest_wait, 3),
+            "time_to_match_seconds": {
+                "buckets": buckets,
+                "count": cumulative,
+                "sum": round(MatchmakingMetrics._wait_sum, 3),
+            },
+            "counters": dict(MatchmakingMetrics._counters),
+            "matches_per_second": round(
+                sum(count for _, count in MatchmakingMetrics._recent_matches) / MatchmakingMetrics.RATE_WINDOW, 3
+            ),
+            "last_tick": dict(MatchmakingMetrics._last_tick),
+        }
@@ -0,0 +1,112 @@
+from django.conf import settings
+from collections import deque
+import logging
+import asyncio
+import json
+import time
+
+logger = logging.getLogger(__name__)
+
+class OutboundQueue:
+    """Bounded outbound queue of one game socket, written by its own task.
+
+    Channel layer handlers push frames and return at once, so a slow client
+    only delays itself and not the broadcast to the rest of its group.
+
+    Frame kinds:
+    - "state": game_state frames, latest wins, only the newest pending one is sent
+    - "control": game_start, game_finished, player_(dis|re)connected... sent first, never dropped
+    - "normal": everything else (pong, chat, errors), in order, bounded to MAX_SIZE
+
+    A client is behind when a frame waited more than MAX_LAG seconds or the
+    normal frames overflow. POLICY "drop" discards its normal frames and keeps
+    going, "disconnect" closes the socket with CLOSE_CODE so it reconnects fresh.
+    """
+
+    MAX_SIZE = getattr(settings, "GAME_OUTBOUND_QUEUE_SIZE", 64)
+    MAX_LAG = getattr(settings, "GAME_SLOW_CLIENT_LAG", 2)	# seconds
+    POLICY = getattr(settings, "GAME_SLOW_CLIENT_POLICY", "drop")
+    CLOSE_CODE = 4429	# client too slow, the client reconnects on any code but 1000
+
+    def __init__(self, consumer):
+        self.consumer = consumer
+        self._control = deque()	# (queued_at, payload)
+        self._normal = deque()	# (queued_at, payload)
+        self._state = None	# (queued_at, payload) newest game_state frame
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.closed = False
+        self.dropped = 0
+
+    def push(self, payload, kind="normal"):
+        """Queue a frame (a JSON serializable dict) for the writer task"""
+        if self.closed:
+            return
+        item = (time.monotonic(), payload)
+        if kind == "state":
+            if self._state is not None:
+                self.dropped += 1	# stale frame replaced before it was sent
+            self._state = item
+        elif kind == "control":
+            self._control.append(item)
+        else:
+            self._normal.append(item)
+            if len(self._normal) > OutboundQueue.MAX_SIZE:
+                self._behind(f"{len(self._normal)} frames queued")
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._write())
+
+    def discard_state(self):
+        """Forget the pending game_state frame (the game ended, it is stale)"""
+        self._state = None
+
+    def stop(self):
+        """Stop the writer, pending frames are dropped"""
+        self.closed = True
+        self._wakeup.set()
+
+    def _next(self):
+        if self._control:
+            return self._control.popleft()
+        if self._normal:
+            return self._normal.popleft()
+        item, self._state = self._state, None
+        return item
+
+    def _lag(self):
+        oldest = [queue[0][0] for queue in (self._control, self._normal) if queue]
+        if self._state is not None:
+            oldest.append(self._state[0])
+        return time.monotonic() - min(oldest) if oldest else 0
+
+    def _behind(self, reason):
+        """Apply the slow client policy"""
+        user = getattr(self.consumer, "user", None)
+        if OutboundQueue.POLICY == "disconnect":
+            logger.warning(f"Closing slow client {getattr(user, 'id', None)}: {reason}")
+            self.stop()
+            asyncio.create_task(self.consumer.close(code=OutboundQueue.CLOSE_CODE))
+            return
+        self.dropped += len(self._normal)
+        self._normal.clear()
+        logger.info(f"Slow client {getattr(user, 'id', None)}, normal frames dropped: {reason}")
+
+    async def _write(self):
+        while not self.closed:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while not self.closed:
+                if self._lag() > OutboundQueue.MAX_LAG:
+                    self._behind(f"{self._lag():.1f}s behind")
+                    if self.closed:
+                        return
+                item = self._next()
+                if item is None:
+                    break
+                try:
+                    await self.consumer.send(text_data=json.dumps(item[1]))
+                except Exception as e:	# socket gone, disconnect stops the queue
+                    logger.debug(f"Outbound write failed: {str(e)}")
+                    self.closed = True
+                    return
@@ -0,0 +1,245 @@
+from channels.db import database_sync_to_async
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from main.redis_connection import get_redis
+from ...models import Game
+import logging
+import asyncio
+import atexit
+import redis
+import json
+
+logger = logging.getLogger(__name__)
+
+class PersistenceQueue:
+    """Write-behind persistence for game results and score events.
+
+    The game loop only enqueues, a background batcher writes the pending
+    results and scores with bulk_update. Batches that keep failing are
+    spilled to a Redis list and replayed once the database is back: with
+    the next batch of the worker, and by the replay_game_spill Celery task
+    on its own schedule (idle workers, restarts).
+    The spill uses LPOP with a count, Redis 6.2 or newer is required.
+    On a normal exit (SIGTERM) the atexit hook writes what is still pending,
+    including a batch that was being retried, or spills it if the database
+    is down. Writes are idempotent, a batch stored twice is harmless.
+    """
+
+    FLUSH_INTERVAL = 0.5	# seconds between two batches
+    MAX_RETRIES = 3	# attempts per batch before spilling it to Redis
+    RETRY_DELAY = 0.5	# base delay (seconds) between attempts, doubled each retry
+    SPILL_KEY = "game:persistence:spill"
+    SPILL_REPLAY = 100	# spilled records replayed per batch
+
+    _scores = {}	# {game_id: {"score_player1", "score_player2"}, ...} latest score per game
+    _results = {}	# {game_id: {"winner_id", "score_player1", "score_player2", "finished_at"}, ...}
+    _in_flight = None	# (scores, results) taken by the running flush, until written or spilled
+    _flush_task = None
+    _atexit_registered = False
+    _redis = None
+
+    @staticmethod
+    def record_score(game_id, score1, score2):
+        """Queue the current score of a game, older pending scores of the same game are replaced"""
+        if game_id in PersistenceQueue._results:
+            return	# the final result already carries the scores
+        PersistenceQueue._scores[game_id] = {"score_player1": score1, "score_player2": score2}
+        PersistenceQueue.ensure_running()
+
+    @staticmethod
+    def record_result(game_id, winner_id, score1, score2):
+        """Queue the final result of a game"""
+        PersistenceQueue._scores.pop(game_id, None)
+        PersistenceQueue._results[game_id] = {
+            "winner_id": winner_id,
+            "score_player1": score1,
+            "score_player2": score2,
+            "finished_at": timezone.now().isoformat(),
+        }
+        PersistenceQueue.ensure_running()
+
+    @staticmethod
+    def ensure_running():
+        """Start the batcher if it is not already running"""
+        if not PersistenceQueue._atexit_registered:
+            atexit.register(PersistenceQueue.flush_sync)
+            PersistenceQueue._atexit_registered = True
+        task = PersistenceQueue._flush_task
+        if task is None or task.done():
+            PersistenceQueue._flush_task = asyncio.create_task(PersistenceQueue.flush_loop())
+
+    @staticmethod
+    async def flush_loop():
+        """Write a batch every FLUSH_INTERVAL while there is something pending"""
+        while PersistenceQueue._scores or PersistenceQueue._results:
+            await asyncio.sleep(PersistenceQueue.FLUSH_INTERVAL)
+            await PersistenceQueue.flush()
+
+    @staticmethod
+    async def flush():
+        """Take everything pending and write it, retrying and spilling on failure"""
+        scores, results = PersistenceQueue._scores, PersistenceQueue._results
+        PersistenceQueue._scores, PersistenceQueue._results = {}, {}
+        if not scores and not results:
+            return
+        PersistenceQueue._in_flight = (scores, results)
+        await PersistenceQueue._write_or_spill(scores, results)
+        PersistenceQueue._in_flight = None	# kept if the task is cancelled on shutdown, flush_sync writes it
+
+    @staticmethod
+    async def _write_or_spill(scores, results):
+        for attempt in range(PersistenceQueue.MAX_RETRIES):
+            try:
+                await PersistenceQueue._write_batch(scores, results)
+                return
+            except Exception as e:
+                logger.warning(f"Persistence batch failed (attempt {attempt + 1}): {str(e)}")
+                await asyncio.sleep(PersistenceQueue.RETRY_DELAY * 2 ** attempt)
+
+        try:
+            await PersistenceQueue._spill(scores, results)
+        except Exception as e:
+            logger.error(f"Could not spill {len(scores) + len(results)} game records: {str(e)}")
+            # Keep them in memory, newer records of the same games take priority
+            for game_id, score in scores.items():
+                if game_id not in PersistenceQueue._results:
+                    PersistenceQueue._scores.setdefault(game_id, score)
+            for game_id, result in results.items():
+                PersistenceQueue._results.setdefault(game_id, result)
+
+    @staticmethod
+    def flush_sync():
+        """Write the pending records from synchronous code, registered with atexit"""
+        scores, results = {}, {}
+        if PersistenceQueue._in_flight:	# older than the pending records
+            scores.update(PersistenceQueue._in_flight[0])
+            results.update(PersistenceQueue._in_flight[1])
+        scores.update(PersistenceQueue._scores)
+        results.update(PersistenceQueue._results)
+        PersistenceQueue._scores, PersistenceQueue._results, PersistenceQueue._in_flight = {}, {}, None
+        if not scores and not results:
+            return
+        try:
+            PersistenceQueue._apply(scores, results)
+            logger.info(f"Stored {len(scores) + len(results)} pending game records on shutdown")
+        except Exception as e:
+            logger.warning(f"Could not store pending game records on shutdown: {str(e)}")
+            try:
+                PersistenceQueue._spill_sync(scores, results)
+            except Exception as e:
+                logger.error(f"Lost {len(scores) + len(results)} game records on shutdown: {str(e)}")
+
+    @staticmethod
+    def _get_redis():
+        if PersistenceQueue._redis is None:
+            PersistenceQueue._redis = get_redis()
+        return PersistenceQueue._redis
+
+    @staticmethod
+    @database_sync_to_async
+    def _spill(scores, results):
+        PersistenceQueue._spill_sync(scores, results)
+
+    @staticmethod
+    def _spill_sync(scores, results):
+        """Push records that could not be written to the Redis spill list"""
+        records = [json.dumps({"game_id": game_id, "score": score}) for game_id, score in scores.items()]
+        records += [json.dumps({"game_id": game_id, "result": result}) for game_id, result in results.items()]
+        PersistenceQueue._get_redis().rpush(PersistenceQueue.SPILL_KEY, *records)
+        logger.warning(f"Spilled {len(records)} game records to Redis")
+
+    @staticmethod
+    @database_sync_to_async
+    def _write_batch(scores, results):
+        """Write scores and results with one bulk_update each, together with spilled records"""
+        scores, results = dict(scores), dict(results)	# the caller keeps the batch for retries
+        # Replay what was spilled while the database was unavailable, pending records are newer
+        client = PersistenceQueue._get_redis()
+        spilled = []
+        try:
+            spilled = client.lpop(PersistenceQueue.SPILL_KEY, PersistenceQueue.SPILL_REPLAY) or []
+        except redis.RedisError as e:
+            logger.warning(f"Could not read spilled game records: {str(e)}")
+        spilled_scores, spilled_results = PersistenceQueue._parse_spilled(spilled)
+        for game_id, result in spilled_results.items():
+            results.setdefault(game_id, result)
+        for game_id, score in spilled_scores.items():
+            if game_id not in results:
+                scores.setdefault(game_id, score)
+
+        try:
+            PersistenceQueue._apply(scores, results)
+        except Exception:
+            if spilled:
+                # Put the replayed records back so they are not lost with this batch
+                client.lpush(PersistenceQueue.SPILL_KEY, *reversed(spilled))
+            raise
+
+    @staticmethod
+    def replay_spill():
+        """Write every spilled record to the database (synchronous, run by the replay_game_spill task).
+        Returns how many records were replayed, a failing batch goes back to the list."""
+        client = PersistenceQueue._get_redis()
+        replayed = 0
+        while True:
+            spilled = client.lpop(PersistenceQueue.SPILL_KEY, PersistenceQueue.SPILL_REPLAY) or []
+            if not spilled:
+                return replayed
+            scores, results = PersistenceQueue._parse_spilled(spilled)
+            try:
+                PersistenceQueue._apply(scores, results)
+            except Exception:
+                client.lpush(PersistenceQueue.SPILL_KEY, *reversed(spilled))
+                raise
+            replayed += len(spilled)
+
+    @staticmethod
+    def _parse_spilled(spilled):
+        """Split spilled records (oldest first) into scores and results, the latest record of a game wins"""
+        scores, results = {}, {}
+        for record in map(json.loads, spilled):
+            game_id = record["game_id"]
+            if "result" in record:
+                results[game_id] = record["result"]
+                scores.pop(game_id, None)
+            elif game_id not in results:
+                scores[game_id] = record["score"]
+        return scores, results
+
+    @staticmethod
+    def _apply(scores, results):
+        """Write scores and results with one bulk_update each in a transaction"""
+        finished = [
+            Game(
+                id=game_id,
+                winner_id=result["winner_id"],
+                score_player1=result["score_player1"],
+                score_player2=result["score_player2"],
+                status="FINISHED",
+                finished_at=parse_datetime(result["finished_at"]),
+            )
+            for game_id, result in results.items()
+        ]
+        in_progress = [
+            Game(id=game_id, score_player1=score["score_player1"], score_player2=score["score_player2"])
+            for game_id, score in scores.items() if game_id not in results
+        ]
+
+        with transaction.atomic():
+            if in_progress:
+                # A score replayed late must not overwrite the final score of a game that finished meanwhile
+                # (its result or update_game_on_disconnect), the rows are locked so none finishes in between
+                open_ids = set(
+                    Game.objects.select_for_update()
+                    .filter(id__in=[game.id for game in in_progress])
+                    .exclude(status="FINISHED")
+                    .values_list("id", flat=True)
+                )
+                in_progress = [game for game in in_progress if game.id in open_ids]
+            if in_progress:
+                Game.objects.bulk_update(in_progress, ["score_player1", "score_player2"])
+            if finished:
+                Game.objects.bulk_update(
+                    finished, ["winner", "score_player1", "score_player2", "status", "finished_at"]
+                )
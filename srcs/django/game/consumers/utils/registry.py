@@ -0,0 +1,427 @@
+from main.redis_connection import get_async_redis
+from abc import ABC, abstractmethod
+import json
+import time
+
+# Registries shared by the game consumers and handlers:
+#    - Connected players: {user_id: {"channel_name", "username", "last_seen"}}
+#    - Matchmaking queue: [{"user_id", "username", "channel_name", "join_time"}, ...] in join order
+#    - Game seats: {game_id: {"left": seat, "right": seat}}, seat = {"user_id", "connected",
+#      "channel_name", "disconnect_time"} or None while the side is free
+
+# Every operation is a coroutine so both backends are interchangeable:
+#    - MemoryRegistry: plain dicts and lists, for a single daphne process. Its coroutines never
+#      suspend, so a sequence of calls without other awaits in between is atomic
+#    - RedisRegistry: the same data in Redis, for several workers behind the same upstream
+
+# Heartbeats:
+#    - add_player and heartbeat set last_seen, a player whose last_seen is older than
+#      HEARTBEAT_TTL is not connected anymore (get_player / connected_ids ignore it)
+#    - expired_players returns and removes them, so their sockets can be closed
+#      (see utils/heartbeat_reaper.py)
+
+# Match formation:
+#    - The queue stays in place while a tick pairs players, claim_pairs then removes each pair
+#      atomically only if both players are still queued, so a player that left meanwhile (or was
+#      paired by a concurrent tick) is never matched
+#    - dequeue leaves a cancellation mark, requeue_front skips marked users, so the players of a
+#      claimed pair whose game could not be created are not put back if they left in the meantime
+#    - enqueue clears the mark
+
+
+class RegistryBackend(ABC):
+    """Interface of the game registries"""
+
+    HEARTBEAT_TTL = 30	# seconds without heartbeat before a player is considered gone, settings.GAME_HEARTBEAT_TTL
+
+    # Connected players
+    @abstractmethod
+    async def add_player(self, user_id, channel_name, username):
+        ...
+
+    @abstractmethod
+    async def remove_player(self, user_id):
+        ...
+
+    @abstractmethod
+    async def get_player(self, user_id):
+        """Connected player data, or None if absent or expired"""
+
+    @abstractmethod
+    async def heartbeat(self, *user_ids):
+        """Refresh last_seen of several players at once"""
+
+    @abstractmethod
+    async def connected_ids(self, user_ids):
+        """Subset of user_ids that are connected with a fresh heartbeat"""
+
+    @abstractmethod
+    async def expired_players(self):
+        """Remove the players whose heartbeat expired and return them as {user_id: data}"""
+
+    # Matchmaking queue
+    @abstractmethod
+    async def enqueue(self, entry):
+        """Append a queue entry, returns False if the user is already queued"""
+
+    @abstractmethod
+    async def dequeue(self, *user_ids):
+        """Remove users from the queue and mark them as cancelled, returns how many were queued"""
+
+    @abstractmethod
+    async def queue_position(self, user_id):
+        """1-based position of the user in the queue, 0 if not queued"""
+
+    @abstractmethod
+    async def queue_length(self):
+        ...
+
+    @abstractmethod
+    async def queue_entries(self):
+        ...
+
+    @abstractmethod
+    async def claim_pairs(self, pairs):
+        """Atomically remove each pair of entries whose two users are still queued.
+        Returns the pairs that were removed, the others are left untouched"""
+
+    @abstractmethod
+    async def requeue_front(self, entries):
+        """Put entries back at the head of the queue in order, skipping users queued again or cancelled meanwhile"""
+
+    # Game seats
+    @abstractmethod
+    async def get_seats(self, game_id):
+        ...
+
+    @abstractmethod
+    async def get_seats_many(self, game_ids):
+        """{game_id: seats} for the given games that have seats"""
+
+    @abstractmethod
+    async def set_seat(self, game_id, side, seat):
+        ...
+
+    @abstractmethod
+    async def update_seat(self, game_id, side, **fields):
+        """Update some fields of an occupied seat, returns False if there is no such seat"""
+
+    @abstractmethod
+    async def remove_game(self, game_id):
+        ...
+
+
+class MemoryRegistry(RegistryBackend):
+    """In-process registries"""
+
+    def __init__(self):
+        self._players = {}
+        self._queue = []
+        self._cancelled = set()	# users that left the queue, see requeue_front
+        self._seats = {}
+
+    def _is_fresh(self, data, now):
+        return now - data["last_seen"] <= self.HEARTBEAT_TTL
+
+    async def add_player(self, user_id, channel_name, username):
+        self._players[user_id] = {"channel_name": channel_name, "username": username, "last_seen": time.time()}
+
+    async def remove_player(self, user_id):
+        self._players.pop(user_id, None)
+
+    async def get_player(self, user_id):
+        data = self._players.get(user_id)
+        return dict(data) if data and self._is_fresh(data, time.time()) else None
+
+    async def heartbeat(self, *user_ids):
+        now = time.time()
+        for user_id in user_ids:
+            if user_id in self._players:
+                self._players[user_id]["last_seen"] = now
+
+    async def connected_ids(self, user_ids):
+        now = time.time()
+        return {
+            user_id for user_id in user_ids
+            if user_id in self._players and self._is_fresh(self._players[user_id], now)
+        }
+
+    async def expired_players(self):
+        now = time.time()
+        expired = {user_id: data for user_id, data in self._players.items() if not self._is_fresh(data, now)}
+        for user_id in expired:
+            del self._players[user_id]
+        return expired
+
+    async def enqueue(self, entry):
+        if any(item["user_id"] == entry["user_id"] for item in self._queue):
+            return False
+        self._cancelled.discard(entry["user_id"])
+        self._queue.append(dict(entry))
+        return True
+
+    async def dequeue(self, *user_ids):
+        self._cancelled.update(user_ids)
+        length = len(self._queue)
+        self._queue[:] = [item for item in self._queue if item["user_id"] not in user_ids]
+        return length - len(self._queue)
+
+    async def queue_position(self, user_id):
+        return next((i + 1 for i, item in enumerate(self._queue) if item["user_id"] == user_id), 0)
+
+    async def queue_length(self):
+        return len(self._queue)
+
+    async def queue_entries(self):
+        return [dict(item) for item in self._queue]
+
+    async def claim_pairs(self, pairs):
+        queued = {item["user_id"] for item in self._queue}
+        claimed = [
+            (player1, player2) for player1, player2 in pairs
+            if player1["user_id"] in queued and player2["user_id"] in queued
+        ]
+        await self.dequeue(*[player["user_id"] for pair in claimed for player in pair])
+        self._cancelled.difference_update(player["user_id"] for pair in claimed for player in pair)
+        return claimed
+
+    async def requeue_front(self, entries):
+        skipped = {item["user_id"] for item in self._queue} | self._cancelled
+        self._queue[:0] = [dict(entry) for entry in entries if entry["user_id"] not in skipped]
+
+    async def get_seats(self, game_id):
+        seats = self._seats.get(str(game_id))
+        return {side: dict(seat) if seat else None for side, seat in seats.items()} if seats else None
+
+    async def get_seats_many(self, game_ids):
+        return {game_id: await self.get_seats(game_id) for game_id in game_ids if str(game_id) in self._seats}
+
+    async def set_seat(self, game_id, side, seat):
+        self._seats.setdefault(str(game_id), {"left": None, "right": None})[side] = dict(seat)
+
+    async def update_seat(self, game_id, side, **fields):
+        seat = self._seats.get(str(game_id), {}).get(side)
+        if not seat:
+            return False
+        seat.update(fields)
+        return True
+
+    async def remove_game(self, game_id):
+        self._seats.pop(str(game_id), None)
+
+
+class RedisRegistry(RegistryBackend):
+    """Registries stored in Redis, shared by every worker"""
+
+    PREFIX = "registry:"
+    SEATS_TTL = 6 * 3600	# seats of games nobody touched for 6 hours are dropped
+    CANCELLED_TTL = 60	# seconds a cancellation mark is kept, longer than any match formation pass
+
+    # Append to the queue unless the user is already queued, clearing a previous cancellation
+    ENQUEUE_SCRIPT = """
+    if redis.call('HSETNX', KEYS[2], ARGV[1], ARGV[2]) == 1 then
+        redis.call('SREM', KEYS[3], ARGV[1])
+        redis.call('RPUSH', KEYS[1], ARGV[1])
+        return 1
+    end
+    return 0
+    """
+    # Remove the players whose last heartbeat is older than ARGV[1], in one step so a heartbeat
+    # arriving meanwhile can't be lost. Returns user_id, data pairs
+    EXPIRE_SCRIPT = """
+    local user_ids = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+    local expired = {}
+    for _, user_id in ipairs(user_ids) do
+        local data = redis.call('HGET', KEYS[1], user_id)
+        if data then
+            table.insert(expired, user_id)
+            table.insert(expired, data)
+        end
+        redis.call('HDEL', KEYS[1], user_id)
+        redis.call('ZREM', KEYS[2], user_id)
+    end
+    return expired
+    """
+    # Push entries (user_id, entry pairs in reverse order) to the head unless queued again or cancelled
+    REQUEUE_SCRIPT = """
+    for i = 1, #ARGV, 2 do
+        if redis.call('SISMEMBER', KEYS[3], ARGV[i]) == 0
+            and redis.call('HSETNX', KEYS[2], ARGV[i], ARGV[i + 1]) == 1 then
+            redis.call('LPUSH', KEYS[1], ARGV[i])
+        end
+    end
+    return 1
+    """
+    # Remove each pair of users (consecutive ARGV) if both are still queued. Returns one flag per pair
+    CLAIM_SCRIPT = """
+    local claimed = {}
+    for i = 1, #ARGV, 2 do
+        if redis.call('HEXISTS', KEYS[2], ARGV[i]) == 1 and redis.call('HEXISTS', KEYS[2], ARGV[i + 1]) == 1 then
+            redis.call('HDEL', KEYS[2], ARGV[i], ARGV[i + 1])
+            redis.call('LREM', KEYS[1], 0, ARGV[i])
+            redis.call('LREM', KEYS[1], 0, ARGV[i + 1])
+            table.insert(claimed, 1)
+        else
+            table.insert(claimed, 0)
+        end
+    end
+    return claimed
+    """
+
+    def __init__(self):
+        self._redis = get_async_redis()
+        self._players_key = f"{self.PREFIX}players"
+        self._heartbeats_key = f"{self.PREFIX}heartbeats"
+        self._queue_key = f"{self.PREFIX}queue"
+        self._entries_key = f"{self.PREFIX}queue:entries"
+        self._cancelled_key = f"{self.PREFIX}queue:cancelled"
+        self._enqueue = self._redis.register_script(self.ENQUEUE_SCRIPT)
+        self._requeue = self._redis.register_script(self.REQUEUE_SCRIPT)
+        self._claim = self._redis.register_script(self.CLAIM_SCRIPT)
+        self._expire = self._redis.register_script(self.EXPIRE_SCRIPT)
+
+    def _seats_key(self, game_id):
+        return f"{self.PREFIX}seats:{game_id}"
+
+    async def add_player(self, user_id, channel_name, username):
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self._players_key, user_id, json.dumps({"channel_name": channel_name, "username": username}))
+            pipe.zadd(self._heartbeats_key, {user_id: time.time()})
+            await pipe.execute()
+
+    async def remove_player(self, user_id):
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hdel(self._players_key, user_id)
+            pipe.zrem(self._heartbeats_key, user_id)
+            await pipe.execute()
+
+    async def get_player(self, user_id):
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.hget(self._players_key, user_id)
+            pipe.zscore(self._heartbeats_key, user_id)
+            data, last_seen = await pipe.execute()
+        if not data or last_seen is None or time.time() - last_seen > self.HEARTBEAT_TTL:
+            return None
+        return dict(json.loads(data), last_seen=last_seen)
+
+    async def heartbeat(self, *user_ids):
+        if user_ids:
+            # XX: only refresh players that are still registered
+            await self._redis.zadd(self._heartbeats_key, {user_id: time.time() for user_id in user_ids}, xx=True)
+
+    async def connected_ids(self, user_ids):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for user_id in user_ids:
+                pipe.zscore(self._heartbeats_key, user_id)
+            scores = await pipe.execute()
+        oldest = time.time() - self.HEARTBEAT_TTL
+        return {user_id for user_id, score in zip(user_ids, scores) if score is not None and score >= oldest}
+
+    async def expired_players(self):
+        expired = await self._expire(
+            keys=[self._players_key, self._heartbeats_key], args=[time.time() - self.HEARTBEAT_TTL]
+        )
+        return {int(expired[i]): json.loads(expired[i + 1]) for i in range(0, len(expired), 2)}
+
+    async def enqueue(self, entry):
+        return bool(await self._enqueue(
+            keys=[self._queue_key, self._entries_key, self._cancelled_key],
+            args=[entry["user_id"], json.dumps(entry)]
+        ))
+
+    async def dequeue(self, *user_ids):
+        if not user_ids:
+            return 0
+        async with self._redis.pipeline(transaction=True) as pipe:
+            for user_id in user_ids:
+                pipe.lrem(self._queue_key, 0, user_id)
+            pipe.sadd(self._cancelled_key, *user_ids)
+            pipe.expire(self._cancelled_key, self.CANCELLED_TTL)
+            pipe.hdel(self._entries_key, *user_ids)
+            results = await pipe.execute()
+        return results[-1]
+
+    async def queue_position(self, user_id):
+        index = await self._redis.lpos(self._queue_key, user_id)
+        return index + 1 if index is not None else 0
+
+    async def queue_length(self):
+        return await self._redis.llen(self._queue_key)
+
+    def _entries(self, user_ids, entries):
+        return [json.loads(entries[user_id]) for user_id in user_ids if user_id in entries]
+
+    async def queue_entries(self):
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.lrange(self._queue_key, 0, -1)
+            pipe.hgetall(self._entries_key)
+            user_ids, entries = await pipe.execute()
+        return self._entries(user_ids, entries)
+
+    async def claim_pairs(self, pairs):
+        if not pairs:
+            return []
+        args = [player["user_id"] for pair in pairs for player in pair]
+        claimed = await self._claim(keys=[self._queue_key, self._entries_key], args=args)
+        return [pair for pair, flag in zip(pairs, claimed) if flag]
+
+    async def requeue_front(self, entries):
+        if not entries:
+            return
+        args = []
+        for entry in reversed(entries):
+            args += [entry["user_id"], json.dumps(entry)]
+        await self._requeue(keys=[self._queue_key, self._entries_key, self._cancelled_key], args=args)
+
+    async def get_seats(self, game_id):
+        seats = await self._redis.hgetall(self._seats_key(game_id))
+        if not seats:
+            return None
+        return {side: json.loads(seats[side]) if seats.get(side) else None for side in ("left", "right")}
+
+    async def get_seats_many(self, game_ids):
+        game_ids = list(game_ids)
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for game_id in game_ids:
+                pipe.hgetall(self._seats_key(game_id))
+            results = await pipe.execute()
+        return {
+            game_id: {side: json.loads(seats[side]) if seats.get(side) else None for side in ("left", "right")}
+            for game_id, seats in zip(game_ids, results) if seats
+        }
+
+    async def set_seat(self, game_id, side, seat):
+        key = self._seats_key(game_id)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.hset(key, side, json.dumps(seat))
+            pipe.expire(key, self.SEATS_TTL)
+            await pipe.execute()
+
+    async def update_seat(self, game_id, side, **fields):
+        key = self._seats_key(game_id)
+        data = await self._redis.hget(key, side)
+        if not data:
+            return False
+        seat = json.loads(data)
+        seat.update(fields)
+        await self.set_seat(game_id, side, seat)
+        return True
+
+    async def remove_game(self, game_id):
+        await self._redis.delete(self._seats_key(game_id))
+
+
+def create_registry(backend, heartbeat_ttl=None):
+    """Build the registry backend named in settings.GAME_REGISTRY_BACKEND ("memory" or "redis")"""
+    if backend == "redis":
+        registry = RedisRegistry()
+    elif backend == "memory":
+        registry = MemoryRegistry()
+    else:
+        raise ValueError(f"Unknown game registry backend: {backend}")
+    if heartbeat_ttl:
+        registry.HEARTBEAT_TTL = heartbeat_ttl
+    return registry
@@ -0,0 +1,147 @@
+from collections import Counter
+import logging
+import asyncio
+import math
+
+logger = logging.getLogger(__name__)
+
+class Timer:
+    """Handle of a scheduled callback, returned by TimerWheel.schedule"""
+
+    __slots__ = ("expires", "callback", "args", "name", "bucket")
+
+    def __init__(self, expires, callback, args, name):
+        self.expires = expires	# tick at which the callback runs
+        self.callback = callback
+        self.args = args
+        self.name = name
+        self.bucket = None	# wheel slot holding the timer, None once fired or cancelled
+
+    @property
+    def active(self):
+        return self.bucket is not None
+
+    def remaining(self):
+        """Seconds left before the callback runs"""
+        return max(0.0, (self.expires - TimerWheel._tick) * TimerWheel.TICK)
+
+    def cancel(self):
+        """Cancel the timer, returns False if it already fired or was cancelled"""
+        if self.bucket is None:
+            return False
+        self.bucket.discard(self)
+        self.bucket = None
+        TimerWheel._pending -= 1
+        return True
+
+
+class TimerWheel:
+    """Hierarchical timer wheel for game and matchmaking deadlines.
+
+    One driver task advances the wheel every TICK instead of one sleeping
+    coroutine per deadline. Scheduling and cancelling are O(1), timers on
+    the upper levels are cascaded down as their slot comes up.
+    """
+
+    TICK = 0.1	# seconds per tick of the lowest level
+    SLOT_BITS = 6	# 64 slots per level
+    LEVELS = 3	# 6.4 s, ~7 min and ~7 h of range, longer delays are cascaded again
+
+    _wheels = [[set() for _ in range(64)] for _ in range(3)]	# [level][slot] -> set of Timer
+    _tick = 0	# current tick, the wheel is in sync with the loop clock while timers are pending
+    _origin = None	# loop time of tick 0
+    _pending = 0
+    _driver_task = None
+
+    @staticmethod
+    def _current_tick():
+        loop = asyncio.get_event_loop()
+        if TimerWheel._origin is None:
+            TimerWheel._origin = loop.time()
+        return int((loop.time() - TimerWheel._origin) / TimerWheel.TICK)
+
+    @staticmethod
+    def schedule(delay, callback, *args, name=None):
+        """Run the coroutine function callback(*args) after delay seconds, returns a Timer"""
+        if TimerWheel._pending == 0:
+            TimerWheel._tick = TimerWheel._current_tick()	# nothing to fire in between, skip idle ticks
+        ticks = max(1, math.ceil(delay / TimerWheel.TICK))
+        timer = Timer(TimerWheel._tick + ticks, callback, args, name or getattr(callback, "__name__", "timer"))
+        TimerWheel._place(timer)
+        TimerWheel._pending += 1
+
+        task = TimerWheel._driver_task
+        if task is None or task.done():
+            TimerWheel._driver_task = asyncio.create_task(TimerWheel._drive())
+        return timer
+
+    @staticmethod
+    def _place(timer):
+        """Put a timer in the slot of the lowest level that covers its expiry"""
+        bits = TimerWheel.SLOT_BITS
+        mask = (1 << bits) - 1
+        delta = timer.expires - TimerWheel._tick
+        for level in range(TimerWheel.LEVELS):
+            if delta < 1 << (bits * (level + 1)) or level == TimerWheel.LEVELS - 1:
+                expires = timer.expires
+                if level == TimerWheel.LEVELS - 1 and delta >= 1 << (bits * TimerWheel.LEVELS):
+                    # Out of range, park it in the farthest slot and place it again when cascaded
+                    expires = TimerWheel._tick + (1 << (bits * TimerWheel.LEVELS)) - 1
+                bucket = TimerWheel._wheels[level][(expires >> (bits * level)) & mask]
+                bucket.add(timer)
+                timer.bucket = bucket
+                return
+
+    @staticmethod
+    def _cascade(level):
+        """Move the timers of the current slot of a level to the lower levels"""
+        bits = TimerWheel.SLOT_BITS
+        bucket = TimerWheel._wheels[level][(TimerWheel._tick >> (bits * level)) & ((1 << bits) - 1)]
+        timers = list(bucket)
+        bucket.clear()
+        for timer in timers:
+            TimerWheel._place(timer)
+
+    @staticmethod
+    def _advance():
+        """Advance one tick and return the timers that expire on it"""
+        TimerWheel._tick += 1
+        bits = TimerWheel.SLOT_BITS
+        mask = (1 << bits) - 1
+        # When a level wraps, bring down the next slot of the level above (highest first)
+        wrapped = 0
+        while wrapped < TimerWheel.LEVELS - 1 and (TimerWheel._tick >> (bits * wrapped)) & mask == 0:
+            wrapped += 1
+        for level in range(wrapped, 0, -1):
+            TimerWheel._cascade(level)
+
+        bucket = TimerWheel._wheels[0][TimerWheel._tick & mask]
+        expired = list(bucket)
+        bucket.clear()
+        for timer in expired:
+            timer.bucket = None
+        TimerWheel._pending -= len(expired)
+        return expired
+
+    @staticmethod
+    async def _drive():
+        """Advance the wheel with the loop clock while timers are pending"""
+        while TimerWheel._pending:
+            await asyncio.sleep(TimerWheel.TICK)
+            target = TimerWheel._current_tick()
+            while TimerWheel._tick < target and TimerWheel._pending:
+                for timer in TimerWheel._advance():
+                    asyncio.create_task(TimerWheel._fire(timer))
+
+    @staticmethod
+    async def _fire(timer):
+        try:
+            await timer.callback(*timer.args)
+        except Exception as e:
+            logger.error(f"Error in timer {timer.name}: {str(e)}")
+
+    @staticmethod
+    def snapshot():
+        """Pending timers per name, for the staff metrics endpoint"""
+        by_name = Counter(timer.name for level in TimerWheel._wheels for bucket in level for timer in bucket)
+        return {"pending": TimerWheel._pending, "by_name": dict(by_name), "tick_seconds": TimerWheel.TICK}
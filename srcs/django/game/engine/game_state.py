@@ -40,6 +40,7 @@ class GameState:
         self.status = "waiting"  # Initial game status
         self.countdown = 3
         self.countdown_active = False
+        self.latency = {"left": None, "right": None}  # Smoothed RTT (ms) of each player, for lag compensation
 
         self.collision_manager = CollisionManager(self)  # Initialize collision manager
         self.score_manager = ScoreManager(self)  # Initialize score manager
@@ -83,6 +84,42 @@ class GameState:
         )
         # print(f"Ball position reset to: ({self.ball.x}, {self.ball.y})")  # Debug
 
+    def to_snapshot(self):
+        """Full state needed to resume the game in another process (see GameMigration)"""
+        return {
+            "ball": {
+                "x": self.ball.x,
+                "y": self.ball.y,
+                "speed_x": self.ball.speed_x,
+                "speed_y": self.ball.speed_y,
+                "base_speed": self.ball.base_speed,
+            },
+            "paddles": {
+                side: {"y": paddle.y, "score": paddle.score, "speed": paddle.speed}
+                for side, paddle in self.paddles.items()
+            },
+            "status": self.status,
+            "latency": self.latency,
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """Rebuild a game state from to_snapshot() output"""
+        state = cls()
+        ball = snapshot["ball"]
+        state.ball.x, state.ball.y = ball["x"], ball["y"]
+        state.ball.prev_x, state.ball.prev_y = ball["x"], ball["y"]
+        state.ball.speed_x, state.ball.speed_y = ball["speed_x"], ball["speed_y"]
+        state.ball.base_speed = ball["base_speed"]
+        for side, data in snapshot["paddles"].items():
+            paddle = state.paddles[side]
+            paddle.score = data["score"]
+            paddle.speed = data["speed"]
+            paddle.reset_state(y=data["y"])
+        state.status = snapshot["status"]
+        state.latency = snapshot.get("latency", state.latency)
+        return state
+
     def serialize(self):
         """Serializes the game state"""
         current_state = {
@@ -109,6 +146,7 @@ class GameState:
             },
             "status": self.status,
             "canvas": {"width": self.CANVAS_WIDTH, "height": self.CANVAS_HEIGHT},
+            "latency": self.latency,
         }
 
         if self.countdown_active:
@@ -19,6 +19,7 @@ class Game(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
         related_name="games_as_player1",
+        null=True,	# Player1 is null while the game is a pre-provisioned slot (POOLED)
     )
     # Player2 is who joined the game
     player2 = models.ForeignKey(
@@ -40,6 +41,7 @@ class Game(models.Model):
     status = models.CharField(
         max_length=20,
         choices=[
+            ("POOLED", "Pre-provisioned slot"),
             ("WAITING", "Waiting for players"),
             ("MATCHED", "Matched"),
             ("PLAYING", "In progress"),
@@ -0,0 +1,19 @@
+from game.consumers.utils.persistence_queue import PersistenceQueue
+from celery import shared_task
+import logging
+
+logger = logging.getLogger(__name__)
+
+@shared_task # Decorator to make this a Celery task
+def replay_game_spill():
+    """
+    Celery task to write the game records spilled to Redis during a database outage
+    This task runs according to GAME_SPILL_REPLAY_INTERVAL (in settings.py)
+    """
+    try:
+        replayed = PersistenceQueue.replay_spill()
+        if replayed:
+            logger.info(f"✅ Replayed {replayed} spilled game records")
+    except Exception as e:
+        logger.error(f"❌ Could not replay spilled game records: {str(e)}")
+        raise
@@ -0,0 +1,114 @@
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from game.consumers.utils.persistence_queue import PersistenceQueue
+from game.consumers.utils.timer_wheel import TimerWheel
+from game.models import Game
+
+
+class TimerWheelTests(SimpleTestCase):
+    """The wheel is advanced by hand, the driver task is cancelled as soon as it starts"""
+
+    def setUp(self):
+        TimerWheel._wheels = [[set() for _ in range(64)] for _ in range(TimerWheel.LEVELS)]
+        TimerWheel._tick = 0
+        TimerWheel._origin = None
+        TimerWheel._pending = 0
+        TimerWheel._driver_task = None
+
+    def tearDown(self):
+        if TimerWheel._driver_task:
+            TimerWheel._driver_task.cancel()
+
+    def schedule(self, delay, name):
+        timer = TimerWheel.schedule(delay, self.fire, name=name)
+        TimerWheel._driver_task.cancel()
+        return timer
+
+    async def fire(self):
+        pass
+
+    def run_until(self, tick):
+        """Names of the expired timers with the tick they expired on"""
+        fired = []
+        while TimerWheel._tick < tick:
+            expired = TimerWheel._advance()
+            fired += [(TimerWheel._tick, timer.name) for timer in expired]
+        return fired
+
+    async def test_timers_fire_in_deadline_order_across_levels(self):
+        # Delays on every level of the wheel: level 0 covers 64 ticks (6.4 s), level 1 4096 ticks
+        delays = {"countdown": 3, "reconnect": 0.1, "ready": 30, "match": 6.5, "idle": 600, "cleanup": 500}
+        timers = {name: self.schedule(delay, name) for name, delay in delays.items()}
+
+        fired = self.run_until(6001)
+        self.assertEqual(
+            fired,
+            [(1, "reconnect"), (30, "countdown"), (65, "match"), (300, "ready"), (5000, "cleanup"), (6000, "idle")],
+        )
+        self.assertEqual(TimerWheel._pending, 0)
+        self.assertFalse(any(timer.active for timer in timers.values()))
+
+    async def test_timers_beyond_the_wheel_range_are_parked_and_fire_on_time(self):
+        far = 1 << (TimerWheel.SLOT_BITS * TimerWheel.LEVELS)	# first tick out of range
+        self.schedule((far + 10) * TimerWheel.TICK, "far")
+        self.schedule(1, "near")
+
+        fired = self.run_until(far + 10)
+        self.assertEqual(fired, [(10, "near"), (far + 10, "far")])
+
+    async def test_cancelled_timer_does_not_fire(self):
+        kept = self.schedule(2, "kept")
+        cancelled = self.schedule(1, "cancelled")
+        self.assertTrue(cancelled.cancel())
+        self.assertFalse(cancelled.cancel())
+        self.assertEqual(TimerWheel._pending, 1)
+
+        self.assertEqual(self.run_until(20), [(20, "kept")])
+        self.assertFalse(kept.active)
+
+
+class PersistenceQueueApplyTests(TestCase):
+
+    def setUp(self):
+        User = get_user_model()
+        self.player1 = User.objects.create_user(username="persist_p1", password="x")
+        self.player2 = User.objects.create_user(username="persist_p2", password="x")
+        self.game = Game.objects.create(player1=self.player1, player2=self.player2, status="PLAYING")
+
+    def score(self, score1, score2):
+        return {self.game.id: {"score_player1": score1, "score_player2": score2}}
+
+    def result(self, winner, score1, score2):
+        return {self.game.id: {
+            "winner_id": winner.id,
+            "score_player1": score1,
+            "score_player2": score2,
+            "finished_at": timezone.now().isoformat(),
+        }}
+
+    def test_score_of_a_game_in_progress_is_written(self):
+        PersistenceQueue._apply(self.score(2, 1), {})
+        self.game.refresh_from_db()
+        self.assertEqual((self.game.score_player1, self.game.score_player2), (2, 1))
+        self.assertEqual(self.game.status, "PLAYING")
+
+    def test_stale_score_does_not_overwrite_a_finished_game(self):
+        PersistenceQueue._apply({}, self.result(self.player1, 5, 3))
+        PersistenceQueue._apply(self.score(2, 1), {})	# a spilled score replayed after the result
+        self.game.refresh_from_db()
+        self.assertEqual((self.game.score_player1, self.game.score_player2), (5, 3))
+        self.assertEqual(self.game.status, "FINISHED")
+        self.assertEqual(self.game.winner_id, self.player1.id)
+
+    def test_stale_score_does_not_overwrite_a_game_finished_elsewhere(self):
+        Game.objects.filter(id=self.game.id).update(status="FINISHED", winner=self.player2, score_player1=0, score_player2=5)
+        PersistenceQueue._apply(self.score(3, 4), {})
+        self.game.refresh_from_db()
+        self.assertEqual((self.game.score_player1, self.game.score_player2), (0, 5))
+
+    def test_result_wins_over_a_score_of_the_same_batch(self):
+        PersistenceQueue._apply(self.score(2, 1), self.result(self.player2, 4, 5))
+        self.game.refresh_from_db()
+        self.assertEqual((self.game.score_player1, self.game.score_player2), (4, 5))
+        self.assertEqual(self.game.winner_id, self.player2.id)
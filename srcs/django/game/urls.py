@@ -1,4 +1,4 @@
-from .views import GameModesView, MatchmakingView, GameView
+from .views import GameModesView, MatchmakingView, GameView, matchmaking_metrics_view, drain_worker_view
 from django.urls import path
 
 app_name = "game"
@@ -6,5 +6,7 @@ app_name = "game"
 urlpatterns = [
     path("", GameModesView.as_view(), name="game_modes_view"),
     path("matchmaking/", MatchmakingView.as_view(), name="matchmaking_view"),
+    path("matchmaking/metrics/", matchmaking_metrics_view, name="matchmaking_metrics"),
+    path("drain/", drain_worker_view, name="drain_worker"),
     path("game/<int:game_id>/", GameView.as_view(), name="game_view"),
 ]
\ No newline at end of file
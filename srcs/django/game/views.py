@@ -1,7 +1,16 @@
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import login_required
+from .consumers.utils.matchmaking_metrics import MatchmakingMetrics
+from .consumers.utils.timer_wheel import TimerWheel
+from .consumers.utils.broadcast_batcher import BroadcastBatcher
+from .consumers.utils.game_migration import GameMigration
+from .consumers.shared_state import registry
+from django.views.decorators.http import require_POST
+from asgiref.sync import async_to_sync
 from django.utils.decorators import method_decorator
 from django.contrib.auth import get_user_model
 from django.shortcuts import render, redirect
+from django.http import JsonResponse
 from django.views import View
 from .models import Game
 
@@ -36,7 +45,7 @@ class GameView(View):
         else:  # If there's a game ID...
             try:
                 game = Game.objects.get(id=game_id)  # Extract the game ID
-                if game.status == "FINISHED":  # If game is finished...
+                if game.status in ("FINISHED", "POOLED"):  # If game is finished or is still an empty slot...
                     return redirect("game:game_modes_view")  # ...redirect to game modes selection
                 elif game.status == "WAITING":  # If game is waiting for players...
                     return redirect("game:matchmaking_view")  # ...redirect to matchmaking
@@ -48,3 +57,19 @@ class GameView(View):
             "game/game.html",
             {"game_id": game.id, "user_id": request.user.id},  # Render the game template
         )
+
+@staff_member_required
+def matchmaking_metrics_view(request):
+    """Matchmaking telemetry, pending timers and broadcast batching of this worker process in JSON format"""
+    metrics = MatchmakingMetrics.snapshot(async_to_sync(registry.queue_entries)())
+    metrics["timers"] = TimerWheel.snapshot()
+    metrics["broadcast"] = BroadcastBatcher.snapshot()
+    return JsonResponse(metrics)
+
+@staff_member_required
+@require_POST
+def drain_worker_view(request):
+    """Put this worker in drain mode before a restart, its live games are handed off to other workers"""
+    # Runs on the event loop of the worker, where the games live
+    migrated = async_to_sync(GameMigration.drain)()
+    return JsonResponse({"draining": True, "migrated_games": migrated})
@@ -0,0 +1,17 @@
+from django.conf import settings
+import redis.asyncio as aioredis
+import redis
+
+# Redis clients of the project, every module connects through these (settings.REDIS_URL)
+# Clients are not cached here: async clients are bound to the event loop that uses them,
+# so each module keeps its own (and registers its scripts on it)
+
+
+def get_redis():
+    """Synchronous client (Celery tasks, services, threads)"""
+    return redis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
+
+
+def get_async_redis():
+    """asyncio client (consumers)"""
+    return aioredis.Redis.from_url(settings.REDIS_URL, decode_responses=True)
@@ -117,15 +117,43 @@ TEMPLATES = [
 # It is a specification for communication between web servers and web applications or web application frameworks
 ASGI_APPLICATION = "main.asgi.application"
 
+# Redis used by the channel layer, Celery and every module (main/redis_connection.py)
+REDIS_URL = os.environ.get("REDIS_URL", "redis://redis:6379/0")
+
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
         "CONFIG": {
-            "hosts": [("redis", 6379)],
+            "hosts": [REDIS_URL],
         },
     },
 }
 
+# Backend of the game registries (connected players, matchmaking queue, game seats)
+# "memory" for a single daphne process, "redis" to share them between several workers
+GAME_REGISTRY_BACKEND = os.environ.get("GAME_REGISTRY_BACKEND", "memory")
+
+# Seconds without ping before a game/matchmaking socket is considered dead and closed
+# (the clients ping every 2-5 seconds)
+GAME_HEARTBEAT_TTL = int(os.environ.get("GAME_HEARTBEAT_TTL", 30))
+
+# Outbound queue of each game socket: frames kept for a slow client, seconds a frame may wait
+# and what to do with a client that stays behind ("drop" its frames or "disconnect" it)
+GAME_OUTBOUND_QUEUE_SIZE = int(os.environ.get("GAME_OUTBOUND_QUEUE_SIZE", 64))
+GAME_SLOW_CLIENT_LAG = float(os.environ.get("GAME_SLOW_CLIENT_LAG", 2))
+GAME_SLOW_CLIENT_POLICY = os.environ.get("GAME_SLOW_CLIENT_POLICY", "drop")
+
+# Seconds between two replays of the game records spilled to Redis (game.tasks.replay_game_spill)
+GAME_SPILL_REPLAY_INTERVAL = int(os.environ.get("GAME_SPILL_REPLAY_INTERVAL", 60))
+
+# Chat archival (chat.tasks.archive_old_messages): messages older than the retention window are
+# moved to ArchivedMessage in batches, with a pause between batches and a time budget per run
+CHAT_RETENTION_DAYS = int(os.environ.get("CHAT_RETENTION_DAYS", 30))
+CHAT_ARCHIVE_BATCH_SIZE = int(os.environ.get("CHAT_ARCHIVE_BATCH_SIZE", 5000))
+CHAT_ARCHIVE_THROTTLE = float(os.environ.get("CHAT_ARCHIVE_THROTTLE", 0.5))
+CHAT_ARCHIVE_MAX_SECONDS = int(os.environ.get("CHAT_ARCHIVE_MAX_SECONDS", 120))
+CHAT_ARCHIVE_INTERVAL = 3600  # 1 hour (Celery)
+
 # Database configuration
 DATABASES = {
     "default": {
@@ -200,8 +228,8 @@ SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 SESSION_COOKIE_AGE = INACTIVITY_THRESHOLD * 2  # Double the inactivity threshold
 
 # Celery Configuration
-CELERY_BROKER_URL = 'redis://redis:6379/0'
-CELERY_RESULT_BACKEND = 'redis://redis:6379/0'
+CELERY_BROKER_URL = REDIS_URL
+CELERY_RESULT_BACKEND = REDIS_URL
 CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
@@ -243,6 +271,14 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'authentication.tasks.cleanup_inactive_users',
         'schedule': TASK_CHECK_INTERVAL,
     },
+    'replay-game-spill': {
+        'task': 'game.tasks.replay_game_spill',
+        'schedule': GAME_SPILL_REPLAY_INTERVAL,
+    },
+    'archive-old-messages': {
+        'task': 'chat.tasks.archive_old_messages',
+        'schedule': CHAT_ARCHIVE_INTERVAL,
+    },
 }
 
 # Encryption key settings for GDPR compliance
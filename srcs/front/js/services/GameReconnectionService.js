@@ -9,6 +9,10 @@ class GameReconnectionService {
 		this.RECONNECT_INTERVAL = 2000; // ms
 		this.lastMessageTime = Date.now(); // time from the last message received by the server
 		this._lastStopCommandTime = 0; // Last stop command time to avoid jitter
+		this.pingInterval = null;
+		this.lastRtt = null; // Last measured round trip time (ms), reported to the server in the next ping
+		this.migrating = false; // The server is draining and moved the game to another worker
+		this.MIGRATION_RECONNECT_DELAY = 200; // ms
 	}
 
 	// Config websockets connection for game with fast reconnect
@@ -41,6 +45,7 @@ class GameReconnectionService {
 
 			this.socket.onopen = () => {
 				console.log('WebSocket connection established');
+				this.startPing();
 
 				if (this.callbacks.onOpen) {
 					this.callbacks.onOpen(this.reconnecting);
@@ -81,6 +86,20 @@ class GameReconnectionService {
 				try {
 					const data = JSON.parse(event.data);
 
+					// Measure latency with the pong
+					if (data.type === 'pong') {
+						if (data.client_timestamp) {
+							this.lastRtt = Date.now() - data.client_timestamp;
+						}
+						return;
+					}
+
+					// The server is about to close this connection, reconnect right away when it does
+					if (data.type === 'fast_reconnect' && data.reason === 'migration') {
+						this.migrating = true;
+						return;
+					}
+
 					// Handle fast reconnect response and game state
 					if (data.type === 'fast_state') {
 						this.handleFastReconnect(data);
@@ -99,6 +118,7 @@ class GameReconnectionService {
 
 			this.socket.onclose = (event) => {
 				console.log('Connection closed', event.code, event.reason);
+				this.stopPing();
 
 				// Handle disconnection if not a normal close event (like page unload)
 				if (event.code !== 1000) {
@@ -129,7 +149,13 @@ class GameReconnectionService {
 		}
 
 		this.reconnecting = true;
-		this.reconnectAttempts++;
+		// A migration is not a failure, it doesn't use up reconnection attempts
+		const delay = this.migrating ? this.MIGRATION_RECONNECT_DELAY : this.RECONNECT_INTERVAL;
+		if (this.migrating) {
+			this.migrating = false;
+		} else {
+			this.reconnectAttempts++;
+		}
 
 		if (this.callbacks.onDisconnect) {
 			this.callbacks.onDisconnect(this.reconnectAttempts, this.MAX_RECONNECT_ATTEMPTS);
@@ -141,7 +167,7 @@ class GameReconnectionService {
 				console.log(`Attempting to reconnect (${this.reconnectAttempts}/${this.MAX_RECONNECT_ATTEMPTS})`);
 				this.setupConnection(this.gameId, this.callbacks);
 			}
-		}, this.RECONNECT_INTERVAL);
+		}, delay);
 	}
 
 	// Handle fast reconnect response
@@ -291,8 +317,30 @@ class GameReconnectionService {
 		}
 	}
 
+	// Send a ping every 5 seconds with the last measured RTT
+	startPing() {
+		this.stopPing();
+		this.pingInterval = setInterval(() => {
+			if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+				this.socket.send(JSON.stringify({
+					type: 'ping',
+					timestamp: Date.now(),
+					rtt: this.lastRtt
+				}));
+			}
+		}, 5000);
+	}
+
+	stopPing() {
+		if (this.pingInterval) {
+			clearInterval(this.pingInterval);
+			this.pingInterval = null;
+		}
+	}
+
 	// close the socket connection
 	disconnect() {
+		this.stopPing();
 		if (this.socket) {
 			try {
 				if (this.socket.readyState === WebSocket.OPEN ||
@@ -6,6 +6,8 @@ class GameWebSocketService {
         this.socket = null;
         this.statusCallback = null;
         this.isSearching = false;
+        this.pingInterval = null;
+        this.lastRtt = null; // Último RTT medido (ms), se informa al servidor en el siguiente ping
     }
 
     async setupConnection(statusCallback) {
@@ -30,6 +32,7 @@ class GameWebSocketService {
         this.socket = new WebSocket(wsUrl);
         
         this.socket.onopen = () => {
+            this.startPing();
             
             // Si estaba buscando partida, reanudar búsqueda
             if (this.isSearching) {
@@ -46,6 +49,14 @@ class GameWebSocketService {
         this.socket.onmessage = (event) => {
             try {
                 const data = JSON.parse(event.data);
+                
+                // Medir latencia con la respuesta al ping
+                if (data.type === 'pong') {
+                    if (data.timestamp) {
+                        this.lastRtt = Date.now() - data.timestamp;
+                    }
+                    return;
+                }
                 console.log('📩 Mensaje recibido:', data);
                 
                 // Si el mensaje tiene type, lo procesamos primero
@@ -82,6 +93,7 @@ class GameWebSocketService {
         };
 
         this.socket.onclose = (event) => {
+            this.stopPing();
             // Si estaba buscando y se cierra la conexión, intentar reconectar
             if (this.isSearching) {
                 console.log('🔄 Reconectando...');
@@ -143,6 +155,26 @@ class GameWebSocketService {
         }
     }
 
+    startPing() {
+        this.stopPing();
+        this.pingInterval = setInterval(() => {
+            if (this.socket?.readyState === WebSocket.OPEN) {
+                this.socket.send(JSON.stringify({
+                    type: 'ping',
+                    timestamp: Date.now(),
+                    rtt: this.lastRtt
+                }));
+            }
+        }, 2000);
+    }
+
+    stopPing() {
+        if (this.pingInterval) {
+            clearInterval(this.pingInterval);
+            this.pingInterval = null;
+        }
+    }
+
     updateStatus(message) {
         if (this.statusCallback) {
             this.statusCallback(message);
@@ -153,6 +185,7 @@ class GameWebSocketService {
         console.log('Desconectando del matchmaking...');
         this.isSearching = false;
         localStorage.removeItem('matchmaking_active');
+        this.stopPing();
         
         if (this.socket) {
             try {
@@ -5,6 +5,8 @@ class WebSocketService {
         this.keepAliveInterval = null;
         this.messageQueue = [];
         this.isConnecting = false;
+        this.lastSeq = {}; // Último número de secuencia recibido por canal, para sincronizar al reconectar
+        this.onlineUsers = new Map(); // Usuarios online por id, la lista completa más los cambios recibidos
     }
 
     async connect(roomName = 'general') {
@@ -14,7 +16,9 @@ class WebSocketService {
         return new Promise((resolve, reject) => {
             const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
             const host = window.location.host;
-            const wsUrl = `${protocol}//${host}/ws/chat/${roomName}/`;
+            // Si ya tenemos mensajes, el servidor no reenvía el historial y esperamos a pedir solo lo que falta
+            const resume = Object.keys(this.lastSeq).length > 0;
+            const wsUrl = `${protocol}//${host}/ws/chat/${roomName}/${resume ? '?resume=1' : ''}`;
 
             try {
                 // Añadir opciones para el WebSocket
@@ -37,6 +41,14 @@ class WebSocketService {
 
                 this.socket.onopen = () => {
                     this.isConnecting = false;
+
+                    // Pedir solo los mensajes posteriores a los que ya tenemos
+                    if (resume) {
+                        this.send({
+                            type: 'sync',
+                            channels: { ...this.lastSeq }
+                        });
+                    }
                     
                     // Solicitar lista de usuarios online al conectar
                     this.send({
@@ -54,8 +66,20 @@ class WebSocketService {
                 this.socket.onmessage = (event) => {
                     try {
                         const data = JSON.parse(event.data);
+                        this.trackSequence(data);
                         const listeners = this.listeners.get(data.type) || [];
                         listeners.forEach(callback => callback(data));
+                        this.trackPresence(data);
+
+                        // El historial llega en un solo frame por canal, la primera página se
+                        // entrega como chat_message para que las vistas lo pinten como siempre
+                        if (data.type === 'channel_history' && data.initial) {
+                            const chatListeners = this.listeners.get('chat_message') || [];
+                            data.messages.forEach(message => {
+                                const chatMessage = { type: 'chat_message', ...message };
+                                chatListeners.forEach(callback => callback(chatMessage));
+                            });
+                        }
                     } catch (error) {
                         console.error('Error parsing message:', error);
                     }
@@ -90,6 +114,42 @@ class WebSocketService {
         }
         // Limpiar listeners
         this.listeners.clear();
+        this.lastSeq = {};
+        this.onlineUsers.clear();
+    }
+
+    // Guarda el último seq visto de cada canal (mensajes en vivo e historial)
+    trackSequence(data) {
+        const messages = data.type === 'chat_message' ? [data]
+            : data.type === 'channel_history' ? data.messages : [];
+        messages.forEach(message => {
+            if (Number.isInteger(message.seq)) {
+                const last = this.lastSeq[message.channel_name] || 0;
+                this.lastSeq[message.channel_name] = Math.max(last, message.seq);
+            }
+        });
+    }
+
+    // El servidor solo envía la lista completa cuando se pide, después llegan user_online/user_offline.
+    // Se aplican a la lista y se entrega como user_list a las vistas que solo escuchan la lista
+    trackPresence(data) {
+        if (data.type === 'user_list') {
+            this.onlineUsers = new Map(data.users.map(user => [parseInt(user.id), user]));
+            return;
+        }
+        if (data.type === 'user_online') {
+            this.onlineUsers.set(parseInt(data.user_id), {
+                id: data.user_id,
+                username: data.username,
+                is_online: true
+            });
+        } else if (data.type === 'user_offline') {
+            this.onlineUsers.delete(parseInt(data.user_id));
+        } else {
+            return;
+        }
+        const userList = { type: 'user_list', users: [...this.onlineUsers.values()] };
+        (this.listeners.get('user_list') || []).forEach(callback => callback(userList));
     }
 
     send(message) {
@@ -127,6 +187,15 @@ class WebSocketService {
         this.socket.send(JSON.stringify(formattedMessage));
     }
 
+    // Pide la página anterior de un canal, "before" es el cursor recibido en channel_history
+    requestChannelHistory(channelName, before) {
+        this.send({
+            type: 'request_channel_history',
+            channel_name: channelName,
+            before: before
+        });
+    }
+
     startKeepAlive() {
         this.keepAliveInterval = setInterval(() => {
             if (this.socket && this.socket.readyState === WebSocket.OPEN) {